@@ -0,0 +1,31 @@
+"""sku e hash di riga sui prodotti per l'import dei listini
+
+Revision ID: 0c5e8b3d9a71
+Revises: f3a9d27c6b18
+Create Date: 2025-10-15 15:06:48.902113
+
+Il listino di un fornitore identifica i prodotti per SKU (o per nome se manca);
+hash_riga permette di saltare le righe uguali all'import precedente.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0c5e8b3d9a71'
+down_revision = 'f3a9d27c6b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('prodotti', sa.Column('sku', sa.String(), nullable=True))
+    op.add_column('prodotti', sa.Column('hash_riga', sa.String(), nullable=True))
+    op.create_index('uq_prodotti_fornitore_sku', 'prodotti', ['fornitore_id', 'sku'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_prodotti_fornitore_sku', table_name='prodotti')
+    with op.batch_alter_table('prodotti') as batch_op:
+        batch_op.drop_column('hash_riga')
+        batch_op.drop_column('sku')
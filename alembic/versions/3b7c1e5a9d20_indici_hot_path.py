@@ -0,0 +1,83 @@
+"""indici hot path ordini, righe e visibilità
+
+Revision ID: 3b7c1e5a9d20
+Revises: 98df5dd1d4f9
+Create Date: 2025-10-06 09:41:03.552190
+
+Indici sulle colonne filtrate da carrello, storico admin e job di invio,
+più l'indice unico parziale che garantisce un solo carrello aperto per
+(utente, ristorante).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7c1e5a9d20'
+down_revision = '98df5dd1d4f9'
+branch_labels = None
+depends_on = None
+
+
+def _unisci_carrelli_duplicati():
+    # Prima del carrello incrementale potevano esistere più ordini aperti
+    # per la stessa coppia (utente, ristorante): li uniamo nel più recente,
+    # altrimenti l'indice unico non si può creare.
+    conn = op.get_bind()
+    gruppi = conn.execute(sa.text(
+        "SELECT user_id, ristorante_id, MAX(id) FROM ordini "
+        "WHERE inviato = :no GROUP BY user_id, ristorante_id HAVING COUNT(*) > 1"
+    ), {"no": False}).fetchall()
+    for user_id, ristorante_id, tieni in gruppi:
+        params = {"u": user_id, "r": ristorante_id, "tieni": tieni, "no": False}
+        vecchi = "SELECT id FROM ordini WHERE user_id = :u AND ristorante_id = :r AND inviato = :no AND id <> :tieni"
+        conn.execute(sa.text(f"UPDATE order_items SET ordine_id = :tieni WHERE ordine_id IN ({vecchi})"), params)
+        conn.execute(sa.text(f"DELETE FROM ordini WHERE id IN ({vecchi})"), params)
+        # Lo stesso prodotto può ora comparire su più righe del carrello: come faceva
+        # agglomera_ordini, una sola riga (la più vecchia, col suo prezzo) con le
+        # quantità sommate. Il carrello incrementale si aspetta una riga per prodotto.
+        prime = (
+            "SELECT MIN(id) FROM order_items WHERE ordine_id = :tieni "
+            "AND prodotto_id IS NOT NULL GROUP BY prodotto_id"
+        )
+        conn.execute(sa.text(
+            "UPDATE order_items SET quantita = (SELECT SUM(d.quantita) FROM order_items d "
+            "WHERE d.ordine_id = order_items.ordine_id AND d.prodotto_id = order_items.prodotto_id) "
+            f"WHERE id IN ({prime} HAVING COUNT(*) > 1)"
+        ), {"tieni": tieni})
+        conn.execute(sa.text(
+            "DELETE FROM order_items WHERE ordine_id = :tieni "
+            f"AND prodotto_id IS NOT NULL AND id NOT IN ({prime})"
+        ), {"tieni": tieni})
+        conn.execute(sa.text(
+            "UPDATE ordini SET totale = (SELECT COALESCE(SUM(quantita * prezzo_unitario), 0) "
+            "FROM order_items WHERE ordine_id = :tieni) WHERE id = :tieni"
+        ), {"tieni": tieni})
+
+
+def upgrade():
+    _unisci_carrelli_duplicati()
+
+    op.create_index(
+        'uq_ordini_carrello_aperto', 'ordini', ['user_id', 'ristorante_id'],
+        unique=True,
+        sqlite_where=sa.text('inviato = 0'),
+        postgresql_where=sa.text('inviato = false'),
+    )
+    op.create_index('ix_ordini_user_ristorante_inviato', 'ordini', ['user_id', 'ristorante_id', 'inviato'])
+    op.create_index(
+        'ix_ordini_ristorante_inviato_data', 'ordini',
+        ['ristorante_id', 'inviato', sa.text('data_ordine DESC')],
+    )
+    op.create_index('ix_order_items_ordine_prodotto', 'order_items', ['ordine_id', 'prodotto_id'])
+    op.create_index('ix_order_items_prodotto_id', 'order_items', ['prodotto_id'])
+    op.create_index('ix_product_visibility_prodotto_id', 'product_visibility', ['prodotto_id'])
+
+
+def downgrade():
+    op.drop_index('ix_product_visibility_prodotto_id', table_name='product_visibility')
+    op.drop_index('ix_order_items_prodotto_id', table_name='order_items')
+    op.drop_index('ix_order_items_ordine_prodotto', table_name='order_items')
+    op.drop_index('ix_ordini_ristorante_inviato_data', table_name='ordini')
+    op.drop_index('ix_ordini_user_ristorante_inviato', table_name='ordini')
+    op.drop_index('uq_ordini_carrello_aperto', table_name='ordini')
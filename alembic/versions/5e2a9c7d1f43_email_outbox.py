@@ -0,0 +1,50 @@
+"""outbox email con tentativi e stato per messaggio
+
+Revision ID: 5e2a9c7d1f43
+Revises: c41f0a6e2b87
+Create Date: 2025-10-10 09:41:03.512877
+
+I messaggi del job di invio vengono scritti qui nella stessa transazione che
+segna gli ordini come inviati; il worker di app/outbox.py li spedisce.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2a9c7d1f43'
+down_revision = 'c41f0a6e2b87'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('chiave', sa.String(), nullable=False),
+        sa.Column('ordine_id', sa.Integer(), sa.ForeignKey('ordini.id'), nullable=True),
+        sa.Column('destinatario', sa.String(), nullable=False),
+        sa.Column('mittente', sa.String(), nullable=True),
+        sa.Column('oggetto', sa.String(), nullable=False),
+        sa.Column('corpo', sa.Text(), nullable=False),
+        sa.Column('stato', sa.String(), nullable=False),
+        sa.Column('tentativi', sa.Integer(), nullable=False),
+        sa.Column('prossimo_tentativo', sa.DateTime(), nullable=False),
+        sa.Column('ultimo_errore', sa.Text(), nullable=True),
+        sa.Column('lotto', sa.String(), nullable=True),
+        sa.Column('creata_il', sa.DateTime(), nullable=False),
+        sa.Column('inviata_il', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('chiave'),
+    )
+    op.create_index('ix_email_outbox_id', 'email_outbox', ['id'])
+    op.create_index('ix_email_outbox_stato_prossimo', 'email_outbox', ['stato', 'prossimo_tentativo'])
+    op.create_index('ix_email_outbox_lotto', 'email_outbox', ['lotto'])
+
+
+def downgrade():
+    op.drop_index('ix_email_outbox_lotto', table_name='email_outbox')
+    op.drop_index('ix_email_outbox_stato_prossimo', table_name='email_outbox')
+    op.drop_index('ix_email_outbox_id', table_name='email_outbox')
+    op.drop_table('email_outbox')
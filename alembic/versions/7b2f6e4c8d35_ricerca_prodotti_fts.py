@@ -0,0 +1,49 @@
+"""indice full-text FTS5 su nome e descrizione dei prodotti
+
+Revision ID: 7b2f6e4c8d35
+Revises: 0c5e8b3d9a71
+Create Date: 2025-10-16 08:55:21.470912
+
+Tabella virtuale prodotti_fts (external content su prodotti) con trigger di
+allineamento e prefissi indicizzati per l'autocompletamento. Solo SQLite: sugli
+altri database la ricerca ripiega su LIKE (vedi app/ricerca.py).
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7b2f6e4c8d35'
+down_revision = '0c5e8b3d9a71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("""CREATE VIRTUAL TABLE prodotti_fts USING fts5(
+        nome, descrizione,
+        content='prodotti', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""")
+    op.execute("""CREATE TRIGGER prodotti_fts_ai AFTER INSERT ON prodotti BEGIN
+        INSERT INTO prodotti_fts(rowid, nome, descrizione) VALUES (new.id, new.nome, new.descrizione);
+    END""")
+    op.execute("""CREATE TRIGGER prodotti_fts_ad AFTER DELETE ON prodotti BEGIN
+        INSERT INTO prodotti_fts(prodotti_fts, rowid, nome, descrizione) VALUES ('delete', old.id, old.nome, old.descrizione);
+    END""")
+    op.execute("""CREATE TRIGGER prodotti_fts_au AFTER UPDATE OF nome, descrizione ON prodotti BEGIN
+        INSERT INTO prodotti_fts(prodotti_fts, rowid, nome, descrizione) VALUES ('delete', old.id, old.nome, old.descrizione);
+        INSERT INTO prodotti_fts(rowid, nome, descrizione) VALUES (new.id, new.nome, new.descrizione);
+    END""")
+    # indicizza i prodotti già presenti
+    op.execute("INSERT INTO prodotti_fts(prodotti_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    op.execute("DROP TRIGGER IF EXISTS prodotti_fts_au")
+    op.execute("DROP TRIGGER IF EXISTS prodotti_fts_ad")
+    op.execute("DROP TRIGGER IF EXISTS prodotti_fts_ai")
+    op.execute("DROP TABLE IF EXISTS prodotti_fts")
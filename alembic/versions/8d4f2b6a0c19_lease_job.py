@@ -0,0 +1,34 @@
+"""lease dei job schedulati
+
+Revision ID: 8d4f2b6a0c19
+Revises: 5e2a9c7d1f43
+Create Date: 2025-10-12 11:05:48.220914
+
+Con più worker uvicorn o più nodi lo scheduler parte in ogni processo: il
+lease su DB fa eseguire ogni batch a un solo processo.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d4f2b6a0c19'
+down_revision = '5e2a9c7d1f43'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'lease_job',
+        sa.Column('nome', sa.String(), nullable=False),
+        sa.Column('proprietario', sa.String(), nullable=True),
+        sa.Column('scadenza', sa.DateTime(), nullable=True),
+        sa.Column('ultimo_batch', sa.String(), nullable=True),
+        sa.Column('aggiornato_il', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('nome'),
+    )
+
+
+def downgrade():
+    op.drop_table('lease_job')
@@ -0,0 +1,161 @@
+"""schema iniziale
+
+Revision ID: 98df5dd1d4f9
+Revises:
+Create Date: 2025-09-20 10:12:44.318502
+
+Schema di partenza, già presente nei DB esistenti (sql_app.db è marcato
+con questa revisione): su un DB nuovo crea le tabelle originali.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '98df5dd1d4f9'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'registrazioni_pending',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('hashed_password', sa.String(), nullable=False),
+        sa.Column('ristorante_richiesto', sa.String(), nullable=False),
+        sa.Column('data_creazione', sa.DateTime(), nullable=True),
+        sa.Column('approvata', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_registrazioni_pending_id', 'registrazioni_pending', ['id'])
+    op.create_index('ix_registrazioni_pending_email', 'registrazioni_pending', ['email'], unique=True)
+
+    op.create_table(
+        'ristoranti',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nome', sa.String(), nullable=False),
+        sa.Column('abbonamento_attivo', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_ristoranti_id', 'ristoranti', ['id'])
+    op.create_index('ix_ristoranti_nome', 'ristoranti', ['nome'], unique=True)
+
+    op.create_table(
+        'ruoli',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nome', sa.String(), nullable=True),
+        sa.Column('ruolo', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('nome'),
+        sa.UniqueConstraint('ruolo'),
+    )
+    op.create_index('ix_ruoli_id', 'ruoli', ['id'])
+
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(), nullable=False),
+        sa.Column('hashed_password', sa.String(), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.Column('ristorante_richiesto', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+    op.create_index('ix_users_id', 'users', ['id'])
+
+    op.create_table(
+        'fornitori',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nome', sa.String(), nullable=False),
+        sa.Column('email', sa.String(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_fornitori_id', 'fornitori', ['id'])
+    op.create_index('ix_fornitori_nome', 'fornitori', ['nome'], unique=True)
+
+    op.create_table(
+        'user_ruoli',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('ruolo_id', sa.Integer(), sa.ForeignKey('ruoli.id'), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'ruolo_id'),
+    )
+    op.create_table(
+        'registrazione_ruoli',
+        sa.Column('registrazione_id', sa.Integer(), sa.ForeignKey('registrazioni_pending.id'), nullable=False),
+        sa.Column('ruolo_id', sa.Integer(), sa.ForeignKey('ruoli.id'), nullable=False),
+        sa.PrimaryKeyConstraint('registrazione_id', 'ruolo_id'),
+    )
+    op.create_table(
+        'user_ruoli_richiesti',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('ruolo_id', sa.Integer(), sa.ForeignKey('ruoli.id'), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'ruolo_id'),
+    )
+    op.create_table(
+        'user_ristoranti',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('ristorante_id', sa.Integer(), sa.ForeignKey('ristoranti.id'), nullable=False),
+        sa.PrimaryKeyConstraint('user_id', 'ristorante_id'),
+    )
+
+    op.create_table(
+        'prodotti',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('nome', sa.String(), nullable=False),
+        sa.Column('descrizione', sa.String(), nullable=True),
+        sa.Column('prezzo', sa.Float(), nullable=False),
+        sa.Column('immagine_url', sa.String(), nullable=True),
+        sa.Column('fornitore_id', sa.Integer(), sa.ForeignKey('fornitori.id'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_prodotti_id', 'prodotti', ['id'])
+    op.create_index('ix_prodotti_nome', 'prodotti', ['nome'])
+
+    op.create_table(
+        'ordini',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=True),
+        sa.Column('ristorante_id', sa.Integer(), sa.ForeignKey('ristoranti.id'), nullable=True),
+        sa.Column('data_ordine', sa.DateTime(), nullable=True),
+        sa.Column('totale', sa.Float(), nullable=False),
+        sa.Column('note', sa.String(), nullable=True),
+        sa.Column('inviato', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_ordini_id', 'ordini', ['id'])
+
+    op.create_table(
+        'product_visibility',
+        sa.Column('ristorante_id', sa.Integer(), sa.ForeignKey('ristoranti.id'), nullable=False),
+        sa.Column('prodotto_id', sa.Integer(), sa.ForeignKey('prodotti.id'), nullable=False),
+        sa.PrimaryKeyConstraint('ristorante_id', 'prodotto_id'),
+    )
+
+    op.create_table(
+        'order_items',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('ordine_id', sa.Integer(), sa.ForeignKey('ordini.id'), nullable=True),
+        sa.Column('prodotto_id', sa.Integer(), sa.ForeignKey('prodotti.id'), nullable=True),
+        sa.Column('quantita', sa.Integer(), nullable=False),
+        sa.Column('prezzo_unitario', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_order_items_id', 'order_items', ['id'])
+
+
+def downgrade():
+    op.drop_table('order_items')
+    op.drop_table('product_visibility')
+    op.drop_table('ordini')
+    op.drop_table('prodotti')
+    op.drop_table('user_ristoranti')
+    op.drop_table('user_ruoli_richiesti')
+    op.drop_table('registrazione_ruoli')
+    op.drop_table('user_ruoli')
+    op.drop_table('fornitori')
+    op.drop_table('users')
+    op.drop_table('ruoli')
+    op.drop_table('ristoranti')
+    op.drop_table('registrazioni_pending')
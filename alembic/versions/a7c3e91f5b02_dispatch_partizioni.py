@@ -0,0 +1,72 @@
+"""dispatch a partizioni: run, partizioni e ordini congelati nel run
+
+Revision ID: a7c3e91f5b02
+Revises: 8d4f2b6a0c19
+Create Date: 2025-10-13 16:48:31.074562
+
+Il batch delle 16:00 viene diviso in partizioni (per hash di fornitore e di
+ristorante) che più processi prendono in carico in parallelo.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c3e91f5b02'
+down_revision = '8d4f2b6a0c19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'dispatch_run',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('giorno', sa.Date(), nullable=False),
+        sa.Column('stato', sa.String(), nullable=False),
+        sa.Column('n_partizioni', sa.Integer(), nullable=False),
+        sa.Column('n_ordini', sa.Integer(), nullable=False),
+        sa.Column('riepilogo', sa.Text(), nullable=True),
+        sa.Column('creato_il', sa.DateTime(), nullable=False),
+        sa.Column('completato_il', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_dispatch_run_id', 'dispatch_run', ['id'])
+
+    op.create_table(
+        'dispatch_partizione',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('run_id', sa.Integer(), sa.ForeignKey('dispatch_run.id'), nullable=False),
+        sa.Column('tipo', sa.String(), nullable=False),
+        sa.Column('numero', sa.Integer(), nullable=False),
+        sa.Column('stato', sa.String(), nullable=False),
+        sa.Column('proprietario', sa.String(), nullable=True),
+        sa.Column('scadenza', sa.DateTime(), nullable=True),
+        sa.Column('tentativi', sa.Integer(), nullable=False),
+        sa.Column('n_mail', sa.Integer(), nullable=False),
+        sa.Column('errore', sa.Text(), nullable=True),
+        sa.Column('iniziata_il', sa.DateTime(), nullable=True),
+        sa.Column('completata_il', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('run_id', 'tipo', 'numero', name='uq_dispatch_partizione'),
+    )
+    op.create_index('ix_dispatch_partizione_id', 'dispatch_partizione', ['id'])
+    op.create_index('ix_dispatch_partizione_run_stato', 'dispatch_partizione', ['run_id', 'stato'])
+
+    with op.batch_alter_table('ordini') as batch_op:
+        batch_op.add_column(sa.Column('dispatch_run_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('fk_ordini_dispatch_run_id', 'dispatch_run', ['dispatch_run_id'], ['id'])
+        batch_op.create_index('ix_ordini_dispatch_run_id', ['dispatch_run_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('ordini') as batch_op:
+        batch_op.drop_index('ix_ordini_dispatch_run_id')
+        batch_op.drop_constraint('fk_ordini_dispatch_run_id', type_='foreignkey')
+        batch_op.drop_column('dispatch_run_id')
+
+    op.drop_index('ix_dispatch_partizione_run_stato', table_name='dispatch_partizione')
+    op.drop_index('ix_dispatch_partizione_id', table_name='dispatch_partizione')
+    op.drop_table('dispatch_partizione')
+    op.drop_index('ix_dispatch_run_id', table_name='dispatch_run')
+    op.drop_table('dispatch_run')
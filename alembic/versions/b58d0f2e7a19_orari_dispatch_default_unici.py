@@ -0,0 +1,42 @@
+"""orari_dispatch: un solo orario anche per i default con colonne NULL
+
+Revision ID: b58d0f2e7a19
+Revises: d6e1a8f0b3c4
+Create Date: 2025-10-17 09:41:06.284517
+
+Il vincolo UNIQUE (ristorante_id, fornitore_id) non confronta i NULL: gli orari
+di default (solo ristorante, solo fornitore o globale) potevano essere inseriti
+più volte. Lo sostituisce un indice unico su COALESCE(colonna, 0); dei
+duplicati già presenti resta il più recente.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b58d0f2e7a19'
+down_revision = 'd6e1a8f0b3c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('orari_dispatch') as batch_op:
+        batch_op.drop_constraint('uq_orari_dispatch_ristorante_fornitore', type_='unique')
+    op.execute(
+        "DELETE FROM orari_dispatch WHERE id NOT IN ("
+        " SELECT MAX(id) FROM orari_dispatch"
+        " GROUP BY COALESCE(ristorante_id, 0), COALESCE(fornitore_id, 0))"
+    )
+    # NULL -> 0: anche i default (ristorante, fornitore o globale) sono unici
+    op.create_index(
+        'uq_orari_dispatch_ristorante_fornitore', 'orari_dispatch',
+        [sa.text('COALESCE(ristorante_id, 0)'), sa.text('COALESCE(fornitore_id, 0)')],
+        unique=True,
+    )
+
+
+def downgrade():
+    op.drop_index('uq_orari_dispatch_ristorante_fornitore', table_name='orari_dispatch')
+    with op.batch_alter_table('orari_dispatch') as batch_op:
+        batch_op.create_unique_constraint('uq_orari_dispatch_ristorante_fornitore', ['ristorante_id', 'fornitore_id'])
@@ -0,0 +1,89 @@
+"""rollup report fatturato, prodotti e order manager
+
+Revision ID: c41f0a6e2b87
+Revises: 3b7c1e5a9d20
+Create Date: 2025-10-08 14:22:17.906431
+
+Tabelle pre-aggregate per i report admin, popolate con lo storico degli
+ordini già inviati; da qui in poi le aggiorna il job di invio.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f0a6e2b87'
+down_revision = '3b7c1e5a9d20'
+branch_labels = None
+depends_on = None
+
+
+def _backfill():
+    conn = op.get_bind()
+    if conn.dialect.name == "postgresql":
+        giorno = "CAST(o.data_ordine AS DATE)"
+        mese = "CAST(date_trunc('month', o.data_ordine) AS DATE)"
+    else:
+        giorno = "date(o.data_ordine)"
+        mese = "strftime('%Y-%m-01', o.data_ordine)"
+    inviato = {"si": True}
+
+    conn.execute(sa.text(
+        "INSERT INTO report_ristorante_giorno (ristorante_id, giorno, n_ordini, fatturato) "
+        f"SELECT o.ristorante_id, {giorno}, COUNT(DISTINCT o.id), SUM(r.quantita * r.prezzo_unitario) "
+        "FROM ordini o JOIN order_items r ON r.ordine_id = o.id "
+        f"WHERE o.inviato = :si AND o.ristorante_id IS NOT NULL GROUP BY o.ristorante_id, {giorno}"
+    ), inviato)
+    conn.execute(sa.text(
+        "INSERT INTO report_prodotto_giorno (ristorante_id, prodotto_id, giorno, quantita, fatturato) "
+        f"SELECT o.ristorante_id, r.prodotto_id, {giorno}, SUM(r.quantita), SUM(r.quantita * r.prezzo_unitario) "
+        "FROM ordini o JOIN order_items r ON r.ordine_id = o.id "
+        "WHERE o.inviato = :si AND o.ristorante_id IS NOT NULL AND r.prodotto_id IS NOT NULL "
+        f"GROUP BY o.ristorante_id, r.prodotto_id, {giorno}"
+    ), inviato)
+    conn.execute(sa.text(
+        "INSERT INTO report_order_manager_mese (ristorante_id, user_id, mese, n_ordini, fatturato) "
+        f"SELECT o.ristorante_id, o.user_id, {mese}, COUNT(DISTINCT o.id), SUM(r.quantita * r.prezzo_unitario) "
+        "FROM ordini o JOIN order_items r ON r.ordine_id = o.id "
+        "WHERE o.inviato = :si AND o.ristorante_id IS NOT NULL AND o.user_id IS NOT NULL "
+        f"GROUP BY o.ristorante_id, o.user_id, {mese}"
+    ), inviato)
+
+
+def upgrade():
+    op.create_table(
+        'report_ristorante_giorno',
+        sa.Column('ristorante_id', sa.Integer(), sa.ForeignKey('ristoranti.id'), nullable=False),
+        sa.Column('giorno', sa.Date(), nullable=False),
+        sa.Column('n_ordini', sa.Integer(), nullable=False),
+        sa.Column('fatturato', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('ristorante_id', 'giorno'),
+    )
+    op.create_table(
+        'report_prodotto_giorno',
+        sa.Column('ristorante_id', sa.Integer(), sa.ForeignKey('ristoranti.id'), nullable=False),
+        sa.Column('prodotto_id', sa.Integer(), sa.ForeignKey('prodotti.id'), nullable=False),
+        sa.Column('giorno', sa.Date(), nullable=False),
+        sa.Column('quantita', sa.Integer(), nullable=False),
+        sa.Column('fatturato', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('ristorante_id', 'prodotto_id', 'giorno'),
+    )
+    op.create_index('ix_report_prodotto_giorno_giorno', 'report_prodotto_giorno', ['giorno'])
+    op.create_table(
+        'report_order_manager_mese',
+        sa.Column('ristorante_id', sa.Integer(), sa.ForeignKey('ristoranti.id'), nullable=False),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('mese', sa.Date(), nullable=False),
+        sa.Column('n_ordini', sa.Integer(), nullable=False),
+        sa.Column('fatturato', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('ristorante_id', 'user_id', 'mese'),
+    )
+
+    _backfill()
+
+
+def downgrade():
+    op.drop_table('report_order_manager_mese')
+    op.drop_index('ix_report_prodotto_giorno_giorno', table_name='report_prodotto_giorno')
+    op.drop_table('report_prodotto_giorno')
+    op.drop_table('report_ristorante_giorno')
@@ -0,0 +1,33 @@
+"""conteggio dei riferimenti alle immagini caricate
+
+Revision ID: d6e1a8f0b3c4
+Revises: 7b2f6e4c8d35
+Create Date: 2025-10-16 14:22:37.118460
+
+Gli upload sono archiviati per contenuto (static/uploads/ab/cd/<sha256>.ext);
+la tabella conta i prodotti che usano ogni file, per cancellare quelli orfani.
+I vecchi upload si spostano con: python -m app.immagini migra
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6e1a8f0b3c4'
+down_revision = '7b2f6e4c8d35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'immagini',
+        sa.Column('percorso', sa.String(), nullable=False),
+        sa.Column('riferimenti', sa.Integer(), nullable=False),
+        sa.Column('aggiornato_il', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('percorso'),
+    )
+
+
+def downgrade():
+    op.drop_table('immagini')
@@ -0,0 +1,38 @@
+"""orari di cutoff e invio per ristorante e fornitore
+
+Revision ID: e1b84d3c7a56
+Revises: a7c3e91f5b02
+Create Date: 2025-10-14 10:12:55.638201
+
+Sostituisce il cutoff delle 15:30 e il cron delle 16:00 fissi: ogni ristorante
+(o fornitore) può avere i propri orari, con fuso orario.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1b84d3c7a56'
+down_revision = 'a7c3e91f5b02'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'orari_dispatch',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('ristorante_id', sa.Integer(), sa.ForeignKey('ristoranti.id'), nullable=True),
+        sa.Column('fornitore_id', sa.Integer(), sa.ForeignKey('fornitori.id'), nullable=True),
+        sa.Column('ora_cutoff', sa.Time(), nullable=False),
+        sa.Column('ora_invio', sa.Time(), nullable=False),
+        sa.Column('fuso_orario', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('ristorante_id', 'fornitore_id', name='uq_orari_dispatch_ristorante_fornitore'),
+    )
+    op.create_index('ix_orari_dispatch_id', 'orari_dispatch', ['id'])
+
+
+def downgrade():
+    op.drop_index('ix_orari_dispatch_id', table_name='orari_dispatch')
+    op.drop_table('orari_dispatch')
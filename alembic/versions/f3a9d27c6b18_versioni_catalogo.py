@@ -0,0 +1,40 @@
+"""versioni del catalogo per ETag e GET condizionali
+
+Revision ID: f3a9d27c6b18
+Revises: e1b84d3c7a56
+Create Date: 2025-10-15 09:41:03.217554
+
+Un contatore per risorsa (prodotti, ristoranti, fornitori, visibilita),
+incrementato nella stessa transazione di ogni scrittura: le GET di elenco e
+dettaglio ne ricavano ETag e Last-Modified e rispondono 304 senza query.
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a9d27c6b18'
+down_revision = 'e1b84d3c7a56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    versioni = op.create_table(
+        'versioni_catalogo',
+        sa.Column('risorsa', sa.String(), nullable=False),
+        sa.Column('versione', sa.Integer(), nullable=False),
+        sa.Column('aggiornato_il', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('risorsa'),
+    )
+    adesso = datetime.utcnow().replace(microsecond=0)
+    op.bulk_insert(versioni, [
+        {'risorsa': r, 'versione': 1, 'aggiornato_il': adesso}
+        for r in ('prodotti', 'ristoranti', 'fornitori', 'visibilita')
+    ])
+
+
+def downgrade():
+    op.drop_table('versioni_catalogo')
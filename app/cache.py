@@ -0,0 +1,50 @@
+# app/cache.py
+#
+# Cache in memoria del processo, usata per gli snapshot del catalogo
+# (app/catalogo.py) e per i principal degli utenti (app/dependencies.py).
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheLRU:
+    """LRU con scadenza, sicura tra thread (gli endpoint sync girano nel threadpool)."""
+
+    def __init__(self, dimensione: int, ttl: int):
+        self.dimensione = dimensione
+        self.ttl = ttl
+        self._voci = OrderedDict()  # chiave -> (scadenza, valore)
+        self._lock = threading.Lock()
+        # incrementata a ogni invalidazione: un valore calcolato prima non viene salvato
+        self.generazione = 0
+
+    def get(self, chiave):
+        with self._lock:
+            voce = self._voci.get(chiave)
+            if voce is None:
+                return None
+            scadenza, valore = voce
+            if scadenza < time.monotonic():
+                del self._voci[chiave]
+                return None
+            self._voci.move_to_end(chiave)
+            return valore
+
+    def put(self, chiave, valore, generazione: int):
+        with self._lock:
+            if generazione != self.generazione:
+                return
+            self._voci[chiave] = (time.monotonic() + self.ttl, valore)
+            self._voci.move_to_end(chiave)
+            while len(self._voci) > self.dimensione:
+                self._voci.popitem(last=False)
+
+    def invalida(self, chiavi=None):
+        with self._lock:
+            self.generazione += 1
+            if chiavi is None:
+                self._voci.clear()
+            else:
+                for chiave in chiavi:
+                    self._voci.pop(chiave, None)
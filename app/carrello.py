@@ -0,0 +1,182 @@
+# app/carrello.py
+
+from datetime import datetime
+from sqlalchemy import and_, bindparam, delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, selectinload
+
+from app import models
+
+NOTA_CARRELLO = "Ordine aggregato del giorno"
+
+# --- Carrello aperto: un solo Ordine non inviato per (utente, ristorante) ---
+def trova_carrello(db: Session, user_id: int, ristorante_id: int):
+    return (
+        db.query(models.Ordine)
+        .filter(
+            models.Ordine.user_id == user_id,
+            models.Ordine.ristorante_id == ristorante_id,
+            models.Ordine.inviato == False
+        )
+        .first()
+    )
+
+def apri_carrello(db: Session, user_id: int, ristorante_id: int, note: str = None):
+    carrello = trova_carrello(db, user_id, ristorante_id)
+    if carrello:
+        # la stessa nota a ogni aggiunta non si ripete: la nota non cresce all'infinito
+        if note and note != carrello.note:
+            if not carrello.note or carrello.note == NOTA_CARRELLO:
+                carrello.note = note
+            elif note not in carrello.note.split("; "):
+                carrello.note = f"{carrello.note}; {note}"
+        return carrello
+
+    carrello = models.Ordine(
+        user_id=user_id,
+        ristorante_id=ristorante_id,
+        data_ordine=datetime.utcnow(),
+        note=note or NOTA_CARRELLO,
+        totale=0.0,
+        inviato=False
+    )
+    # l'indice unico parziale garantisce un solo carrello aperto:
+    # se un'altra richiesta lo ha appena creato, riusiamo il suo
+    try:
+        with db.begin_nested():
+            db.add(carrello)
+            db.flush()
+    except IntegrityError:
+        carrello = trova_carrello(db, user_id, ristorante_id)
+    return carrello
+
+# --- Prezzi e visibilità di tutti i prodotti in una sola query ---
+# Ritorna {prodotto_id: (prezzo, visibile_nel_ristorante, fornitore_id)}; i prodotti inesistenti mancano.
+def risolvi_prodotti(db: Session, ristorante_id: int, prodotto_ids) -> dict:
+    ids = list(set(prodotto_ids))
+    if not ids:
+        return {}
+    pv = models.product_visibility
+    rows = (
+        db.query(models.Prodotto.id, models.Prodotto.prezzo, pv.c.ristorante_id, models.Prodotto.fornitore_id)
+        .outerjoin(pv, and_(
+            pv.c.prodotto_id == models.Prodotto.id,
+            pv.c.ristorante_id == ristorante_id
+        ))
+        .filter(models.Prodotto.id.in_(ids))
+        .all()
+    )
+    return {pid: (prezzo, rid is not None, fid) for pid, prezzo, rid, fid in rows}
+
+def carica_ordine_completo(db: Session, ordine_id: int):
+    # righe, prodotti e fornitori in query a numero costante (per la risposta API)
+    return (
+        db.query(models.Ordine)
+        .options(
+            selectinload(models.Ordine.righe)
+            .selectinload(models.OrderItem.prodotto)
+            .selectinload(models.Prodotto.fornitore)
+        )
+        .filter(models.Ordine.id == ordine_id)
+        .populate_existing()
+        .first()
+    )
+
+# --- Merge delle righe nel carrello ---
+# righe: {prodotto_id: quantita}; prezzi: {prodotto_id: prezzo} per le righe nuove.
+# Con sostituisci=False le quantità si sommano (POST), altrimenti si sovrascrivono (PUT).
+# Tocca solo le righe passate: il costo non dipende dalla dimensione del carrello.
+def unisci_righe(db: Session, carrello: models.Ordine, righe: dict, prezzi: dict, sostituisci: bool = False):
+    if not righe:
+        return carrello
+
+    esistenti = {
+        r.prodotto_id: r
+        for r in db.query(
+            models.OrderItem.id,
+            models.OrderItem.prodotto_id,
+            models.OrderItem.quantita,
+            models.OrderItem.prezzo_unitario
+        ).filter(
+            models.OrderItem.ordine_id == carrello.id,
+            models.OrderItem.prodotto_id.in_(list(righe))
+        )
+    }
+
+    nuove, aggiornate, incrementi, rimosse, azzerate = [], [], [], [], []
+    delta_totale = 0.0
+    for prodotto_id, quantita in righe.items():
+        riga = esistenti.get(prodotto_id)
+        if riga and not sostituisci:
+            # incremento atomico (quantita = quantita + delta): due aggiunte
+            # concorrenti alla stessa riga si sommano invece di sovrascriversi
+            incrementi.append({"b_id": riga.id, "b_delta": quantita})
+            delta_totale += quantita * riga.prezzo_unitario
+        elif riga:
+            if quantita > 0:
+                delta_totale += (quantita - riga.quantita) * riga.prezzo_unitario
+                aggiornate.append({"id": riga.id, "quantita": quantita})
+            else:
+                delta_totale -= riga.quantita * riga.prezzo_unitario
+                rimosse.append(riga.id)
+        elif quantita > 0 and prodotto_id in prezzi:
+            nuove.append({
+                "ordine_id": carrello.id,
+                "prodotto_id": prodotto_id,
+                "quantita": quantita,
+                "prezzo_unitario": prezzi[prodotto_id]
+            })
+            delta_totale += quantita * prezzi[prodotto_id]
+
+    # un'unica istruzione per tipo di modifica, qualunque sia il numero di righe
+    righe_tabella = models.OrderItem.__table__
+    if nuove:
+        db.execute(insert(models.OrderItem), nuove)
+    if aggiornate:
+        db.execute(update(models.OrderItem), aggiornate)
+    if incrementi:
+        db.execute(
+            update(righe_tabella)
+            .where(righe_tabella.c.id == bindparam("b_id"))
+            .values(quantita=righe_tabella.c.quantita + bindparam("b_delta")),
+            incrementi,
+        )
+        if any(i["b_delta"] < 0 for i in incrementi):
+            # righe scese a zero o meno: via, togliendo dal totale quello che ne restava
+            azzerate = db.execute(
+                delete(righe_tabella)
+                .where(righe_tabella.c.id.in_([i["b_id"] for i in incrementi]), righe_tabella.c.quantita <= 0)
+                .returning(righe_tabella.c.quantita, righe_tabella.c.prezzo_unitario)
+            ).all()
+            delta_totale -= sum(q * p for q, p in azzerate)
+    if rimosse:
+        db.execute(delete(models.OrderItem).where(models.OrderItem.id.in_(rimosse)))
+
+    # aggiornamento atomico del totale, senza ricalcolare tutto il carrello
+    if delta_totale:
+        db.query(models.Ordine).filter(models.Ordine.id == carrello.id).update(
+            {models.Ordine.totale: models.Ordine.totale + delta_totale},
+            synchronize_session=False
+        )
+    db.flush()
+
+    # carrello svuotato → lo eliminiamo, come faceva la vecchia agglomerazione
+    if (rimosse or azzerate) and not carrello_ha_righe(db, carrello.id):
+        db.delete(carrello)
+        db.flush()
+        return None
+
+    db.expire(carrello, ["totale"])
+    return carrello
+
+def carrello_ha_righe(db: Session, ordine_id: int) -> bool:
+    return db.query(models.OrderItem.id).filter(models.OrderItem.ordine_id == ordine_id).first() is not None
+
+# --- Aggiunta righe (POST /ordini/): apre il carrello se serve e unisce le righe ---
+# Ritorna l'id del carrello, oppure None se il risultato è vuoto.
+def aggiungi_righe(db: Session, user_id: int, ristorante_id: int, righe: dict, prezzi: dict, note: str = None):
+    carrello = apri_carrello(db, user_id, ristorante_id, note=note)
+    carrello = unisci_righe(db, carrello, righe, prezzi)
+    if not carrello or not carrello_ha_righe(db, carrello.id):
+        return None
+    return carrello.id
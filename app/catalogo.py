@@ -0,0 +1,147 @@
+# app/catalogo.py
+#
+# Snapshot del catalogo per ristorante, usato dalla vetrina dell'order manager.
+# Il catalogo cambia poche volte al giorno ma viene letto migliaia di volte: lo
+# snapshot (tuple immutabili con il nome del fornitore già risolto) resta in
+# memoria nel processo, con un numero massimo di ristoranti (LRU) e una durata
+# massima. Le scritture di app/routers/prodotti.py lo invalidano subito; la
+# durata limita quanto può restare vecchio negli altri processi/worker.
+#
+# Qui vivono anche le versioni del catalogo: un contatore per risorsa
+# incrementato da ogni scrittura, da cui le GET di prodotti, ristoranti e
+# fornitori ricavano ETag e Last-Modified per rispondere 304.
+
+import os
+from collections import namedtuple
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.cache import CacheLRU
+from app.database import insert_dialetto
+
+CATALOGO_CACHE_RISTORANTI = int(os.getenv("CATALOGO_CACHE_RISTORANTI", 256))
+CATALOGO_CACHE_TTL = int(os.getenv("CATALOGO_CACHE_TTL", 300))
+
+ProdottoVetrina = namedtuple("ProdottoVetrina", "id nome descrizione prezzo immagine_url fornitore")
+SnapshotCatalogo = namedtuple("SnapshotCatalogo", "id nome prodotti")
+
+
+_cache = CacheLRU(CATALOGO_CACHE_RISTORANTI, CATALOGO_CACHE_TTL)
+
+
+def costruisci_snapshot(db: Session, ristorante_id: int):
+    nome = db.scalar(select(models.Ristorante.nome).where(models.Ristorante.id == ristorante_id))
+    if nome is None:
+        return None
+    pv = models.product_visibility
+    righe = db.execute(
+        select(
+            models.Prodotto.id,
+            models.Prodotto.nome,
+            models.Prodotto.descrizione,
+            models.Prodotto.prezzo,
+            models.Prodotto.immagine_url,
+            models.Fornitore.nome,
+        )
+        .join(pv, pv.c.prodotto_id == models.Prodotto.id)
+        .outerjoin(models.Fornitore, models.Fornitore.id == models.Prodotto.fornitore_id)
+        .where(pv.c.ristorante_id == ristorante_id)
+        .order_by(models.Prodotto.id)
+    ).all()
+    return SnapshotCatalogo(ristorante_id, nome, tuple(ProdottoVetrina(*r) for r in righe))
+
+
+def snapshot_ristorante(db: Session, ristorante_id: int):
+    """Snapshot dalla cache; la sessione viene usata solo se manca. None se il ristorante non esiste."""
+    snapshot = _cache.get(ristorante_id)
+    if snapshot is not None:
+        return snapshot
+    generazione = _cache.generazione
+    snapshot = costruisci_snapshot(db, ristorante_id)
+    if snapshot is not None:
+        _cache.put(ristorante_id, snapshot, generazione)
+    return snapshot
+
+
+def invalida(ristorante_ids=None):
+    """Da chiamare dopo ogni modifica a prodotti, prezzi, fornitori o visibilità (None = tutti)."""
+    _cache.invalida(ristorante_ids)
+
+
+# -----------------------------
+# Versioni e GET condizionali
+# -----------------------------
+def incrementa_versioni(db: Session, *risorse: str):
+    """Da chiamare nella transazione della scrittura, prima del commit."""
+    adesso = datetime.utcnow().replace(microsecond=0)
+    V = models.VersioneCatalogo
+    stmt = insert_dialetto(db, V)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["risorsa"],
+        set_={"versione": V.versione + 1, "aggiornato_il": stmt.excluded.aggiornato_il},
+    )
+    db.execute(stmt, [{"risorsa": r, "versione": 1, "aggiornato_il": adesso} for r in risorse])
+
+
+class Validatori:
+    """ETag forte e Last-Modified per una risposta che dipende da alcune risorse del catalogo."""
+
+    def __init__(self, versioni: dict, ultima_modifica):
+        # es. "prodotti.12-fornitori.3": cambia con ogni scrittura su una delle risorse
+        self.etag = '"' + "-".join(f"{r}.{v}" for r, v in sorted(versioni.items())) + '"'
+        self.ultima_modifica = ultima_modifica
+
+    def intestazioni(self) -> dict:
+        # no-cache: il browser può riusare la copia, ma solo dopo averla rivalidata
+        h = {"ETag": self.etag, "Cache-Control": "private, no-cache"}
+        if self._data_affidabile():
+            h["Last-Modified"] = format_datetime(self.ultima_modifica.replace(tzinfo=timezone.utc), usegmt=True)
+        return h
+
+    def _data_affidabile(self) -> bool:
+        # Last-Modified ha la risoluzione del secondo: se il secondo dell'ultima
+        # scrittura non è ancora finito, un'altra scrittura può avere la stessa data
+        # (RFC 9110, 8.8.2.2); la data vale come validatore solo quando è passato
+        if not self.ultima_modifica:
+            return False
+        return self.ultima_modifica.replace(microsecond=0) < datetime.utcnow().replace(microsecond=0)
+
+    def non_modificato(self, request: Request) -> bool:
+        # If-None-Match ha la precedenza su If-Modified-Since (RFC 9110, 13.2.2)
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            etag_client = [e.strip().removeprefix("W/") for e in if_none_match.split(",")]
+            return "*" in etag_client or self.etag in etag_client
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and self._data_affidabile():
+            try:
+                data_client = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if data_client.tzinfo:
+                data_client = data_client.astimezone(timezone.utc).replace(tzinfo=None)
+            return self.ultima_modifica.replace(microsecond=0) <= data_client
+        return False
+
+    def risposta(self, request: Request, response: Response):
+        """304 se il client ha già questa versione, altrimenti None dopo aver impostato le intestazioni."""
+        if self.non_modificato(request):
+            return Response(status_code=304, headers=self.intestazioni())
+        response.headers.update(self.intestazioni())
+        return None
+
+
+def validatori(db: Session, *risorse: str) -> Validatori:
+    """Una sola lettura sulla tabella dei contatori; risorse mai scritte valgono 0."""
+    V = models.VersioneCatalogo
+    righe = db.execute(
+        select(V.risorsa, V.versione, V.aggiornato_il).where(V.risorsa.in_(risorse))
+    ).all()
+    versioni = dict.fromkeys(risorse, 0)
+    versioni.update({r.risorsa: r.versione for r in righe})
+    return Validatori(versioni, max((r.aggiornato_il for r in righe), default=None))
@@ -1,33 +1,97 @@
 # app/dependencies.py
 
+import os
+from dataclasses import dataclass
+
 from fastapi import Depends, HTTPException, Request
-from sqlalchemy.orm import joinedload
-from app.database import SessionLocal
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
 from app import models
+from app.cache import CacheLRU
+from app.database import SessionLocal
+
+# Principal in cache: chi scrive ruoli, ristoranti o stato di un utente chiama
+# invalida_principal; il TTL limita quanto può restare vecchio negli altri processi
+PRINCIPAL_CACHE_UTENTI = int(os.getenv("PRINCIPAL_CACHE_UTENTI", 4096))
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", 60))
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Quello che serve per autorizzare una richiesta, senza sessione DB."""
+
+    id: int
+    email: str
+    is_active: bool
+    ruoli: frozenset
+    ristorante_ids: frozenset
+
+    @property
+    def is_superuser(self) -> bool:
+        return "superuser" in self.ruoli
+
+    def ha_ruolo(self, *ruoli: str) -> bool:
+        return self.is_superuser or not self.ruoli.isdisjoint(ruoli)
+
+
+_cache = CacheLRU(PRINCIPAL_CACHE_UTENTI, PRINCIPAL_CACHE_TTL)
+
+
+def carica_principal(db: Session, user_id: int):
+    utente = db.execute(
+        select(models.User.email, models.User.is_active).where(models.User.id == user_id)
+    ).first()
+    if utente is None:
+        return None
+    ruoli = db.scalars(
+        select(models.Ruolo.ruolo)
+        .join(models.user_ruoli, models.user_ruoli.c.ruolo_id == models.Ruolo.id)
+        .where(models.user_ruoli.c.user_id == user_id)
+    ).all()
+    ristoranti = db.scalars(
+        select(models.user_ristoranti.c.ristorante_id).where(models.user_ristoranti.c.user_id == user_id)
+    ).all()
+    return Principal(user_id, utente.email, bool(utente.is_active), frozenset(ruoli), frozenset(ristoranti))
+
+
+def invalida_principal(user_ids=None):
+    """Da chiamare dopo il commit che cambia ruoli, ristoranti o stato di utenti (None = tutti)."""
+    _cache.invalida(user_ids)
+
+
+def get_principal(request: Request) -> Principal:
+    # risolto una volta per richiesta: tutte le dipendenze lo condividono
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        return principal
 
-def get_current_user(request: Request) -> models.User:
     user_id = request.session.get("user_id")
     if not user_id:
         raise HTTPException(status_code=401, detail="Non autenticato")
-    db = SessionLocal()
-    try:
-        user = (
-            db.query(models.User)
-            .options(joinedload(models.User.ruoli))
-            .get(user_id)
-        )
-        if not user:
+    principal = _cache.get(user_id)
+    if principal is None:
+        generazione = _cache.generazione
+        db = SessionLocal()
+        try:
+            principal = carica_principal(db, user_id)
+        finally:
+            db.close()
+        if principal is None:
             raise HTTPException(status_code=401, detail="Utente non trovato")
-        return user
-    finally:
-        db.close()
+        _cache.put(user_id, principal, generazione)
+    if not principal.is_active:
+        raise HTTPException(status_code=403, detail="Account non attivo")
+
+    request.state.principal = principal
+    return principal
+
+# compatibilità: le dipendenze ricevono il Principal al posto del modello User
+get_current_user = get_principal
 
 def require_role(*accepted_roles: str):
-    def _dep(user: models.User = Depends(get_current_user)) -> models.User:
-        user_roles = {r.ruolo for r in user.ruoli}
-        if "superuser" in user_roles:
-            return user
-        if not user_roles.intersection(set(accepted_roles)):
+    def _dep(user: Principal = Depends(get_principal)) -> Principal:
+        if not user.ha_ruolo(*accepted_roles):
             raise HTTPException(status_code=403, detail="Non autorizzato")
         return user
     return _dep
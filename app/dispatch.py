@@ -0,0 +1,495 @@
+# app/dispatch.py
+#
+# Dispatch giornaliero degli ordini aggregati. Le righe degli ordini da inviare
+# si leggono con una sola query (ordini, ristoranti, order manager, prodotti e
+# fornitori in join) e si organizzano in memoria per fornitore e per ordine.
+# Da questa struttura escono:
+#   - un ordine d'acquisto per fornitore, con il dettaglio per ristorante
+#     (una sola mail per run anche se il fornitore serve 40 ristoranti);
+#   - la conferma per ogni order manager, con le righe divise per fornitore.
+#
+# Ogni ristorante ha il proprio orario di invio (app/orari.py): lo scheduler
+# controlla ogni minuto quali ristoranti sono arrivati all'orario e crea un run
+# con i loro ordini aperti, congelandoli. Il lavoro del run è diviso in
+# partizioni (ordini d'acquisto per hash del fornitore, conferme per hash del
+# ristorante). Le partizioni le prendono in carico i processi del pool
+# (DISPATCH_WORKERS) e gli altri nodi; il run si chiude quando sono tutte finite.
+#
+# Gli ordini diventano inviati alla creazione del run, le mail si accodano dopo,
+# una partizione alla volta. Una partizione che esaurisce i tentativi chiude il
+# run come "con_errori", ma non è abbandonata: dopo DISPATCH_RIPRESA_MINUTI
+# riprendi_run_con_errori la rimette in attesa e riapre il run. Gli ordini
+# restano legati al run, quindi prima o poi ogni ordine inviato ha le sue mail.
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime, timedelta
+from multiprocessing import get_context
+
+from sqlalchemy import and_, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from app import models, orari, outbox, report
+from app.database import SessionLocal
+from app.lease import PROPRIETARIO
+
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", 4))
+DISPATCH_PARTIZIONI = int(os.getenv("DISPATCH_PARTIZIONI", 16))
+DISPATCH_LEASE_SECONDI = int(os.getenv("DISPATCH_LEASE_SECONDI", 300))
+DISPATCH_MAX_TENTATIVI = int(os.getenv("DISPATCH_MAX_TENTATIVI", 3))
+DISPATCH_TIMEOUT_SECONDI = int(os.getenv("DISPATCH_TIMEOUT_SECONDI", 3600))
+# attesa prima di riprovare le partizioni fallite di un run chiuso con errori
+DISPATCH_RIPRESA_MINUTI = int(os.getenv("DISPATCH_RIPRESA_MINUTI", 15))
+# lotti di mail piccoli: i worker si dividono l'invio invece di prenderlo tutto il primo
+DISPATCH_LOTTO_MAIL = int(os.getenv("DISPATCH_LOTTO_MAIL", 20))
+
+FORNITORI, CONFERME = "fornitori", "conferme"
+
+
+def carica_righe(db: Session, *condizioni) -> list:
+    return db.execute(
+        select(
+            models.Ordine.id.label("ordine_id"),
+            models.Ordine.ristorante_id,
+            models.Ristorante.nome.label("ristorante"),
+            models.User.email.label("order_manager"),
+            models.Ordine.note,
+            models.OrderItem.quantita,
+            models.OrderItem.prezzo_unitario,
+            models.Prodotto.nome.label("prodotto"),
+            models.Fornitore.id.label("fornitore_id"),
+            models.Fornitore.nome.label("fornitore"),
+            models.Fornitore.email.label("fornitore_email"),
+        )
+        .join(models.Ristorante, models.Ristorante.id == models.Ordine.ristorante_id)
+        .join(models.User, models.User.id == models.Ordine.user_id)
+        .join(models.OrderItem, models.OrderItem.ordine_id == models.Ordine.id)
+        .outerjoin(models.Prodotto, models.Prodotto.id == models.OrderItem.prodotto_id)
+        .outerjoin(models.Fornitore, models.Fornitore.id == models.Prodotto.fornitore_id)
+        .where(*condizioni)
+        .order_by(models.Ristorante.nome, models.Ordine.id, models.Prodotto.nome)
+    ).all()
+
+
+def raggruppa(righe) -> tuple:
+    """Ritorna (per_fornitore, per_ordine).
+
+    per_fornitore: {fornitore_id: {"nome", "email", "ristoranti": {ristorante_id: {"nome", "referenti", "ordini", "righe"}}}}
+                   (righe: {(prodotto, prezzo_unitario): riga}, quantità sommate tra gli ordini)
+    per_ordine:    {ordine_id: {"ristorante", "order_manager", "fornitori": {nome_fornitore: [righe]}}}
+    """
+    per_fornitore = {}
+    per_ordine = {}
+
+    for r in righe:
+        riga = {
+            "prodotto": r.prodotto or "Prodotto non più a catalogo",
+            "quantita": r.quantita,
+            "prezzo_unitario": r.prezzo_unitario,
+            "subtotale": r.quantita * r.prezzo_unitario,
+        }
+
+        o = per_ordine.setdefault(r.ordine_id, {
+            "ristorante": r.ristorante,
+            "order_manager": r.order_manager,
+            "fornitori": defaultdict(list),
+        })
+        o["fornitori"][r.fornitore or "Senza fornitore"].append(riga)
+
+        if r.fornitore_id is None:
+            continue
+        f = per_fornitore.setdefault(r.fornitore_id, {
+            "nome": r.fornitore,
+            "email": r.fornitore_email,
+            "ristoranti": {},
+        })
+        rist = f["ristoranti"].setdefault(r.ristorante_id, {
+            "nome": r.ristorante,
+            "referenti": set(),
+            "ordini": set(),
+            "righe": {},
+        })
+        rist["referenti"].add(r.order_manager)
+        rist["ordini"].add(r.ordine_id)
+        # stesso prodotto in più ordini dello stesso ristorante: una riga sola
+        consolidata = rist["righe"].setdefault(
+            (riga["prodotto"], riga["prezzo_unitario"]), dict(riga, quantita=0, subtotale=0.0)
+        )
+        consolidata["quantita"] += riga["quantita"]
+        consolidata["subtotale"] += riga["subtotale"]
+
+    return per_fornitore, per_ordine
+
+
+def _linea(riga) -> str:
+    return f"- {riga['prodotto']} x {riga['quantita']} = {riga['subtotale']:.2f}€\n"
+
+
+def render_fornitore(fornitore: dict, giorno: date) -> tuple:
+    oggetto = f"Ordine del {giorno:%d/%m/%Y} — {len(fornitore['ristoranti'])} ristorante/i"
+    corpo = f"Ordine d'acquisto per {fornitore['nome']} del {giorno:%d/%m/%Y}\n"
+    totale = 0.0
+    for rist in sorted(fornitore["ristoranti"].values(), key=lambda x: x["nome"]):
+        righe = sorted(rist["righe"].values(), key=lambda x: x["prodotto"])
+        subtotale = sum(r["subtotale"] for r in righe)
+        totale += subtotale
+        ordini = ", ".join(f"#{i}" for i in sorted(rist["ordini"]))
+        referenti = ", ".join(sorted(rist["referenti"]))
+        corpo += f"\n{rist['nome']} (ordini {ordini}; referenti {referenti}):\n"
+        corpo += "".join(_linea(r) for r in righe)
+        corpo += f"  Totale ristorante: {subtotale:.2f}€\n"
+    corpo += f"\nTotale ordine: {totale:.2f}€"
+    return oggetto, corpo
+
+
+def render_conferma(ordine_id: int, ordine: dict) -> tuple:
+    oggetto = f"Conferma ordine aggregato #{ordine_id}"
+    corpo = f"Riepilogo ordine #{ordine_id} — Ristorante {ordine['ristorante']}\n"
+    totale = 0.0
+    for fornitore, righe in sorted(ordine["fornitori"].items()):
+        corpo += f"\n{fornitore}:\n" + "".join(_linea(r) for r in righe)
+        totale += sum(r["subtotale"] for r in righe)
+    corpo += f"\nTotale ordine aggregato: {totale:.2f}€"
+    return oggetto, corpo
+
+
+def orario_invio_fornitore(tabella_orari: dict, ristorante_id: int, fornitore_id: int):
+    """Orario di invio dell'ordine d'acquisto di quel ristorante a quel fornitore,
+    se il fornitore ne ha uno che vince secondo orari.risolvi; None = subito."""
+    orario = orari.risolvi(tabella_orari, ristorante_id, fornitore_id)
+    # un orario che non dipende dal fornitore è quello del ristorante, già arrivato
+    return None if orario == orari.risolvi(tabella_orari, ristorante_id) else orario
+
+
+def messaggi_fornitori(per_fornitore: dict, giorno: date, run_id: int, tabella_orari: dict = None) -> list:
+    """Ordini d'acquisto per l'outbox (vedi outbox.accoda), uno per fornitore.
+
+    Un fornitore con il proprio orario di invio (orari_dispatch, anche solo per
+    alcuni ristoranti) riceve la mail a quell'ora invece che subito: se i
+    ristoranti hanno orari diversi, una mail per orario.
+    """
+    tabella_orari = tabella_orari or {}
+    messaggi = []
+    for fornitore_id, fornitore in per_fornitore.items():
+        if not fornitore["email"]:
+            logging.warning("Fornitore %s senza email: ordine d'acquisto non inviato", fornitore["nome"])
+            continue
+        per_momento = defaultdict(dict)  # momento di invio (None = subito) -> ristoranti
+        for ristorante_id, ristorante in fornitore["ristoranti"].items():
+            orario = orario_invio_fornitore(tabella_orari, ristorante_id, fornitore_id)
+            per_momento[orari.momento_invio(orario) if orario else None][ristorante_id] = ristorante
+        for momento, ristoranti in per_momento.items():
+            oggetto, corpo = render_fornitore(dict(fornitore, ristoranti=ristoranti), giorno)
+            chiave = f"fornitore:{fornitore_id}:{giorno.isoformat()}:{run_id}"
+            if momento is not None and len(per_momento) > 1:
+                chiave += f":{momento:%H%M}"
+            messaggi.append(dict(
+                chiave=chiave,
+                destinatario=fornitore["email"],
+                oggetto=oggetto,
+                corpo=corpo,
+                prossimo_tentativo=momento,
+            ))
+    return messaggi
+
+
+def messaggi_conferme(per_ordine: dict) -> list:
+    """Conferme per l'outbox, una per ordine (mittente = order manager)."""
+    messaggi = []
+    for ordine_id, ordine in per_ordine.items():
+        oggetto, corpo = render_conferma(ordine_id, ordine)
+        messaggi.append(dict(
+            chiave=f"ordine:{ordine_id}:order_manager",
+            ordine_id=ordine_id,
+            destinatario=ordine["order_manager"],
+            oggetto=oggetto,
+            corpo=corpo,
+            mittente=ordine["order_manager"],
+        ))
+    return messaggi
+
+
+# -----------------------------
+# Run e partizioni
+# -----------------------------
+def ristoranti_dovuti(db: Session, adesso: datetime = None) -> list:
+    """Ristoranti con ordini aperti il cui orario di invio (nel loro fuso) è arrivato."""
+    ristorante_ids = db.scalars(
+        select(models.Ordine.ristorante_id).where(models.Ordine.inviato == False).distinct()
+    ).all()
+    if not ristorante_ids:
+        return []
+    tabella_orari = orari.carica_orari(db)
+    return [
+        rid for rid in ristorante_ids
+        if rid is not None and orari.invio_dovuto(orari.risolvi(tabella_orari, rid), adesso)
+    ]
+
+
+def crea_run(db: Session, giorno: date, n_partizioni: int = None, ristorante_ids: list = None):
+    """Congela gli ordini aperti (dei ristoranti indicati) in un nuovo run e ne crea le partizioni.
+
+    Nella stessa transazione gli ordini diventano inviati (i carrelli successivi
+    sono ordini nuovi) e si aggiornano i rollup dei report. Ritorna None se non
+    ci sono ordini da inviare.
+    """
+    n_partizioni = n_partizioni or DISPATCH_PARTIZIONI
+    run = models.DispatchRun(giorno=giorno, stato="in_corso", n_partizioni=n_partizioni, n_ordini=0)
+    db.add(run)
+    db.flush()
+
+    aperti = [models.Ordine.inviato == False]
+    if ristorante_ids is not None:
+        aperti.append(models.Ordine.ristorante_id.in_(ristorante_ids))
+    n_ordini = db.execute(
+        update(models.Ordine)
+        .where(*aperti)
+        .values(inviato=True, dispatch_run_id=run.id)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not n_ordini:
+        db.rollback()
+        return None
+
+    run.n_ordini = n_ordini
+    db.execute(insert(models.DispatchPartizione), [
+        {"run_id": run.id, "tipo": tipo, "numero": numero, "stato": "in_attesa", "tentativi": 0, "n_mail": 0}
+        for tipo in (FORNITORI, CONFERME)
+        for numero in range(n_partizioni)
+    ])
+    report.aggiorna_rollup(
+        db, db.scalars(select(models.Ordine.id).where(models.Ordine.dispatch_run_id == run.id)).all()
+    )
+    db.commit()
+    return run
+
+
+def reclama_partizione(db: Session, run_id: int):
+    """Prende in carico una partizione libera (o scaduta) del run; None se non ce ne sono."""
+    P = models.DispatchPartizione
+    while True:
+        adesso = datetime.utcnow()
+        disponibile = and_(
+            P.run_id == run_id,
+            P.tentativi < DISPATCH_MAX_TENTATIVI,
+            or_(
+                P.stato == "in_attesa",
+                and_(P.stato.in_(("in_corso", "errore")), P.scadenza < adesso),
+            ),
+        )
+        partizione_id = db.scalar(select(P.id).where(disponibile).order_by(P.tentativi, P.id).limit(1))
+        if partizione_id is None:
+            return None
+        # UPDATE condizionato: se un altro processo l'ha appena presa, si passa alla prossima
+        presa = db.execute(
+            update(P)
+            .where(P.id == partizione_id, disponibile)
+            .values(
+                stato="in_corso",
+                proprietario=PROPRIETARIO,
+                scadenza=adesso + timedelta(seconds=DISPATCH_LEASE_SECONDI),
+                tentativi=P.tentativi + 1,
+                iniziata_il=adesso,
+            )
+        ).rowcount == 1
+        db.commit()
+        if presa:
+            return db.get(P, partizione_id)
+
+
+def processa_partizione(db: Session, partizione: models.DispatchPartizione) -> int:
+    """Renderizza e accoda nell'outbox le mail della partizione; ritorna quante."""
+    run = partizione.run
+    if partizione.tipo == FORNITORI:
+        condizione = models.Fornitore.id % run.n_partizioni == partizione.numero
+    else:
+        condizione = models.Ordine.ristorante_id % run.n_partizioni == partizione.numero
+
+    per_fornitore, per_ordine = raggruppa(
+        carica_righe(db, models.Ordine.dispatch_run_id == run.id, condizione)
+    )
+    if partizione.tipo == FORNITORI:
+        messaggi = messaggi_fornitori(per_fornitore, run.giorno, run.id, orari.carica_orari(db))
+    else:
+        messaggi = messaggi_conferme(per_ordine)
+
+    outbox.accoda(db, messaggi)
+    db.execute(
+        update(models.DispatchPartizione)
+        .where(models.DispatchPartizione.id == partizione.id,
+               models.DispatchPartizione.proprietario == PROPRIETARIO)
+        .values(stato="completata", n_mail=len(messaggi), errore=None, completata_il=datetime.utcnow())
+    )
+    db.commit()
+    return len(messaggi)
+
+
+def lavora(run_id: int) -> dict:
+    """Corpo di un worker: prende partizioni del run finché ce ne sono, poi
+    spedisce le mail pronte nell'outbox insieme agli altri worker."""
+    svolte = {"proprietario": PROPRIETARIO, "partizioni": 0, "mail": 0}
+    db = SessionLocal()
+    try:
+        while True:
+            partizione = reclama_partizione(db, run_id)
+            if partizione is None:
+                break
+            try:
+                svolte["mail"] += processa_partizione(db, partizione)
+                svolte["partizioni"] += 1
+            except Exception as e:
+                db.rollback()
+                logging.exception("Partizione %s/%s del run %s fallita", partizione.tipo, partizione.numero, run_id)
+                db.execute(
+                    update(models.DispatchPartizione)
+                    .where(models.DispatchPartizione.id == partizione.id)
+                    .values(stato="errore", errore=f"{type(e).__name__}: {e}"[:2000], scadenza=datetime.utcnow())
+                )
+                db.commit()
+        # invio: tutti i worker svuotano l'outbox insieme, a lotti piccoli
+        asyncio.run(outbox.svuota_outbox(lotto=DISPATCH_LOTTO_MAIL))
+        chiudi_run_se_finito(db, run_id)
+    finally:
+        db.close()
+    return svolte
+
+
+def chiudi_run_se_finito(db: Session, run_id: int):
+    """Barriera: chiude il run (una volta sola) quando tutte le partizioni sono terminate."""
+    run = db.get(models.DispatchRun, run_id, populate_existing=True)
+    if run.stato != "in_corso":
+        return run
+
+    adesso = datetime.utcnow()
+    partizioni = db.scalars(
+        select(models.DispatchPartizione).where(models.DispatchPartizione.run_id == run_id)
+        .execution_options(populate_existing=True)
+    ).all()
+    fallite = []
+    for p in partizioni:
+        if p.stato == "completata":
+            continue
+        esaurita = p.tentativi >= DISPATCH_MAX_TENTATIVI and (
+            p.stato == "errore" or (p.scadenza is not None and p.scadenza < adesso)
+        )
+        if not esaurita:
+            return run  # ancora in lavorazione o da riprendere
+        fallite.append(f"{p.tipo}/{p.numero}: {p.errore or 'worker interrotto'}")
+
+    per_worker = defaultdict(int)
+    for p in partizioni:
+        if p.stato == "completata":
+            per_worker[p.proprietario] += 1
+    riepilogo = {
+        "ordini": run.n_ordini,
+        "partizioni": len(partizioni),
+        "completate": len(partizioni) - len(fallite),
+        "fallite": fallite,
+        "mail_accodate": sum(p.n_mail for p in partizioni),
+        "partizioni_per_worker": dict(per_worker),
+        "durata_secondi": round((adesso - run.creato_il).total_seconds(), 1),
+    }
+    db.execute(
+        update(models.DispatchRun)
+        .where(models.DispatchRun.id == run_id, models.DispatchRun.stato == "in_corso")
+        .values(
+            stato="con_errori" if fallite else "completato",
+            riepilogo=json.dumps(riepilogo),
+            completato_il=adesso,
+        )
+    )
+    db.commit()
+    return db.get(models.DispatchRun, run_id, populate_existing=True)
+
+
+def riprendi_run_con_errori(db: Session, adesso: datetime = None) -> list:
+    """Riapre i run chiusi con partizioni fallite da almeno DISPATCH_RIPRESA_MINUTI,
+    con i tentativi azzerati. Ritorna gli id dei run riaperti."""
+    R, P = models.DispatchRun, models.DispatchPartizione
+    adesso = adesso or datetime.utcnow()
+    run_ids = db.scalars(
+        select(R.id).where(
+            R.stato == "con_errori",
+            R.completato_il < adesso - timedelta(minutes=DISPATCH_RIPRESA_MINUTI),
+        )
+    ).all()
+    riaperti = []
+    for run_id in run_ids:
+        # UPDATE condizionato: con più nodi il run lo riapre uno solo
+        riaperto = db.execute(
+            update(R)
+            .where(R.id == run_id, R.stato == "con_errori")
+            .values(stato="in_corso", completato_il=None)
+        ).rowcount == 1
+        if not riaperto:
+            continue
+        db.execute(
+            update(P)
+            .where(P.run_id == run_id, P.stato != "completata")
+            .values(stato="in_attesa", tentativi=0, proprietario=None, scadenza=None)
+        )
+        riaperti.append(run_id)
+        logging.warning("Dispatch run %s riaperto: partizioni fallite di nuovo in attesa", run_id)
+    db.commit()
+    return riaperti
+
+
+def esegui_dispatch(giorno: date = None, workers: int = None, n_partizioni: int = None, ristorante_ids: list = None):
+    """Crea un run (tutti gli ordini aperti o solo quelli dei ristoranti indicati),
+    lo esegue sul pool di processi e attende la fine.
+
+    Ritorna il riepilogo del run (dict), oppure None se non c'erano ordini.
+    """
+    workers = DISPATCH_WORKERS if workers is None else workers
+    db = SessionLocal()
+    try:
+        run = crea_run(db, giorno or date.today(), n_partizioni, ristorante_ids)
+        if run is None:
+            return None
+        run_id = run.id
+
+        if workers > 1:
+            # spawn: il processo padre ha thread attivi (scheduler, heartbeat del lease)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+                for svolte in pool.map(lavora, [run_id] * workers):
+                    logging.info("Dispatch run %s: %s", run_id, svolte)
+        else:
+            lavora(run_id)
+
+        # barriera: attende anche le partizioni prese da altri nodi, riprendendo quelle scadute
+        limite = time.monotonic() + DISPATCH_TIMEOUT_SECONDI
+        while True:
+            run = chiudi_run_se_finito(db, run_id)
+            if run.stato != "in_corso":
+                break
+            if time.monotonic() > limite:
+                logging.error("Dispatch run %s non completato entro %ss", run_id, DISPATCH_TIMEOUT_SECONDI)
+                return {"run_id": run_id, "stato": run.stato}
+            time.sleep(2)
+            lavora(run_id)
+
+        riepilogo = json.loads(run.riepilogo)
+        riepilogo.update(run_id=run_id, stato=run.stato)
+        return riepilogo
+    finally:
+        db.close()
+
+
+def partecipa_dispatch():
+    """Per gli altri nodi: lavora sulle partizioni dei run ancora in corso,
+    compresi quelli riaperti per riprovare le partizioni fallite."""
+    db = SessionLocal()
+    try:
+        riprendi_run_con_errori(db)
+        run_ids = db.scalars(
+            select(models.DispatchRun.id).where(models.DispatchRun.stato == "in_corso")
+        ).all()
+    finally:
+        db.close()
+    for run_id in run_ids:
+        lavora(run_id)
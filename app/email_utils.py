@@ -1,11 +1,11 @@
 # app/email_utils.py
 
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from email.message import EmailMessage
 import aiosmtplib
 import logging
-from app.database import SessionLocal
-from app import models
 
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.ethereal.email")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
@@ -13,54 +13,149 @@ SMTP_USER = os.getenv("SMTP_USER", "your_ethereal_user")
 SMTP_PASS = os.getenv("SMTP_PASS", "your_ethereal_pass")
 FROM = os.getenv("EMAIL_FROM", SMTP_USER)
 
-async def invia_mail(destinatario: str, oggetto: str, corpo: str, mittente: str = None):
-    mittente = mittente or FROM  # se mittente non passato, usa default
+# Pool di connessioni SMTP per gli invii massivi (job delle 16:00)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") == "1"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", 30))
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", 5))
+SMTP_CONCORRENZA = int(os.getenv("SMTP_CONCORRENZA", SMTP_POOL_SIZE))
+
+
+def crea_messaggio(destinatario: str, oggetto: str, corpo: str, mittente: str = None,
+                   intestazioni: dict = None) -> EmailMessage:
     msg = EmailMessage()
-    msg["From"] = mittente
+    msg["From"] = mittente or FROM  # se mittente non passato, usa default
     msg["To"] = destinatario
     msg["Subject"] = oggetto
+    for nome, valore in (intestazioni or {}).items():
+        msg[nome] = valore
     msg.set_content(corpo)
-    
-    try:
-        resp = await aiosmtplib.send(
-            msg,
-            hostname=SMTP_HOST,
-            port=SMTP_PORT,
-            start_tls=True,
-            username=SMTP_USER,
-            password=SMTP_PASS,
+    return msg
+
+
+class PoolSMTP:
+    """Connessioni SMTP già autenticate, riusate tra un invio e l'altro.
+
+    Ogni connessione fa TCP + STARTTLS + AUTH una volta sola invece che a ogni mail.
+    Le connessioni si aprono su richiesta fino a `dimensione`; una connessione che
+    dà errore viene scartata e sostituita alla richiesta successiva.
+
+        async with PoolSMTP() as pool:
+            await pool.invia(msg)
+    """
+
+    def __init__(self, hostname: str = None, port: int = None, username: str = None, password: str = None,
+                 start_tls: bool = None, dimensione: int = None, timeout: float = None):
+        self.hostname = hostname or SMTP_HOST
+        self.port = port or SMTP_PORT
+        self.username = SMTP_USER if username is None else username
+        self.password = SMTP_PASS if password is None else password
+        self.start_tls = SMTP_STARTTLS if start_tls is None else start_tls
+        self.dimensione = dimensione or SMTP_POOL_SIZE
+        self.timeout = timeout or SMTP_TIMEOUT
+        self._libere = asyncio.Queue()
+        self._slot = asyncio.Semaphore(self.dimensione)
+        self._aperte = set()
+
+    async def _apri(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            start_tls=self.start_tls,
+            username=self.username or None,
+            password=self.password or None,
+            timeout=self.timeout,
         )
+        await smtp.connect()  # connect fa anche STARTTLS e login
+        self._aperte.add(smtp)
+        return smtp
+
+    async def _scarta(self, smtp: aiosmtplib.SMTP):
+        self._aperte.discard(smtp)
+        try:
+            await smtp.quit()
+        except Exception:
+            smtp.close()
+
+    @asynccontextmanager
+    async def connessione(self):
+        async with self._slot:
+            smtp = None
+            while not self._libere.empty():
+                candidata = self._libere.get_nowait()
+                if candidata.is_connected:
+                    smtp = candidata
+                    break
+                self._aperte.discard(candidata)
+            if smtp is None:
+                smtp = await self._apri()
+            try:
+                yield smtp
+            except Exception:
+                # stato della connessione incerto: non la rimettiamo nel pool
+                await self._scarta(smtp)
+                raise
+            else:
+                self._libere.put_nowait(smtp)
+
+    async def invia(self, msg: EmailMessage):
+        try:
+            async with self.connessione() as smtp:
+                return await smtp.send_message(msg)
+        except aiosmtplib.SMTPServerDisconnected:
+            # il server ha chiuso una connessione inattiva: un solo nuovo tentativo
+            async with self.connessione() as smtp:
+                return await smtp.send_message(msg)
+
+    async def chiudi(self):
+        while not self._libere.empty():
+            self._libere.get_nowait()
+        for smtp in list(self._aperte):
+            await self._scarta(smtp)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.chiudi()
+
+
+async def invia_mail(destinatario: str, oggetto: str, corpo: str, mittente: str = None, pool: PoolSMTP = None,
+                     intestazioni: dict = None):
+    msg = crea_messaggio(destinatario, oggetto, corpo, mittente, intestazioni)
+
+    try:
+        if pool:
+            resp = await pool.invia(msg)
+        else:
+            resp = await aiosmtplib.send(
+                msg,
+                hostname=SMTP_HOST,
+                port=SMTP_PORT,
+                start_tls=SMTP_STARTTLS,
+                username=SMTP_USER,
+                password=SMTP_PASS,
+            )
         logging.info("Mail inviata a %s — risposta: %s", destinatario, resp)
     except Exception as e:
         logging.exception("Errore invio mail a %s: %s", destinatario, e)
         raise
-        
-async def invia_ordine(ordine: models.Ordine):
-    db = SessionLocal()
-    try:
-        ordine = db.query(models.Ordine).get(ordine.id)
-        user = ordine.user
-        righe = ordine.righe
-        testo_mail_user = f"Riepilogo ordine #{ordine.id} — Ristorante {ordine.ristorante.nome}\n\n"
-
-        fornitori = {}
-        for r in righe:
-            prodotto = r.prodotto
-            linea = f"- {prodotto.nome} x {r.quantita} = {r.quantita * r.prezzo_unitario:.2f}€\n"
-            testo_mail_user += linea
-            fornitori.setdefault(prodotto.fornitore.email, []).append(linea)
-
-        testo_mail_user += f"\nTotale ordine: {ordine.totale:.2f}€"
-
-        # invia mail utente
-        await invia_mail(user.email, f"Conferma ordine #{ordine.id}", testo_mail_user)
-
-        # invia mail fornitori
-        for email_forn, righe_txt in fornitori.items():
-            corpo = f"Ordine dal ristorante {ordine.ristorante.nome} (#{ordine.id}):\n" + "".join(righe_txt)
-            await invia_mail(email_forn, f"Nuovo ordine #{ordine.id}", corpo)
-
-        ordine.inviato = True
-        db.commit()
-    finally:
-        db.close()
+
+
+async def invia_messaggi(messaggi: list, pool: PoolSMTP, concorrenza: int = None) -> list:
+    """Invia in parallelo (al massimo `concorrenza` alla volta) i messaggi passati.
+
+    messaggi: lista di dict con gli argomenti di invia_mail.
+    Ritorna, nello stesso ordine, None per le mail inviate o l'eccezione per quelle
+    fallite: un errore su una mail non blocca le altre.
+    """
+    semaforo = asyncio.Semaphore(concorrenza or SMTP_CONCORRENZA)
+
+    async def _invia(m):
+        async with semaforo:
+            try:
+                await invia_mail(pool=pool, **m)
+            except Exception as e:
+                return e
+            return None
+
+    return await asyncio.gather(*(_invia(m) for m in messaggi))
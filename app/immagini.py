@@ -0,0 +1,239 @@
+# app/immagini.py
+#
+# Archivio delle immagini caricate, indirizzato per contenuto: il file si chiama
+# come lo sha256 dei suoi byte ed è in una sottocartella a due livelli
+# (uploads/ab/cd/abcd….jpg), quindi la stessa foto caricata due volte occupa un
+# solo file e un URL non cambia mai contenuto (servito con Cache-Control
+# immutable). L'upload è scritto a blocchi su un file temporaneo calcolando
+# l'hash, senza tenerlo tutto in memoria.
+#
+# La tabella immagini conta quanti prodotti usano ogni file; chi cambia
+# prodotti.immagine_url aggiorna il conteggio nella stessa transazione
+# (aggiorna_riferimenti). raccogli_orfane cancella i file senza riferimenti da
+# più di IMMAGINI_GRAZIA_SECONDI.
+#
+# Uso:  python -m app.immagini gc | riconcilia | migra
+
+import hashlib
+import os
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, func, select, update
+from sqlalchemy.orm import Session
+from starlette.staticfiles import StaticFiles
+
+from app import models
+from app.config import UPLOADS_DIR
+from app.database import SessionLocal, insert_dialetto
+
+URL_UPLOADS = "/static/uploads/"
+IMMAGINI_MAX_BYTES = int(os.getenv("IMMAGINI_MAX_MB", 10)) * 1024 * 1024
+# un file appena caricato non ha ancora riferimenti finché il prodotto non è salvato
+IMMAGINI_GRAZIA_SECONDI = int(os.getenv("IMMAGINI_GRAZIA_SECONDI", 3600))
+BLOCCO = 1024 * 1024
+
+# stesse immagini con estensioni equivalenti devono avere lo stesso nome
+ESTENSIONI = {".jpg": ".jpg", ".jpeg": ".jpg", ".png": ".png", ".webp": ".webp", ".gif": ".gif"}
+CACHE_IMMUTABILE = "public, max-age=31536000, immutable"
+
+
+class ErroreImmagine(ValueError):
+    pass
+
+
+class StaticImmutabili(StaticFiles):
+    """StaticFiles per gli upload: il nome cambia con il contenuto, quindi il browser può tenerli per sempre."""
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = CACHE_IMMUTABILE
+        return response
+
+
+def percorso_relativo(digest: str, estensione: str) -> str:
+    return f"{digest[:2]}/{digest[2:4]}/{digest}{estensione}"
+
+
+def percorso_da_url(url: str | None) -> str | None:
+    """Percorso nell'archivio per un URL di immagine; None per URL esterni o vecchi upload."""
+    if not url or not url.startswith(URL_UPLOADS):
+        return None
+    relativo = url[len(URL_UPLOADS):]
+    return relativo if relativo.count("/") == 2 else None
+
+
+def _registra(db: Session, percorso: str, adesso: datetime):
+    I = models.Immagine
+    stmt = insert_dialetto(db, I).values(percorso=percorso, riferimenti=0, aggiornato_il=adesso)
+    db.execute(stmt.on_conflict_do_update(index_elements=["percorso"], set_={"aggiornato_il": adesso}))
+
+
+def salva_stream(flusso, nome_file: str | None) -> str:
+    """Salva l'immagine letta da un file binario aperto e restituisce il suo URL.
+
+    La riga in immagini viene registrata (con una sessione propria, già
+    committata) prima di mettere il file al suo posto: un gc concorrente vede
+    l'immagine come appena usata. Il riferimento lo aggiunge poi chi salva il prodotto.
+    """
+    _, ext = os.path.splitext(nome_file or "")
+    estensione = ESTENSIONI.get(ext.lower() or ".jpg")
+    if estensione is None:
+        raise ErroreImmagine(f"Formato immagine non supportato: {ext}")
+
+    sha = hashlib.sha256()
+    dimensione = 0
+    fd, temporaneo = tempfile.mkstemp(dir=UPLOADS_DIR, prefix=".upload-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while blocco := flusso.read(BLOCCO):
+                dimensione += len(blocco)
+                if dimensione > IMMAGINI_MAX_BYTES:
+                    raise ErroreImmagine(f"Immagine oltre {IMMAGINI_MAX_BYTES // (1024 * 1024)} MB")
+                sha.update(blocco)
+                out.write(blocco)
+        if not dimensione:
+            raise ErroreImmagine("Immagine vuota")
+
+        percorso = percorso_relativo(sha.hexdigest(), estensione)
+        db = SessionLocal()
+        try:
+            _registra(db, percorso, datetime.utcnow())
+            db.commit()
+        finally:
+            db.close()
+
+        destinazione = os.path.join(UPLOADS_DIR, percorso)
+        os.makedirs(os.path.dirname(destinazione), exist_ok=True)
+        # sempre, anche se esiste già: il contenuto è identico e così il file
+        # c'è di sicuro anche se un gc lo stava spostando
+        os.replace(temporaneo, destinazione)
+    finally:
+        if os.path.exists(temporaneo):
+            os.remove(temporaneo)
+    return URL_UPLOADS + percorso
+
+
+def aggiorna_riferimenti(db: Session, aggiunti=(), rimossi=()):
+    """Da chiamare nella transazione che cambia prodotti.immagine_url, senza commit.
+
+    aggiunti/rimossi: URL (anche ripetuti); quelli fuori dall'archivio sono ignorati.
+    """
+    delta = Counter()
+    for url in aggiunti:
+        delta[percorso_da_url(url)] += 1
+    for url in rimossi:
+        delta[percorso_da_url(url)] -= 1
+    delta.pop(None, None)
+
+    adesso = datetime.utcnow()
+    I = models.Immagine
+    for percorso, n in delta.items():
+        if n == 0:
+            continue
+        stmt = insert_dialetto(db, I).values(percorso=percorso, riferimenti=max(n, 0), aggiornato_il=adesso)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=["percorso"],
+            set_={
+                "riferimenti": case((I.riferimenti + n < 0, 0), else_=I.riferimenti + n),
+                "aggiornato_il": adesso,
+            },
+        ))
+
+
+def riconcilia(db: Session):
+    """Ricalcola tutti i conteggi da prodotti.immagine_url (dopo modifiche fatte fuori dall'app)."""
+    conteggi = Counter()
+    for url, n in db.execute(
+        select(models.Prodotto.immagine_url, func.count())
+        .where(models.Prodotto.immagine_url.like(URL_UPLOADS + "%"))
+        .group_by(models.Prodotto.immagine_url)
+    ):
+        percorso = percorso_da_url(url)
+        if percorso:
+            conteggi[percorso] += n
+
+    adesso = datetime.utcnow()
+    I = models.Immagine
+    db.execute(update(I).where(I.percorso.not_in(conteggi), I.riferimenti != 0).values(riferimenti=0, aggiornato_il=adesso))
+    for percorso, n in conteggi.items():
+        stmt = insert_dialetto(db, I).values(percorso=percorso, riferimenti=n, aggiornato_il=adesso)
+        db.execute(stmt.on_conflict_do_update(index_elements=["percorso"], set_={"riferimenti": n}))
+    db.commit()
+
+
+def raccogli_orfane(db: Session, grazia_secondi: int = IMMAGINI_GRAZIA_SECONDI) -> int:
+    """Cancella i file senza riferimenti. Restituisce quanti ne ha rimossi."""
+    I = models.Immagine
+    soglia = datetime.utcnow() - timedelta(seconds=grazia_secondi)
+    candidati = db.scalars(select(I.percorso).where(I.riferimenti == 0, I.aggiornato_il < soglia)).all()
+
+    rimossi = 0
+    for percorso in candidati:
+        file = os.path.join(UPLOADS_DIR, percorso)
+        # il file viene prima spostato: se intanto qualcuno ricarica la stessa
+        # immagine, la DELETE condizionale non trova la riga e lo si rimette a posto
+        sospeso = f"{file}.gc"
+        try:
+            os.replace(file, sospeso)
+        except FileNotFoundError:
+            sospeso = None
+        eliminata = db.execute(
+            delete(I).where(I.percorso == percorso, I.riferimenti == 0, I.aggiornato_il < soglia)
+        ).rowcount
+        db.commit()
+        if sospeso is None:
+            continue
+        if eliminata or os.path.exists(file):
+            os.remove(sospeso)
+            rimossi += bool(eliminata)
+        else:
+            os.replace(sospeso, file)
+    return rimossi
+
+
+def migra_upload_vecchi(db: Session) -> dict:
+    """Sposta i vecchi upload (uuid nella cartella piatta) nell'archivio per contenuto."""
+    esito = {"file": 0, "duplicati": 0, "prodotti": 0}
+    for nome in sorted(os.listdir(UPLOADS_DIR)):
+        vecchio = os.path.join(UPLOADS_DIR, nome)
+        if nome.startswith(".") or nome.endswith(".gc") or not os.path.isfile(vecchio):
+            continue
+        _, ext = os.path.splitext(nome)
+        with open(vecchio, "rb") as f:
+            sha = hashlib.sha256()
+            while blocco := f.read(BLOCCO):
+                sha.update(blocco)
+        percorso = percorso_relativo(sha.hexdigest(), ESTENSIONI.get(ext.lower(), ext.lower()))
+        nuovo = os.path.join(UPLOADS_DIR, percorso)
+        os.makedirs(os.path.dirname(nuovo), exist_ok=True)
+        if os.path.exists(nuovo):
+            esito["duplicati"] += 1
+        esito["prodotti"] += db.execute(
+            update(models.Prodotto)
+            .where(models.Prodotto.immagine_url == URL_UPLOADS + nome)
+            .values(immagine_url=URL_UPLOADS + percorso)
+        ).rowcount
+        _registra(db, percorso, datetime.utcnow())
+        db.commit()
+        os.replace(vecchio, nuovo)
+        esito["file"] += 1
+    riconcilia(db)
+    return esito
+
+
+if __name__ == "__main__":
+    comandi = {
+        "gc": lambda db: f"{raccogli_orfane(db)} file rimossi",
+        "riconcilia": lambda db: riconcilia(db) or "conteggi ricalcolati",
+        "migra": migra_upload_vecchi,
+    }
+    if len(sys.argv) != 2 or sys.argv[1] not in comandi:
+        sys.exit(f"uso: python -m app.immagini {{{'|'.join(comandi)}}}")
+    db = SessionLocal()
+    try:
+        print(comandi[sys.argv[1]](db))
+    finally:
+        db.close()
@@ -1,84 +1,110 @@
 # app/jobs.py
 
 import asyncio
+import os
 from datetime import datetime
 from apscheduler.schedulers.background import BackgroundScheduler
-from sqlalchemy.orm import Session
+from app import dispatch, immagini, metriche, outbox
 from app.database import SessionLocal
-from app import models
-from app.email_utils import invia_mail
+from app.lease import lease
 import logging
 
 
-async def invia_ordini():
-    db: Session = SessionLocal()
-    print(f"[{datetime.now()}] Esecuzione job invio ordini aggregati...")
-
+def invia_ordini():
     try:
-        # Prendo SOLO gli ordini aggregati non inviati
-        ordini = db.query(models.Ordine)\
-                   .filter(models.Ordine.inviato == False)\
-                   .all()
-
-        for ordine in ordini:
-            order_manager_email = ordine.user.email
-            righe = ordine.righe
-
-            # Preparo testo mail per order manager
-            testo_mail_om = f"Riepilogo ordine #{ordine.id} — Ristorante {ordine.ristorante.nome}\n\n"
-
-            # Raggruppo righe per fornitore
-            fornitori = {}  # {email_fornitore: [linee]}
-            for r in righe:
-                prodotto = r.prodotto
-                subtot = r.quantita * r.prezzo_unitario
-                linea = f"- {prodotto.nome} x {r.quantita} = {subtot:.2f}€\n"
-                testo_mail_om += linea
-
-                # Raggruppo per fornitore
-                email_forn = prodotto.fornitore.email
-                if email_forn not in fornitori:
-                    fornitori[email_forn] = []
-                fornitori[email_forn].append(linea)
-
-            testo_mail_om += f"\nTotale ordine aggregato: {ordine.totale:.2f}€"
-
-            # 1️⃣ Invio mail all’order manager (mittente = stesso order manager)
-            await invia_mail(
-                destinatario=order_manager_email,
-                oggetto=f"Conferma ordine aggregato #{ordine.id}",
-                corpo=testo_mail_om,
-                mittente=order_manager_email
-            )
-
-            # 2️⃣ Invio mail a ciascun fornitore
-            for email_forn, righe_txt in fornitori.items():
-                corpo = f"Ordine dal ristorante {ordine.ristorante.nome} (#{ordine.id}):\n" + "".join(righe_txt)
-                await invia_mail(
-                    destinatario=email_forn,
-                    oggetto=f"Nuovo ordine #{ordine.id}",
-                    corpo=corpo,
-                    mittente=order_manager_email
-                )
-
-            # Segno ordine come inviato
-            ordine.inviato = True
-
-        db.commit()
-        print(f"{len(ordini)} ordine/i aggregato/i processato/i e inviato/i.\n")
-
-    except Exception as e:
-        db.rollback()
+        # solo i ristoranti arrivati al proprio orario di invio (app/orari.py)
+        db = SessionLocal()
+        try:
+            ristorante_ids = dispatch.ristoranti_dovuti(db)
+        finally:
+            db.close()
+        if not ristorante_ids:
+            return True
+
+        print(f"[{datetime.now()}] Esecuzione job invio ordini aggregati ({len(ristorante_ids)} ristorante/i)...")
+        # run a partizioni sul pool di processi (vedi app/dispatch.py)
+        riepilogo = dispatch.esegui_dispatch(ristorante_ids=ristorante_ids)
+    except Exception:
         logging.exception("Job invio ordini fallito")
-    finally:
-        db.close()
-
+        return False
 
-def run_job_sync():
-    asyncio.run(invia_ordini())
+    if riepilogo is None:
+        print("Nessun ordine aggregato da inviare.\n")
+    else:
+        print(f"Dispatch completato: {riepilogo}\n")
+    return True
 
 
-# Scheduler che invia tutti gli ordini aggregati ogni giorno alle 16:00
-scheduler = BackgroundScheduler()
-scheduler.add_job(run_job_sync, 'cron', hour=16, minute=0)
-scheduler.start()
+def run_job_sync():
+    # con più processi (worker uvicorn, nodi) il controllo scatta in tutti:
+    # lo esegue solo chi prende il lease
+    with lease("invia_ordini") as l:
+        if l is None:
+            logging.debug("Dispatch già in corso in un altro processo")
+            return
+        with metriche.misura_job("invia_ordini") as m:
+            m.fallito = not invia_ordini()
+
+
+def partecipa_dispatch_sync():
+    # ogni nodo aiuta con le partizioni dei run in corso (e riprende quelle di processi morti)
+    with metriche.misura_job("partecipa_dispatch") as m:
+        try:
+            dispatch.partecipa_dispatch()
+        except Exception:
+            m.fallito = True
+            logging.exception("Partecipazione al dispatch fallita")
+
+
+def svuota_outbox_sync():
+    # più worker in parallelo sono sicuri: ognuno prende in carico lotti diversi
+    with metriche.misura_job("svuota_outbox") as m:
+        try:
+            asyncio.run(outbox.svuota_outbox())
+        except Exception:
+            m.fallito = True
+            logging.exception("Svuotamento outbox fallito")
+
+
+def raccogli_immagini_sync():
+    with lease("immagini_gc") as l:
+        if l is None:
+            return
+        db = SessionLocal()
+        with metriche.misura_job("immagini_gc") as m:
+            try:
+                rimossi = immagini.raccogli_orfane(db)
+                if rimossi:
+                    print(f"[{datetime.now()}] Immagini orfane rimosse: {rimossi}")
+            except Exception:
+                m.fallito = True
+                logging.exception("Pulizia immagini fallita")
+            finally:
+                db.close()
+
+
+# Lo scheduler parte dal lifespan dell'app (app/main.py), non all'import del modulo
+SCHEDULER_ATTIVO = os.getenv("SCHEDULER_ATTIVO", "1") == "1"
+scheduler = None
+
+
+def avvia_scheduler():
+    global scheduler
+    if scheduler is None:
+        scheduler = BackgroundScheduler()
+        # ogni minuto: invia gli ordini dei ristoranti arrivati al proprio orario di invio
+        scheduler.add_job(run_job_sync, 'cron', minute='*')
+        # partizioni dei run in corso e mail rimaste nell'outbox, ogni minuto
+        scheduler.add_job(partecipa_dispatch_sync, 'interval', minutes=1)
+        scheduler.add_job(svuota_outbox_sync, 'interval', minutes=1)
+        # file caricati che nessun prodotto usa più
+        scheduler.add_job(raccogli_immagini_sync, 'cron', hour=3, minute=30)
+        scheduler.start()
+    return scheduler
+
+
+def ferma_scheduler():
+    global scheduler
+    if scheduler is not None:
+        scheduler.shutdown(wait=False)
+        scheduler = None
@@ -0,0 +1,130 @@
+# app/lease.py
+#
+# Lease su DB per i job schedulati. Ogni processo (worker uvicorn, nodo) avvia il
+# proprio scheduler; al momento del job tutti provano a prendere il lease con un
+# UPDATE condizionato e solo uno ci riesce. Chi lo detiene lo rinnova con un
+# heartbeat; se il processo muore il lease scade e un altro può subentrare.
+# ultimo_batch registra l'ultimo batch completato, così chi arriva in ritardo
+# (lease già rilasciato) non riesegue lo stesso batch.
+
+import logging
+import os
+import socket
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, or_, update
+
+from app import models
+from app.database import SessionLocal, insert_dialetto
+
+LEASE_DURATA_SECONDI = int(os.getenv("LEASE_DURATA_SECONDI", 300))
+
+# identifica questo processo nel cluster
+PROPRIETARIO = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def acquisisci(nome: str, batch: str = None, durata: int = None) -> bool:
+    L = models.LeaseJob
+    adesso = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        db.execute(insert_dialetto(db, L).values(nome=nome).on_conflict_do_nothing(index_elements=["nome"]))
+        condizioni = [
+            L.nome == nome,
+            or_(L.proprietario.is_(None), L.scadenza < adesso, L.proprietario == PROPRIETARIO),
+        ]
+        if batch is not None:
+            condizioni.append(or_(L.ultimo_batch.is_(None), L.ultimo_batch != batch))
+        preso = db.execute(
+            update(L)
+            .where(and_(*condizioni))
+            .values(
+                proprietario=PROPRIETARIO,
+                scadenza=adesso + timedelta(seconds=durata or LEASE_DURATA_SECONDI),
+                aggiornato_il=adesso,
+            )
+        ).rowcount == 1
+        db.commit()
+        return preso
+    finally:
+        db.close()
+
+
+def rinnova(nome: str, durata: int = None) -> bool:
+    L = models.LeaseJob
+    adesso = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        ok = db.execute(
+            update(L)
+            .where(L.nome == nome, L.proprietario == PROPRIETARIO)
+            .values(scadenza=adesso + timedelta(seconds=durata or LEASE_DURATA_SECONDI), aggiornato_il=adesso)
+        ).rowcount == 1
+        db.commit()
+        return ok
+    finally:
+        db.close()
+
+
+def rilascia(nome: str, batch_completato: str = None):
+    L = models.LeaseJob
+    valori = {"proprietario": None, "scadenza": None, "aggiornato_il": datetime.utcnow()}
+    if batch_completato is not None:
+        valori["ultimo_batch"] = batch_completato
+    db = SessionLocal()
+    try:
+        db.execute(update(L).where(L.nome == nome, L.proprietario == PROPRIETARIO).values(**valori))
+        db.commit()
+    finally:
+        db.close()
+
+
+class Lease:
+    """Lease preso con successo; `completa()` segna il batch come eseguito."""
+
+    def __init__(self, nome: str, batch: str = None):
+        self.nome = nome
+        self.batch = batch
+        self.completato = False
+
+    def completa(self):
+        self.completato = True
+
+
+@contextmanager
+def lease(nome: str, batch: str = None, durata: int = None):
+    """Esegue il blocco solo se questo processo ottiene il lease (altrimenti yield None).
+
+        with lease("invia_ordini", batch=str(date.today())) as l:
+            if l:
+                ...
+                l.completa()
+    """
+    durata = durata or LEASE_DURATA_SECONDI
+    if not acquisisci(nome, batch, durata):
+        yield None
+        return
+
+    stop = threading.Event()
+
+    def _heartbeat():
+        while not stop.wait(durata / 3):
+            try:
+                if not rinnova(nome, durata):
+                    logging.error("Lease %s perso da %s", nome, PROPRIETARIO)
+                    return
+            except Exception:
+                logging.exception("Rinnovo lease %s fallito", nome)
+
+    battito = threading.Thread(target=_heartbeat, name=f"lease-{nome}", daemon=True)
+    battito.start()
+    corrente = Lease(nome, batch)
+    try:
+        yield corrente
+    finally:
+        stop.set()
+        battito.join()
+        rilascia(nome, batch if corrente.completato else None)
@@ -0,0 +1,291 @@
+# app/listini.py
+#
+# Import dei listini fornitori (CSV o JSON) su prodotti. Le righe vengono lette
+# in streaming e scritte a lotti: per ogni fornitore si carica una volta
+# l'indice dei prodotti esistenti (per SKU e per nome), poi ogni lotto diventa
+# un INSERT multiplo per i prodotti nuovi e un UPDATE per chiave primaria per
+# quelli cambiati. Le righe identiche all'ultimo import (stesso hash) non
+# vengono scritte. Tutto l'import è una sola transazione.
+#
+# Colonne: nome, prezzo obbligatorie; sku, descrizione, immagine_url e
+# fornitore (nome) facoltative. Le colonne assenti dal file non vengono toccate.
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+from collections import namedtuple
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import Session
+
+from app import catalogo, immagini, models
+from app.database import SessionLocal
+
+LISTINI_LOTTO = int(os.getenv("LISTINI_LOTTO", 1000))
+# errori di riga riportati nel riepilogo (il conteggio è sempre completo)
+LISTINI_MAX_ERRORI = 50
+
+COLONNE_FACOLTATIVE = ("sku", "descrizione", "immagine_url")
+
+Esistente = namedtuple("Esistente", "id sku hash_riga nome descrizione immagine_url")
+
+
+class ErroreListino(ValueError):
+    pass
+
+
+# -----------------------------
+# Lettura del file
+# -----------------------------
+def _normalizza(riga: dict) -> dict:
+    return {
+        (k or "").strip().lower(): (v.strip() if isinstance(v, str) else v)
+        for k, v in riga.items()
+    }
+
+
+def leggi_csv(testo: io.TextIOBase):
+    # separatore dall'intestazione: i listini italiani usano spesso ";"
+    intestazione = testo.readline()
+    separatore = max(";,\t", key=intestazione.count)
+    colonne = next(csv.reader([intestazione], delimiter=separatore))
+    for riga in csv.DictReader(testo, fieldnames=colonne, delimiter=separatore):
+        yield _normalizza(riga)
+
+
+def leggi_json(testo: io.TextIOBase):
+    # array JSON oppure NDJSON (un oggetto per riga, letto in streaming)
+    inizio = testo.read(1)
+    while inizio and inizio.isspace():
+        inizio = testo.read(1)
+    if inizio == "[":
+        for riga in json.loads(inizio + testo.read()):
+            yield _normalizza(riga)
+        return
+    prima = inizio + testo.readline()
+    for linea in (prima, *testo):
+        if linea.strip():
+            yield _normalizza(json.loads(linea))
+
+
+def leggi_righe(flusso, formato: str):
+    """Righe del listino da un file binario aperto, senza caricarlo tutto in memoria."""
+    testo = io.TextIOWrapper(flusso, encoding="utf-8-sig", newline="")
+    if formato == "csv":
+        return leggi_csv(testo)
+    if formato == "json":
+        return leggi_json(testo)
+    raise ErroreListino(f"Formato non supportato: {formato}")
+
+
+def formato_da_nome(nome_file: str) -> str:
+    _, ext = os.path.splitext(nome_file or "")
+    return "json" if ext.lower() in (".json", ".ndjson", ".jsonl") else "csv"
+
+
+# -----------------------------
+# Confronto e scrittura
+# -----------------------------
+def _prezzo(valore) -> float:
+    if isinstance(valore, (int, float)):
+        return float(valore)
+    testo = str(valore).replace("€", "").strip()
+    # formato italiano "1.234,50": il punto separa le migliaia, la virgola i decimali
+    if "," in testo:
+        testo = testo.replace(".", "").replace(",", ".")
+    return float(testo)
+
+
+def hash_riga(valori: dict) -> str:
+    chiave = "\x1f".join(
+        "" if valori.get(c) is None else str(valori[c])
+        for c in ("nome", "prezzo", "sku", "descrizione", "immagine_url")
+    )
+    return hashlib.sha1(chiave.encode()).hexdigest()
+
+
+class Importatore:
+    """Stato di un import: fornitori risolti, indice dei prodotti esistenti, conteggi."""
+
+    def __init__(self, db: Session, fornitore_id: int | None = None):
+        self.db = db
+        self.fornitore_id = fornitore_id
+        self.fornitori = {nome: id_ for id_, nome in db.execute(select(models.Fornitore.id, models.Fornitore.nome))}
+        if fornitore_id is not None and fornitore_id not in self.fornitori.values():
+            raise ErroreListino(f"Fornitore {fornitore_id} non trovato")
+        self.per_id = {}    # id -> Esistente
+        self.per_sku = {}   # (fornitore_id, sku) -> Esistente
+        self.per_nome = {}  # (fornitore_id, nome) -> Esistente (il primo per id)
+        self.indicizzati = set()
+        self.esito = {"inseriti": 0, "aggiornati": 0, "invariati": 0, "errori": 0, "dettaglio_errori": []}
+
+    def _errore(self, numero: int, messaggio: str):
+        self.esito["errori"] += 1
+        if len(self.esito["dettaglio_errori"]) < LISTINI_MAX_ERRORI:
+            self.esito["dettaglio_errori"].append(f"riga {numero}: {messaggio}")
+
+    def _registra(self, fornitore_id: int, esistente: Esistente):
+        self.per_id[esistente.id] = esistente
+        if esistente.sku:
+            self.per_sku[(fornitore_id, esistente.sku)] = esistente
+        attuale = self.per_nome.get((fornitore_id, esistente.nome))
+        if attuale is None or attuale.id >= esistente.id:
+            self.per_nome[(fornitore_id, esistente.nome)] = esistente
+
+    def _indicizza(self, fornitore_id: int):
+        # una query per fornitore, alla prima riga che lo riguarda
+        if fornitore_id in self.indicizzati:
+            return
+        self.indicizzati.add(fornitore_id)
+        P = models.Prodotto
+        for id_, nome, sku, h, descrizione, immagine_url in self.db.execute(
+            select(P.id, P.nome, P.sku, P.hash_riga, P.descrizione, P.immagine_url)
+            .where(P.fornitore_id == fornitore_id)
+            .order_by(P.id)
+        ):
+            self._registra(fornitore_id, Esistente(id_, sku, h, nome, descrizione, immagine_url))
+
+    def _valida(self, numero: int, riga: dict):
+        if self.fornitore_id is not None:
+            fornitore_id = self.fornitore_id
+        else:
+            fornitore_id = self.fornitori.get(riga.get("fornitore"))
+            if fornitore_id is None:
+                self._errore(numero, f"fornitore sconosciuto: {riga.get('fornitore')!r}")
+                return None
+        if not riga.get("nome"):
+            self._errore(numero, "nome mancante")
+            return None
+        try:
+            prezzo = _prezzo(riga.get("prezzo"))
+        except (TypeError, ValueError):
+            self._errore(numero, f"prezzo non valido: {riga.get('prezzo')!r}")
+            return None
+        if prezzo < 0:
+            self._errore(numero, "prezzo negativo")
+            return None
+
+        valori = {"nome": riga["nome"], "prezzo": prezzo, "fornitore_id": fornitore_id}
+        for c in COLONNE_FACOLTATIVE:
+            if c in riga:
+                valori[c] = riga[c] or None
+        valori["hash_riga"] = hash_riga(valori)
+        return valori
+
+    def processa_lotto(self, lotto: list):
+        # prima una riga per prodotto (l'ultima occorrenza nel file vince), poi il
+        # confronto con l'hash salvato: una riga precedente diversa non deve
+        # restare da scrivere se l'ultima coincide con quanto già nel DB
+        risolte = {}  # chiave -> (Esistente o None, valori)
+        for numero, riga in lotto:
+            valori = self._valida(numero, riga)
+            if valori is None:
+                continue
+            f = valori["fornitore_id"]
+            self._indicizza(f)
+            sku = valori.get("sku")
+            esistente = self.per_sku.get((f, sku)) if sku else None
+            if esistente is None:
+                # per nome solo se quel prodotto non ha già un altro SKU
+                per_nome = self.per_nome.get((f, valori["nome"]))
+                if per_nome and not (sku and per_nome.sku):
+                    esistente = per_nome
+            if esistente is None:
+                chiave = (f, "sku", sku) if sku else (f, "nome", valori["nome"])
+            else:
+                chiave = ("id", esistente.id)
+            risolte[chiave] = (esistente, valori)
+
+        nuovi = []       # valori
+        modificati = {}  # id -> valori
+        for esistente, valori in risolte.values():
+            if esistente is None:
+                nuovi.append(valori)
+            elif esistente.hash_riga == valori["hash_riga"]:
+                self.esito["invariati"] += 1
+            else:
+                modifica = dict(valori, id=esistente.id)
+                # nome e descrizione invariati restano fuori dall'UPDATE: non fanno
+                # scattare il trigger dell'indice full-text (vedi app/ricerca.py)
+                for c in ("nome", "descrizione", "immagine_url"):
+                    if c in modifica and modifica[c] == getattr(esistente, c):
+                        del modifica[c]
+                modificati[esistente.id] = modifica
+
+        if nuovi:
+            P = models.Prodotto
+            righe = nuovi
+            ids = self.db.scalars(insert(P).returning(P.id, sort_by_parameter_order=True), righe).all()
+            for id_, valori in zip(ids, righe):
+                self._registra(
+                    valori["fornitore_id"],
+                    Esistente(
+                        id_, valori.get("sku"), valori["hash_riga"],
+                        valori["nome"], valori.get("descrizione"), valori.get("immagine_url"),
+                    ),
+                )
+            immagini.aggiorna_riferimenti(self.db, aggiunti=[v.get("immagine_url") for v in righe])
+            self.esito["inseriti"] += len(righe)
+
+        if modificati:
+            # UPDATE per chiave primaria, raggruppato per insieme di colonne
+            per_colonne = {}
+            for valori in modificati.values():
+                per_colonne.setdefault(tuple(sorted(valori)), []).append(valori)
+            for righe in per_colonne.values():
+                self.db.execute(update(models.Prodotto), righe)
+            cambio_immagine = [v for v in modificati.values() if "immagine_url" in v]
+            immagini.aggiorna_riferimenti(
+                self.db,
+                aggiunti=[v["immagine_url"] for v in cambio_immagine],
+                rimossi=[self.per_id[v["id"]].immagine_url for v in cambio_immagine],
+            )
+            for valori in modificati.values():
+                precedente = self.per_id[valori["id"]]
+                esistente = precedente._replace(
+                    hash_riga=valori["hash_riga"],
+                    **{c: valori[c] for c in ("sku", "nome", "descrizione", "immagine_url") if c in valori},
+                )
+                self._registra(valori["fornitore_id"], esistente)
+            self.esito["aggiornati"] += len(modificati)
+
+
+def importa_listino(db: Session, righe, fornitore_id: int | None = None, lotto: int = LISTINI_LOTTO) -> dict:
+    """Importa le righe (iterabile di dict) e fa commit. Restituisce i conteggi."""
+    importatore = Importatore(db, fornitore_id)
+    corrente = []
+    try:
+        for numero, riga in enumerate(righe, start=1):
+            corrente.append((numero, riga))
+            if len(corrente) >= lotto:
+                importatore.processa_lotto(corrente)
+                corrente = []
+        importatore.processa_lotto(corrente)
+    except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as e:
+        db.rollback()
+        raise ErroreListino(f"File non leggibile: {e}") from e
+
+    if importatore.esito["inseriti"] or importatore.esito["aggiornati"]:
+        catalogo.incrementa_versioni(db, "prodotti")
+        db.commit()
+        catalogo.invalida()
+    return importatore.esito
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa un listino fornitore (CSV o JSON)")
+    parser.add_argument("file")
+    parser.add_argument("--fornitore-id", type=int, default=None)
+    parser.add_argument("--formato", choices=("csv", "json"), default=None)
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        with open(args.file, "rb") as f:
+            esito = importa_listino(db, leggi_righe(f, args.formato or formato_da_nome(args.file)), args.fornitore_id)
+    finally:
+        db.close()
+    print(json.dumps(esito, indent=2, ensure_ascii=False))
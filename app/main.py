@@ -1,46 +1,63 @@
 # app/main.py
 
 import os
+import secrets
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request, Form, HTTPException, Body, Depends
-from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, JSONResponse, Response
+from starlette.concurrency import run_in_threadpool
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.sessions import SessionMiddleware
 from starlette.staticfiles import StaticFiles
-from passlib.hash import bcrypt
-from sqlalchemy.orm import joinedload, Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload, Session
 from sqlalchemy.exc import IntegrityError
 from typing import List
 
-from app import models
-from app.database import SessionLocal
+from app import catalogo, immagini, jobs, metriche, models, statistiche_sql
+from app import password as password_pool
+from app.database import SessionLocal, get_async_db
+from app.dependencies import get_principal, invalida_principal
 from app.routers import prodotti as prodotti_router
 from app.routers import ordini as ordini_router
 from app.routers import ristoranti as ristoranti_router
+from app.routers import fornitori as fornitori_router
+from app.routers import report as report_router
 from app.config import BASE_DIR, STATIC_DIR, UPLOADS_DIR
 
-app = FastAPI()
+# --- Scheduler job (uno per processo; il lease su DB evita esecuzioni doppie) ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if jobs.SCHEDULER_ATTIVO:
+        jobs.avvia_scheduler()
+    await password_pool.avvia()
+    yield
+    jobs.ferma_scheduler()
+    password_pool.chiudi()
+
+app = FastAPI(lifespan=lifespan)
 
 # --- Sessioni ---
 app.add_middleware(SessionMiddleware, secret_key="supersecretkey")
 
+# --- Query SQL per richiesta (intestazioni X-Query-*, N+1, budget) ---
+app.add_middleware(statistiche_sql.MiddlewareQuery)
+
+# --- Metriche (aggiunto per ultimo: è il più esterno e misura tutta la richiesta) ---
+app.add_middleware(metriche.MiddlewareMetriche)
+# token per lo scraper Prometheus, che non ha una sessione (facoltativo)
+METRICHE_TOKEN = os.getenv("METRICHE_TOKEN")
+
 # --- Templates ---
 templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
 
 # --- Static / Uploads ---
+# gli upload hanno nomi per contenuto: cache immutabile (montato prima di /static)
+app.mount("/static/uploads", immagini.StaticImmutabili(directory=UPLOADS_DIR), name="uploads")
 app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 # --- Helpers ---
-def get_user_by_email(email: str):
-    db = SessionLocal()
-    user = (
-        db.query(models.User)
-        .options(joinedload(models.User.ruoli))
-        .filter(models.User.email == email)
-        .first()
-    )
-    db.close()
-    return user
-
 def get_db():
     db = SessionLocal()
     try:
@@ -59,9 +76,28 @@ def auth_form(request: Request):
     return templates.TemplateResponse("auth.html", {"request": request})
 
 @app.post("/login")
-def login(request: Request, email: str = Form(...), password: str = Form(...)):
-    user = get_user_by_email(email)
-    if not user or not bcrypt.verify(password, user.hashed_password):
+async def login(
+    request: Request,
+    email: str = Form(...),
+    password: str = Form(...),
+    db: AsyncSession = Depends(get_async_db),
+):
+    user = await db.scalar(
+        select(models.User).options(selectinload(models.User.ruoli)).where(models.User.email == email)
+    )
+    valida, nuovo_hash = False, None
+    if user:
+        try:
+            # bcrypt nel pool di processi: non blocca né l'event loop né il threadpool
+            valida, nuovo_hash = await password_pool.verifica(password, user.hashed_password)
+        except password_pool.PasswordOccupato:
+            return templates.TemplateResponse(
+                "auth.html",
+                {"request": request, "error": "Troppi accessi in corso, riprova tra qualche secondo"},
+                status_code=503,
+                headers={"Retry-After": "5"},
+            )
+    if not valida:
         return templates.TemplateResponse(
             "auth.html",
             {"request": request, "error": "Email o password non validi"},
@@ -72,6 +108,11 @@ def login(request: Request, email: str = Form(...), password: str = Form(...)):
             {"request": request, "error": "Account in attesa di approvazione"},
         )
 
+    if nuovo_hash:
+        # hash con un costo diverso da BCRYPT_ROUNDS: si aggiorna ora che si conosce la password
+        user.hashed_password = nuovo_hash
+        await db.commit()
+
     request.session["user_id"] = user.id
     request.session["user_email"] = user.email
     request.session["ruoli"] = [ruolo.ruolo for ruolo in user.ruoli]
@@ -79,13 +120,14 @@ def login(request: Request, email: str = Form(...), password: str = Form(...)):
 
 # --- Auth (registrazione) ---
 @app.post("/register", response_class=HTMLResponse)
-def register(
+async def register(
     request: Request,
     email: str = Form(...),
     password: str = Form(...),
     password2: str = Form(...),
     nome_ristorante: str = Form(...),
     ruoli: List[str] = Form([]),
+    db: AsyncSession = Depends(get_async_db),
 ):
     if password != password2:
         return templates.TemplateResponse(
@@ -93,41 +135,36 @@ def register(
             {"request": request, "error": "Le password non coincidono"},
         )
 
-    db = SessionLocal()
     try:
-        hashed = bcrypt.hash(password)
-
-        # --- Creiamo direttamente l'utente (is_active=False) ---
-        user = models.User(
-            email=email,
-            hashed_password=hashed,
-            is_active=False,  # utente in attesa
-            ristorante_richiesto=nome_ristorante
+        hashed = await password_pool.calcola_hash(password)
+    except password_pool.PasswordOccupato:
+        return templates.TemplateResponse(
+            "auth.html",
+            {"request": request, "error": "Troppe richieste in corso, riprova tra qualche secondo"},
+            status_code=503,
+            headers={"Retry-After": "5"},
         )
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-
-        # Associa ruoli richiesti se presenti
-        if ruoli:
-            ruoli_obj = db.query(models.Ruolo).filter(models.Ruolo.ruolo.in_(ruoli)).all()
-            user.ruoli_richiesti = ruoli_obj
-            db.commit()
-
-        # Eventuale associazione ruoli richiesta
-        if ruoli:
-            ruoli_obj = db.query(models.Ruolo).filter(models.Ruolo.ruolo.in_(ruoli)).all()
-            user.ruoli_richiesti = ruoli_obj  # se vuoi memorizzare richieste
-            db.commit()
 
+    # --- Creiamo direttamente l'utente (is_active=False) con i ruoli richiesti ---
+    ruoli_obj = []
+    if ruoli:
+        ruoli_obj = (await db.scalars(select(models.Ruolo).where(models.Ruolo.ruolo.in_(ruoli)))).all()
+    user = models.User(
+        email=email,
+        hashed_password=hashed,
+        is_active=False,  # utente in attesa
+        ristorante_richiesto=nome_ristorante,
+        ruoli_richiesti=list(ruoli_obj),
+    )
+    db.add(user)
+    try:
+        await db.commit()
     except IntegrityError:
-        db.rollback()
+        await db.rollback()
         return templates.TemplateResponse(
             "auth.html",
             {"request": request, "error": "Email già registrata"},
         )
-    finally:
-        db.close()
 
     return templates.TemplateResponse(
         "auth.html",
@@ -167,13 +204,13 @@ def dashboard_aggregato(request: Request, ristorante_id: int = None, db: Session
     if not request.session.get("user_id"):
         return RedirectResponse("/", status_code=302)
 
-    user_id = request.session.get("user_id")
-    user = db.query(models.User).get(user_id)
-    if not user or not user.ristoranti:
+    # ristoranti dal principal: niente lazy load di user.ristoranti
+    principal = get_principal(request)
+    if not principal.ristorante_ids:
         return HTMLResponse("<h2>Nessun ristorante associato</h2>")
 
     if ristorante_id is None:
-        ristorante_id = user.ristoranti[0].id
+        ristorante_id = min(principal.ristorante_ids)
 
     ristorante = db.query(models.Ristorante).filter(models.Ristorante.id == ristorante_id).first()
     if not ristorante:
@@ -200,13 +237,13 @@ def dashboard_ruolo(request: Request, ruolo: str, ristorante_id: int | None = No
     if "superuser" in ruoli_utente or ruolo in ruoli_utente:
         db = SessionLocal()
         try:
-            user_obj = db.query(models.User).options(
-                joinedload(models.User.ristoranti)
-                .joinedload(models.Ristorante.prodotti_visibili)
-            ).filter(models.User.email == email_utente).first()
-
             if ruolo == "order_manager":
-                ristoranti = user_obj.ristoranti
+                # solo (id, nome) dei ristoranti dell'utente: i prodotti arrivano dallo snapshot
+                ristoranti = db.query(models.Ristorante.id, models.Ristorante.nome).join(
+                    models.user_ristoranti, models.user_ristoranti.c.ristorante_id == models.Ristorante.id
+                ).filter(
+                    models.user_ristoranti.c.user_id == request.session["user_id"]
+                ).order_by(models.Ristorante.id).all()
 
                 if not ristoranti:
                     return HTMLResponse("<h2>Nessun ristorante associato</h2>")
@@ -220,26 +257,26 @@ def dashboard_ruolo(request: Request, ruolo: str, ristorante_id: int | None = No
                             "dashboards/order_manager_select.html",
                             {"request": request, "ristoranti": ristoranti},
                         )
+                elif "superuser" not in ruoli_utente and ristorante_id not in {r.id for r in ristoranti}:
+                    return HTMLResponse("<h2>Non sei associato a questo ristorante</h2>", status_code=403)
 
-                # Recupero il ristorante selezionato
-                ristorante = db.query(models.Ristorante).filter(
-                    models.Ristorante.id == ristorante_id
-                ).first()
-                if not ristorante:
+                # Catalogo del ristorante selezionato (dalla cache, vedi app/catalogo.py)
+                snapshot = catalogo.snapshot_ristorante(db, ristorante_id)
+                if snapshot is None:
                     return HTMLResponse("<h2>Ristorante non trovato</h2>")
 
-                prodotti = ristorante.prodotti_visibili
-
                 return templates.TemplateResponse(
                     "dashboards/order_manager.html",
                     {
                         "request": request,
-                        "user": user_obj,
-                        "prodotti": prodotti,
-                        "ristorante": ristorante,
+                        "user": {"email": email_utente},
+                        "prodotti": snapshot.prodotti,
+                        "ristorante": snapshot,
                     },
                 )
 
+            user_obj = db.query(models.User).filter(models.User.email == email_utente).first()
+
             # altri ruoli → come prima
             return templates.TemplateResponse(
                 f"dashboards/{ruolo}.html",
@@ -303,6 +340,7 @@ def approve_user(user_id: int, payload: dict = Body({}), request: Request = None
         elif nome_ristorante:
             ristorante = models.Ristorante(nome=nome_ristorante)
             db.add(ristorante)
+            catalogo.incrementa_versioni(db, "ristoranti")
             db.commit()
             db.refresh(ristorante)
         else:
@@ -318,6 +356,8 @@ def approve_user(user_id: int, payload: dict = Body({}), request: Request = None
             user.ruoli = ruoli_obj
 
         db.commit()
+        # ruoli e stato cambiati: il principal in cache non è più valido
+        invalida_principal([user_id])
         return {"ok": True, "msg": "Utente approvato"}
 
     finally:
@@ -348,6 +388,7 @@ def modify_user_ristorante(user_id: int, payload: dict = Body(...), db: Session
         user.ristoranti.remove(ristorante)
 
     db.commit()
+    invalida_principal([user_id])
     return {"ok": True}
 
 @app.get("/users/active")
@@ -378,6 +419,18 @@ def dashboard_aggregato(request: Request):
         return RedirectResponse("/", status_code=302)
     return templates.TemplateResponse("dashboards/order_aggregato.html", {"request": request})
 
+# --- Metriche Prometheus: solo superuser (o scraper con METRICHE_TOKEN) ---
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    autorizzazione = request.headers.get("authorization") or ""
+    if not (METRICHE_TOKEN and secrets.compare_digest(autorizzazione, f"Bearer {METRICHE_TOKEN}")):
+        # get_principal può leggere il DB: fuori dall'event loop
+        principal = await run_in_threadpool(get_principal, request)
+        if not principal.is_superuser:
+            raise HTTPException(status_code=403, detail="Non autorizzato")
+    # async: le misure del threadpool si leggono dall'event loop
+    return Response(metriche.esporta(), media_type=metriche.TIPO_CONTENUTO)
+
 # --- Logout ---
 @app.post("/logout")
 def logout(request: Request):
@@ -387,4 +440,6 @@ def logout(request: Request):
 # --- Routers API ---
 app.include_router(prodotti_router.router)
 app.include_router(ristoranti_router.router)
+app.include_router(fornitori_router.router)
 app.include_router(ordini_router.router)
+app.include_router(report_router.router)
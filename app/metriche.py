@@ -0,0 +1,267 @@
+# app/metriche.py
+#
+# Metriche del processo in formato testo Prometheus, esposte da GET /metrics
+# (solo superuser, vedi app/main.py). Registro minimo senza dipendenze:
+# contatori, misure e istogrammi con etichette, aggiornati sotto un lock per
+# metrica. Le misure che costano qualcosa da leggere (threadpool, pool delle
+# password) sono calcolate solo quando /metrics viene letto.
+#
+# MiddlewareMetriche registra per ogni richiesta HTTP durata, stato e byte
+# della risposta, con la rotta come template ("/prodotti/{prodotto_id}") e non
+# come path, così il numero di serie resta limitato.
+
+import threading
+import time
+from bisect import bisect_left
+
+import anyio.to_thread
+
+# secondi: da 5 ms (cache, 304) a 10 s (export, import listini)
+BUCKET_DURATA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BUCKET_BYTE = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# query SQL per richiesta
+BUCKET_QUERY = (1, 2, 5, 10, 20, 50, 100, 250)
+# job in background: da pochi secondi a ore (dispatch, gc immagini)
+BUCKET_JOB = (0.1, 0.5, 1, 5, 15, 30, 60, 300, 900, 3600)
+
+TIPO_CONTENUTO = "text/plain; version=0.0.4; charset=utf-8"
+
+_registro = []
+
+
+def _formatta(valore) -> str:
+    if isinstance(valore, float) and valore.is_integer():
+        return str(int(valore))
+    return repr(valore) if isinstance(valore, float) else str(valore)
+
+
+def _escape(valore) -> str:
+    return str(valore).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _etichette(nomi, valori, extra=()) -> str:
+    coppie = [*zip(nomi, valori), *extra]
+    if not coppie:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in coppie) + "}"
+
+
+class _Metrica:
+    tipo = ""
+
+    def __init__(self, nome: str, aiuto: str, etichette=()):
+        self.nome = nome
+        self.aiuto = aiuto
+        self.etichette = tuple(etichette)
+        self._valori = {}  # tuple dei valori delle etichette -> valore
+        self._lock = threading.Lock()
+        _registro.append(self)
+
+    def _campioni(self):
+        # (suffisso del nome, valori delle etichette, etichette in più, valore)
+        with self._lock:
+            return [("", k, (), v) for k, v in self._valori.items()]
+
+    def righe(self):
+        yield f"# HELP {self.nome} {self.aiuto}"
+        yield f"# TYPE {self.nome} {self.tipo}"
+        for suffisso, chiave, extra, valore in self._campioni():
+            yield f"{self.nome}{suffisso}{_etichette(self.etichette, chiave, extra)} {_formatta(valore)}"
+
+
+class Contatore(_Metrica):
+    tipo = "counter"
+
+    def inc(self, *etichette, valore=1):
+        with self._lock:
+            self._valori[etichette] = self._valori.get(etichette, 0) + valore
+
+
+class Misura(_Metrica):
+    """Gauge. Con funzione, il valore è letto all'esportazione: un numero o un dict etichette -> numero."""
+
+    tipo = "gauge"
+
+    def __init__(self, nome: str, aiuto: str, etichette=(), funzione=None):
+        super().__init__(nome, aiuto, etichette)
+        self.funzione = funzione
+
+    def imposta(self, valore, *etichette):
+        with self._lock:
+            self._valori[etichette] = valore
+
+    def inc(self, *etichette, valore=1):
+        with self._lock:
+            self._valori[etichette] = self._valori.get(etichette, 0) + valore
+
+    def _campioni(self):
+        if self.funzione is None:
+            return super()._campioni()
+        valore = self.funzione()
+        if isinstance(valore, dict):
+            return [("", k, (), v) for k, v in valore.items()]
+        return [("", (), (), valore)]
+
+
+class Istogramma(_Metrica):
+    tipo = "histogram"
+
+    def __init__(self, nome: str, aiuto: str, etichette=(), bucket=BUCKET_DURATA):
+        super().__init__(nome, aiuto, etichette)
+        self.bucket = tuple(bucket)
+        self._limiti = [_formatta(float(b)) for b in self.bucket] + ["+Inf"]
+
+    def osserva(self, valore, *etichette):
+        i = bisect_left(self.bucket, valore)
+        with self._lock:
+            serie = self._valori.get(etichette)
+            if serie is None:
+                # conteggi per bucket (l'ultimo è +Inf), somma
+                serie = self._valori[etichette] = [[0] * (len(self.bucket) + 1), 0.0]
+            serie[0][i] += 1
+            serie[1] += valore
+
+    def _campioni(self):
+        with self._lock:
+            copia = [(k, list(conteggi), somma) for k, (conteggi, somma) in self._valori.items()]
+        campioni = []
+        for chiave, conteggi, somma in copia:
+            cumulato = 0
+            for limite, n in zip(self._limiti, conteggi):
+                cumulato += n
+                campioni.append(("_bucket", chiave, (("le", limite),), cumulato))
+            campioni.append(("_sum", chiave, (), somma))
+            campioni.append(("_count", chiave, (), cumulato))
+        return campioni
+
+
+def esporta() -> str:
+    """Tutte le metriche registrate, in formato testo Prometheus."""
+    righe = []
+    for metrica in _registro:
+        righe.extend(metrica.righe())
+    return "\n".join(righe) + "\n"
+
+
+# -----------------------------
+# Metriche dell'app
+# -----------------------------
+HTTP_DURATA = Istogramma(
+    "http_request_duration_seconds", "Durata delle richieste HTTP", ("method", "route")
+)
+HTTP_RICHIESTE = Contatore(
+    "http_requests_total", "Richieste HTTP completate", ("method", "route", "status")
+)
+HTTP_BYTE = Istogramma(
+    "http_response_size_bytes", "Byte del corpo delle risposte HTTP", ("method", "route"), bucket=BUCKET_BYTE
+)
+HTTP_IN_CORSO = Misura("http_requests_in_flight", "Richieste HTTP in corso")
+
+DB_ATTESA_CONNESSIONE = Istogramma(
+    "db_pool_checkout_wait_seconds", "Attesa per ottenere una connessione dal pool del DB", ("engine",)
+)
+
+SQL_QUERY = Istogramma("http_db_queries", "Query SQL per richiesta HTTP", ("route",), bucket=BUCKET_QUERY)
+SQL_TEMPO = Istogramma("http_db_time_seconds", "Tempo nel DB per richiesta HTTP", ("route",))
+SQL_N1 = Contatore("db_n_plus_one_total", "Richieste con la stessa query ripetuta (N+1 sospetti)", ("route",))
+SQL_BUDGET = Contatore("db_query_budget_exceeded_total", "Richieste oltre il budget di query dell'endpoint", ("route",))
+
+JOB_DURATA = Istogramma("job_duration_seconds", "Durata dei job in background", ("job",), bucket=BUCKET_JOB)
+JOB_ERRORI = Contatore("job_failures_total", "Job in background terminati con errore", ("job",))
+
+PASSWORD_ATTESA = Istogramma("password_queue_wait_seconds", "Attesa in coda del pool delle password")
+PASSWORD_CALCOLO = Istogramma("password_hash_seconds", "Tempo di calcolo bcrypt nei processi del pool")
+PASSWORD_RIFIUTATE = Contatore("password_rejected_total", "Hash/verifiche rifiutati a pool pieno")
+
+
+def _threadpool() -> dict:
+    # limiter di anyio usato da Starlette per gli endpoint sync: si legge solo dall'event loop
+    try:
+        limiter = anyio.to_thread.current_default_thread_limiter()
+    except RuntimeError:
+        return {}
+    return {
+        ("occupati",): limiter.borrowed_tokens,
+        ("totali",): limiter.total_tokens,
+        ("in_attesa",): limiter.statistics().tasks_waiting,
+    }
+
+
+THREADPOOL = Misura("threadpool_threads", "Thread del threadpool (occupati, totali, task in attesa)", ("stato",), _threadpool)
+
+
+# -----------------------------
+# Middleware ASGI
+# -----------------------------
+_rotte = {}  # app -> {endpoint: template della rotta}
+
+
+def rotta(scope) -> str:
+    """Template della rotta servita (da chiamare dopo che il router ha risolto l'endpoint)."""
+    endpoint = scope.get("endpoint")
+    if endpoint is None:
+        return "non_trovata"
+    app = scope["app"]
+    rotte = _rotte.get(app)
+    if rotte is None:
+        # le rotte sono tutte registrate alla prima richiesta
+        rotte = _rotte[app] = {
+            getattr(r, "endpoint", None) or getattr(r, "app", None): r.path
+            for r in app.routes
+        }
+    return rotte.get(endpoint, "altro")
+
+
+class MiddlewareMetriche:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stato = 500
+        dimensione = 0
+
+        async def send_misurato(messaggio):
+            nonlocal stato, dimensione
+            if messaggio["type"] == "http.response.start":
+                stato = messaggio["status"]
+            elif messaggio["type"] == "http.response.body":
+                dimensione += len(messaggio.get("body", b""))
+            await send(messaggio)
+
+        HTTP_IN_CORSO.inc()
+        inizio = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_misurato)
+        finally:
+            durata = time.perf_counter() - inizio
+            HTTP_IN_CORSO.inc(valore=-1)
+            metodo, template = scope["method"], rotta(scope)
+            HTTP_DURATA.osserva(durata, metodo, template)
+            HTTP_RICHIESTE.inc(metodo, template, str(stato))
+            HTTP_BYTE.osserva(dimensione, metodo, template)
+
+
+# -----------------------------
+# Job in background
+# -----------------------------
+class misura_job:
+    """Context manager per i job: durata sempre; errore se esce con un'eccezione
+    o se il job, che gestisce da sé le eccezioni, imposta fallito = True."""
+
+    def __init__(self, nome: str):
+        self.nome = nome
+        self.fallito = False
+
+    def __enter__(self):
+        self.inizio = time.perf_counter()
+        return self
+
+    def __exit__(self, tipo, *_):
+        JOB_DURATA.osserva(time.perf_counter() - self.inizio, self.nome)
+        if tipo is not None or self.fallito:
+            JOB_ERRORI.inc(self.nome)
+        return False
@@ -1,6 +1,6 @@
 # app/models.py
 
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Table, Float, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Table, Float, Date, DateTime, Time, Index, Text, UniqueConstraint, DDL, event, func
 from sqlalchemy.orm import relationship, backref
 from .database import Base
 from datetime import datetime
@@ -23,6 +23,8 @@ product_visibility = Table(
     Base.metadata,
     Column("ristorante_id", Integer, ForeignKey("ristoranti.id"), primary_key=True),
     Column("prodotto_id", Integer, ForeignKey("prodotti.id"), primary_key=True),
+    # ricerca inversa: in quali ristoranti è visibile un prodotto
+    Index("ix_product_visibility_prodotto_id", "prodotto_id"),
 )
 
 # Associazione Registrazione <-> Ruoli richiesti
@@ -144,6 +146,9 @@ class Prodotto(Base):
     descrizione = Column(String, nullable=True)
     prezzo = Column(Float, nullable=False)
     immagine_url = Column(String, nullable=True)
+    # codice articolo del fornitore e hash dell'ultima riga di listino importata (vedi app/listini.py)
+    sku = Column(String, nullable=True)
+    hash_riga = Column(String, nullable=True)
 
     fornitore_id = Column(Integer, ForeignKey("fornitori.id"))
 
@@ -156,6 +161,40 @@ class Prodotto(Base):
     )
     ordini = relationship("OrderItem", back_populates="prodotto")
 
+    __table_args__ = (
+        # più prodotti senza SKU per fornitore: NULL è sempre distinto
+        Index("uq_prodotti_fornitore_sku", "fornitore_id", "sku", unique=True),
+    )
+
+# Indice full-text su nome e descrizione (solo SQLite, FTS5; vedi app/ricerca.py).
+# Tabella "external content" su prodotti, tenuta allineata dai trigger; unicode61
+# con remove_diacritics ignora maiuscole e accenti ("caffe" trova "Caffè") e
+# tratta l'apostrofo come separatore ("dell'olio" -> dell, olio). I prefissi da
+# 2 e 3 caratteri sono indicizzati per l'autocompletamento.
+PRODOTTI_FTS_DDL = (
+    """CREATE VIRTUAL TABLE prodotti_fts USING fts5(
+        nome, descrizione,
+        content='prodotti', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER prodotti_fts_ai AFTER INSERT ON prodotti BEGIN
+        INSERT INTO prodotti_fts(rowid, nome, descrizione) VALUES (new.id, new.nome, new.descrizione);
+    END""",
+    """CREATE TRIGGER prodotti_fts_ad AFTER DELETE ON prodotti BEGIN
+        INSERT INTO prodotti_fts(prodotti_fts, rowid, nome, descrizione) VALUES ('delete', old.id, old.nome, old.descrizione);
+    END""",
+    """CREATE TRIGGER prodotti_fts_au AFTER UPDATE OF nome, descrizione ON prodotti BEGIN
+        INSERT INTO prodotti_fts(prodotti_fts, rowid, nome, descrizione) VALUES ('delete', old.id, old.nome, old.descrizione);
+        INSERT INTO prodotti_fts(rowid, nome, descrizione) VALUES (new.id, new.nome, new.descrizione);
+    END""",
+    "INSERT INTO prodotti_fts(prodotti_fts) VALUES ('rebuild')",
+)
+
+# anche create_all (reset_DB.py, benchmark) crea l'indice
+for _ddl in PRODOTTI_FTS_DDL:
+    event.listen(Prodotto.__table__, "after_create", DDL(_ddl).execute_if(dialect="sqlite"))
+event.listen(Prodotto.__table__, "before_drop", DDL("DROP TABLE IF EXISTS prodotti_fts").execute_if(dialect="sqlite"))
+
 class Ordine(Base):
     __tablename__ = "ordini"
 
@@ -166,11 +205,28 @@ class Ordine(Base):
     totale = Column(Float, nullable=False, default=0.0)
     note = Column(String, nullable=True)
     inviato = Column(Boolean, default=False)
+    dispatch_run_id = Column(Integer, ForeignKey("dispatch_run.id"), nullable=True)  # batch di invio
 
     # relazioni
     user = relationship("User")
     ristorante = relationship("Ristorante")
-    righe = relationship("OrderItem", back_populates="ordine")
+    righe = relationship("OrderItem", back_populates="ordine", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        # un solo carrello aperto (ordine non inviato) per utente e ristorante
+        Index(
+            "uq_ordini_carrello_aperto", "user_id", "ristorante_id",
+            unique=True,
+            sqlite_where=inviato == False,
+            postgresql_where=inviato == False,
+        ),
+        # carrello / ordini dell'order manager
+        Index("ix_ordini_user_ristorante_inviato", "user_id", "ristorante_id", "inviato"),
+        # storico admin e job di invio
+        Index("ix_ordini_ristorante_inviato_data", "ristorante_id", "inviato", data_ordine.desc()),
+        # ordini congelati in un batch di invio
+        Index("ix_ordini_dispatch_run_id", "dispatch_run_id"),
+    )
 
 class OrderItem(Base):
     __tablename__ = "order_items"
@@ -184,3 +240,174 @@ class OrderItem(Base):
     # relazioni
     ordine = relationship("Ordine", back_populates="righe")
     prodotto = relationship("Prodotto", back_populates="ordini")
+
+    __table_args__ = (
+        # righe di un ordine (merge del carrello per prodotto)
+        Index("ix_order_items_ordine_prodotto", "ordine_id", "prodotto_id"),
+        # storico per prodotto / cancellazione prodotti
+        Index("ix_order_items_prodotto_id", "prodotto_id"),
+    )
+
+# -------------------------
+# REPORT (rollup aggiornati dal job di invio ordini)
+# -------------------------
+
+class ReportRistoranteGiorno(Base):
+    __tablename__ = "report_ristorante_giorno"
+
+    ristorante_id = Column(Integer, ForeignKey("ristoranti.id"), primary_key=True)
+    giorno = Column(Date, primary_key=True)
+    n_ordini = Column(Integer, nullable=False, default=0)
+    fatturato = Column(Float, nullable=False, default=0.0)
+
+class ReportProdottoGiorno(Base):
+    __tablename__ = "report_prodotto_giorno"
+
+    ristorante_id = Column(Integer, ForeignKey("ristoranti.id"), primary_key=True)
+    prodotto_id = Column(Integer, ForeignKey("prodotti.id"), primary_key=True)
+    giorno = Column(Date, primary_key=True)
+    quantita = Column(Integer, nullable=False, default=0)
+    fatturato = Column(Float, nullable=False, default=0.0)
+
+    __table_args__ = (
+        # classifiche prodotti per periodo
+        Index("ix_report_prodotto_giorno_giorno", "giorno"),
+    )
+
+class ReportOrderManagerMese(Base):
+    __tablename__ = "report_order_manager_mese"
+
+    ristorante_id = Column(Integer, ForeignKey("ristoranti.id"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    mese = Column(Date, primary_key=True)  # primo giorno del mese
+    n_ordini = Column(Integer, nullable=False, default=0)
+    fatturato = Column(Float, nullable=False, default=0.0)
+
+# -------------------------
+# OUTBOX EMAIL (messaggi renderizzati, inviati dal worker di app/outbox.py)
+# -------------------------
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    chiave = Column(String, unique=True, nullable=False)  # chiave di idempotenza
+    ordine_id = Column(Integer, ForeignKey("ordini.id"), nullable=True)
+    destinatario = Column(String, nullable=False)
+    mittente = Column(String, nullable=True)
+    oggetto = Column(String, nullable=False)
+    corpo = Column(Text, nullable=False)
+    stato = Column(String, nullable=False, default="in_attesa")  # in_attesa | in_invio | inviata | fallita
+    tentativi = Column(Integer, nullable=False, default=0)
+    prossimo_tentativo = Column(DateTime, nullable=False, default=datetime.utcnow)
+    ultimo_errore = Column(Text, nullable=True)
+    lotto = Column(String, nullable=True)  # token del worker che ha preso in carico il messaggio
+    creata_il = Column(DateTime, nullable=False, default=datetime.utcnow)
+    inviata_il = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # messaggi da prendere in carico dal worker
+        Index("ix_email_outbox_stato_prossimo", "stato", "prossimo_tentativo"),
+        Index("ix_email_outbox_lotto", "lotto"),
+    )
+
+# -------------------------
+# LEASE DEI JOB (un solo processo esegue ogni batch schedulato, vedi app/lease.py)
+# -------------------------
+
+class LeaseJob(Base):
+    __tablename__ = "lease_job"
+
+    nome = Column(String, primary_key=True)
+    proprietario = Column(String, nullable=True)  # host:pid:token del processo che lo detiene
+    scadenza = Column(DateTime, nullable=True)
+    ultimo_batch = Column(String, nullable=True)  # ultimo batch completato (es. data del dispatch)
+    aggiornato_il = Column(DateTime, nullable=True)
+
+# -------------------------
+# DISPATCH A PARTIZIONI (vedi app/dispatch.py)
+# -------------------------
+
+class DispatchRun(Base):
+    __tablename__ = "dispatch_run"
+
+    id = Column(Integer, primary_key=True, index=True)
+    giorno = Column(Date, nullable=False)
+    stato = Column(String, nullable=False, default="in_corso")  # in_corso | completato | con_errori
+    n_partizioni = Column(Integer, nullable=False)
+    n_ordini = Column(Integer, nullable=False, default=0)
+    riepilogo = Column(Text, nullable=True)  # JSON con conteggi e tempi
+    creato_il = Column(DateTime, nullable=False, default=datetime.utcnow)
+    completato_il = Column(DateTime, nullable=True)
+
+    partizioni = relationship("DispatchPartizione", back_populates="run")
+
+class DispatchPartizione(Base):
+    __tablename__ = "dispatch_partizione"
+
+    id = Column(Integer, primary_key=True, index=True)
+    run_id = Column(Integer, ForeignKey("dispatch_run.id"), nullable=False)
+    tipo = Column(String, nullable=False)  # fornitori (per hash fornitore) | conferme (per hash ristorante)
+    numero = Column(Integer, nullable=False)
+    stato = Column(String, nullable=False, default="in_attesa")  # in_attesa | in_corso | completata | errore
+    proprietario = Column(String, nullable=True)
+    scadenza = Column(DateTime, nullable=True)
+    tentativi = Column(Integer, nullable=False, default=0)
+    n_mail = Column(Integer, nullable=False, default=0)
+    errore = Column(Text, nullable=True)
+    iniziata_il = Column(DateTime, nullable=True)
+    completata_il = Column(DateTime, nullable=True)
+
+    run = relationship("DispatchRun", back_populates="partizioni")
+
+    __table_args__ = (
+        UniqueConstraint("run_id", "tipo", "numero", name="uq_dispatch_partizione"),
+        Index("ix_dispatch_partizione_run_stato", "run_id", "stato"),
+    )
+
+# -------------------------
+# ORARI DI CUTOFF E INVIO (vedi app/orari.py)
+# -------------------------
+
+class OrarioDispatch(Base):
+    __tablename__ = "orari_dispatch"
+
+    id = Column(Integer, primary_key=True, index=True)
+    # ristorante e/o fornitore; entrambi vuoti = orario globale
+    ristorante_id = Column(Integer, ForeignKey("ristoranti.id"), nullable=True)
+    fornitore_id = Column(Integer, ForeignKey("fornitori.id"), nullable=True)
+    ora_cutoff = Column(Time, nullable=False)
+    ora_invio = Column(Time, nullable=False)
+    fuso_orario = Column(String, nullable=False, default="Europe/Rome")
+
+    __table_args__ = (
+        # un solo orario per combinazione, compresi i default con colonne NULL (che in
+        # un vincolo UNIQUE sarebbero tutti distinti): NULL -> 0, gli id partono da 1
+        Index(
+            "uq_orari_dispatch_ristorante_fornitore",
+            func.coalesce(ristorante_id, 0), func.coalesce(fornitore_id, 0),
+            unique=True,
+        ),
+    )
+
+# -------------------------
+# VERSIONI DEL CATALOGO (ETag delle GET, vedi app/catalogo.py)
+# -------------------------
+
+class VersioneCatalogo(Base):
+    __tablename__ = "versioni_catalogo"
+
+    risorsa = Column(String, primary_key=True)  # prodotti, ristoranti, fornitori, visibilita
+    versione = Column(Integer, nullable=False, default=0)
+    aggiornato_il = Column(DateTime, nullable=False)
+
+# -------------------------
+# IMMAGINI CARICATE (archivio per contenuto, vedi app/immagini.py)
+# -------------------------
+
+class Immagine(Base):
+    __tablename__ = "immagini"
+
+    percorso = Column(String, primary_key=True)  # relativo a static/uploads, es. ab/cd/abcd….jpg
+    riferimenti = Column(Integer, nullable=False, default=0)  # prodotti che la usano
+    aggiornato_il = Column(DateTime, nullable=False)
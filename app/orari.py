@@ -0,0 +1,87 @@
+# app/orari.py
+#
+# Orari di cutoff (fino a quando si ordina) e di invio (quando parte il dispatch)
+# per ristorante e per fornitore, ciascuno nel proprio fuso orario.
+# Vince la riga più specifica di orari_dispatch:
+#   (ristorante, fornitore) > (ristorante, -) > (-, fornitore) > (-, -)
+# In mancanza di righe valgono ORA_CUTOFF/ORA_INVIO; se FINESTRE_DISPATCH è
+# impostata i ristoranti senza orario vengono distribuiti sulle finestre (per id),
+# così scritture e mail non si concentrano tutte nello stesso minuto.
+
+import os
+from collections import namedtuple
+from datetime import date, datetime, time, timezone
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import or_, select
+from sqlalchemy.orm import Session
+
+from app import models
+
+
+def _ora(testo: str) -> time:
+    ore, minuti = testo.strip().split(":")
+    return time(int(ore), int(minuti))
+
+
+ORA_CUTOFF = _ora(os.getenv("ORA_CUTOFF", "15:30"))
+ORA_INVIO = _ora(os.getenv("ORA_INVIO", "16:00"))
+FUSO_ORARIO = os.getenv("FUSO_ORARIO", "Europe/Rome")
+# es. "16:00,16:20,16:40,17:00": il cutoff mantiene lo stesso anticipo sull'invio
+FINESTRE_DISPATCH = [_ora(f) for f in os.getenv("FINESTRE_DISPATCH", "").split(",") if f.strip()]
+
+Orario = namedtuple("Orario", "ora_cutoff ora_invio fuso_orario")
+
+
+def orario_predefinito(ristorante_id: int = None) -> Orario:
+    if not FINESTRE_DISPATCH or ristorante_id is None:
+        return Orario(ORA_CUTOFF, ORA_INVIO, FUSO_ORARIO)
+    invio = FINESTRE_DISPATCH[ristorante_id % len(FINESTRE_DISPATCH)]
+    anticipo = datetime.combine(date.min, ORA_INVIO) - datetime.combine(date.min, ORA_CUTOFF)
+    cutoff = (datetime.combine(date(2000, 1, 2), invio) - anticipo).time()
+    return Orario(cutoff, invio, FUSO_ORARIO)
+
+
+def carica_orari(db: Session, ristorante_id: int = None) -> dict:
+    """{(ristorante_id, fornitore_id): Orario}; con ristorante_id solo le righe utili a quel ristorante."""
+    query = select(models.OrarioDispatch)
+    if ristorante_id is not None:
+        query = query.where(or_(
+            models.OrarioDispatch.ristorante_id == ristorante_id,
+            models.OrarioDispatch.ristorante_id.is_(None),
+        ))
+    return {
+        (o.ristorante_id, o.fornitore_id): Orario(o.ora_cutoff, o.ora_invio, o.fuso_orario)
+        for o in db.scalars(query)
+    }
+
+
+def risolvi(orari: dict, ristorante_id: int = None, fornitore_id: int = None) -> Orario:
+    for chiave in (
+        (ristorante_id, fornitore_id),
+        (ristorante_id, None),
+        (None, fornitore_id),
+        (None, None),
+    ):
+        if chiave in orari:
+            return orari[chiave]
+    return orario_predefinito(ristorante_id)
+
+
+def adesso_locale(orario: Orario, adesso: datetime = None) -> datetime:
+    return (adesso or datetime.now(timezone.utc)).astimezone(ZoneInfo(orario.fuso_orario))
+
+
+def cutoff_superato(orario: Orario, adesso: datetime = None) -> bool:
+    return adesso_locale(orario, adesso).time() >= orario.ora_cutoff
+
+
+def invio_dovuto(orario: Orario, adesso: datetime = None) -> bool:
+    return adesso_locale(orario, adesso).time() >= orario.ora_invio
+
+
+def momento_invio(orario: Orario, adesso: datetime = None) -> datetime:
+    """Orario di invio di oggi (nel fuso dell'orario) come datetime UTC naive, come nel DB."""
+    locale = adesso_locale(orario, adesso)
+    invio = datetime.combine(locale.date(), orario.ora_invio, tzinfo=locale.tzinfo)
+    return invio.astimezone(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,169 @@
+# app/outbox.py
+#
+# Outbox delle email. Chi genera una mail la scrive in email_outbox nella stessa
+# transazione dei dati a cui si riferisce (accoda); il worker (svuota_outbox)
+# prende in carico i messaggi a lotti e li spedisce tramite il pool SMTP.
+# Ogni messaggio ha una chiave di idempotenza: accodarlo due volte non crea
+# doppioni e il Message-ID derivato dalla chiave resta lo stesso nei reinvii.
+# Un errore costa un nuovo tentativo di quel messaggio, con backoff esponenziale.
+
+import asyncio
+import hashlib
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+
+import aiosmtplib
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import SessionLocal, insert_dialetto
+from app.email_utils import FROM, PoolSMTP, invia_messaggi
+
+OUTBOX_LOTTO = int(os.getenv("OUTBOX_LOTTO", 200))
+OUTBOX_MAX_TENTATIVI = int(os.getenv("OUTBOX_MAX_TENTATIVI", 8))
+OUTBOX_BACKOFF_SECONDI = int(os.getenv("OUTBOX_BACKOFF_SECONDI", 30))
+OUTBOX_BACKOFF_MAX_SECONDI = int(os.getenv("OUTBOX_BACKOFF_MAX_SECONDI", 3600))
+# dopo questo tempo un messaggio "in_invio" (worker morto a metà) torna disponibile
+OUTBOX_LEASE_SECONDI = int(os.getenv("OUTBOX_LEASE_SECONDI", 600))
+
+IN_ATTESA, IN_INVIO, INVIATA, FALLITA = "in_attesa", "in_invio", "inviata", "fallita"
+
+
+def accoda(db: Session, messaggi: list):
+    """Scrive i messaggi nell'outbox senza fare commit.
+
+    messaggi: lista di dict con chiave, destinatario, oggetto, corpo e
+    opzionalmente mittente, ordine_id e prossimo_tentativo (invio differito,
+    UTC naive). Le chiavi già presenti vengono ignorate.
+    """
+    if not messaggi:
+        return
+    adesso = datetime.utcnow()
+    righe = [
+        {
+            "chiave": m["chiave"],
+            "ordine_id": m.get("ordine_id"),
+            "destinatario": m["destinatario"],
+            "mittente": m.get("mittente"),
+            "oggetto": m["oggetto"],
+            "corpo": m["corpo"],
+            "stato": IN_ATTESA,
+            "tentativi": 0,
+            "prossimo_tentativo": max(m.get("prossimo_tentativo") or adesso, adesso),
+            "creata_il": adesso,
+        }
+        for m in messaggi
+    ]
+    stmt = insert_dialetto(db, models.EmailOutbox).on_conflict_do_nothing(index_elements=["chiave"])
+    db.execute(stmt, righe)
+
+
+def message_id(chiave: str) -> str:
+    dominio = FROM.rsplit("@", 1)[-1] if "@" in FROM else "localhost"
+    return f"<{hashlib.sha256(chiave.encode()).hexdigest()[:32]}@{dominio}>"
+
+
+def backoff(tentativi: int) -> timedelta:
+    return timedelta(seconds=min(OUTBOX_BACKOFF_SECONDI * 2 ** (tentativi - 1), OUTBOX_BACKOFF_MAX_SECONDI))
+
+
+def _errore_permanente(errore: Exception) -> bool:
+    # destinatari rifiutati con 5xx: ritentare non serve
+    if isinstance(errore, aiosmtplib.SMTPRecipientsRefused):
+        return all(r.code >= 500 for r in errore.recipients)
+    return False
+
+
+def reclama_lotto(db: Session, limite: int = None):
+    """Prende in carico fino a `limite` messaggi pronti; ritorna (lotto, messaggi)."""
+    E = models.EmailOutbox
+    lotto = uuid.uuid4().hex
+    while True:
+        adesso = datetime.utcnow()
+        pronti = (E.stato.in_((IN_ATTESA, IN_INVIO)), E.prossimo_tentativo <= adesso)
+
+        ids = db.scalars(
+            select(E.id).where(*pronti).order_by(E.prossimo_tentativo, E.id).limit(limite or OUTBOX_LOTTO)
+        ).all()
+        if not ids:
+            return lotto, []
+
+        # la condizione viene ricontrollata nell'UPDATE: con più worker ogni
+        # messaggio finisce in un solo lotto
+        presi = db.execute(
+            update(E)
+            .where(E.id.in_(ids), *pronti)
+            .values(stato=IN_INVIO, lotto=lotto, prossimo_tentativo=adesso + timedelta(seconds=OUTBOX_LEASE_SECONDI))
+        ).rowcount
+        db.commit()
+        if presi:
+            return lotto, db.scalars(select(E).where(E.lotto == lotto).order_by(E.id)).all()
+        # tutti presi da un altro worker nel frattempo: si riprova con i successivi
+
+
+def registra_esiti(db: Session, messaggi: list, esiti: list) -> dict:
+    adesso = datetime.utcnow()
+    conteggi = {INVIATA: 0, IN_ATTESA: 0, FALLITA: 0}
+    for m, errore in zip(messaggi, esiti):
+        m.lotto = None
+        if errore is None:
+            m.stato = INVIATA
+            m.inviata_il = adesso
+            m.ultimo_errore = None
+        else:
+            m.tentativi += 1
+            m.ultimo_errore = f"{type(errore).__name__}: {errore}"[:2000]
+            if _errore_permanente(errore) or m.tentativi >= OUTBOX_MAX_TENTATIVI:
+                m.stato = FALLITA
+            else:
+                m.stato = IN_ATTESA
+                m.prossimo_tentativo = adesso + backoff(m.tentativi)
+        conteggi[m.stato] += 1
+    db.commit()
+    return conteggi
+
+
+async def svuota_outbox(pool: PoolSMTP = None, lotto: int = None) -> dict:
+    """Spedisce tutti i messaggi pronti, un lotto alla volta; ritorna i conteggi per stato.
+
+    Con più processi che svuotano insieme, lotti piccoli distribuiscono meglio i messaggi.
+    """
+    totali = {INVIATA: 0, IN_ATTESA: 0, FALLITA: 0}
+    db = SessionLocal()
+    pool_proprio = pool is None
+    pool = pool or PoolSMTP()
+    try:
+        while True:
+            _, messaggi = reclama_lotto(db, lotto)
+            if not messaggi:
+                break
+            esiti = await invia_messaggi(
+                [
+                    dict(
+                        destinatario=m.destinatario,
+                        oggetto=m.oggetto,
+                        corpo=m.corpo,
+                        mittente=m.mittente,
+                        intestazioni={"Message-ID": message_id(m.chiave)},
+                    )
+                    for m in messaggi
+                ],
+                pool,
+            )
+            for stato, n in registra_esiti(db, messaggi, esiti).items():
+                totali[stato] += n
+    finally:
+        db.close()
+        if pool_proprio:
+            await pool.chiudi()
+
+    if totali[IN_ATTESA] or totali[FALLITA]:
+        logging.warning("Outbox: %s", totali)
+    return totali
+
+
+if __name__ == "__main__":
+    print(asyncio.run(svuota_outbox()))
@@ -0,0 +1,162 @@
+# app/password.py
+#
+# Hash e verifica delle password (bcrypt) su un pool di processi dedicato. Un
+# bcrypt costa centinaia di ms di CPU: nel threadpool occuperebbe un thread e
+# il GIL, rallentando tutte le altre richieste del processo durante le ondate
+# di login. Qui gira in PASSWORD_PROCESSI processi separati, su più core.
+#
+# Le richieste in attesa o in calcolo sono al massimo PASSWORD_MAX_IN_CODA:
+# oltre, PasswordOccupato (il login risponde 503 con Retry-After) invece di
+# accodare all'infinito. statistiche() riporta attese in coda e tempi di calcolo,
+# esportati anche come metriche (app/metriche.py).
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app import metriche
+from app.utils import pwd_context
+
+# un core resta al processo web
+PASSWORD_PROCESSI = int(os.getenv("PASSWORD_PROCESSI", max(1, (os.cpu_count() or 2) - 1)))
+PASSWORD_MAX_IN_CODA = int(os.getenv("PASSWORD_MAX_IN_CODA", PASSWORD_PROCESSI * 8))
+# attesa in coda oltre la quale si scrive un avviso nel log
+PASSWORD_ATTESA_AVVISO_MS = int(os.getenv("PASSWORD_ATTESA_AVVISO_MS", 1000))
+
+
+class PasswordOccupato(RuntimeError):
+    pass
+
+
+# -----------------------------
+# Eseguiti nei processi del pool: restituiscono anche il tempo di calcolo
+# -----------------------------
+def _hash(password: str):
+    inizio = time.perf_counter()
+    return pwd_context.hash(password), time.perf_counter() - inizio
+
+
+def _verifica(password: str, hashed: str):
+    inizio = time.perf_counter()
+    try:
+        # (valida, nuovo hash se il costo è cambiato, altrimenti None)
+        esito = pwd_context.verify_and_update(password, hashed)
+    except (TypeError, ValueError):
+        # hash non riconosciuto o corrotto
+        esito = (False, None)
+    return esito, time.perf_counter() - inizio
+
+
+def _nulla():
+    return None, 0.0
+
+
+# -----------------------------
+# Pool e statistiche
+# -----------------------------
+_pool = None
+_lock = threading.Lock()
+_in_corso = 0
+_statistiche = {
+    "richieste": 0,
+    "rifiutate": 0,
+    "attesa_totale_s": 0.0,
+    "attesa_max_s": 0.0,
+    "calcolo_totale_s": 0.0,
+}
+metriche.Misura("password_jobs_in_flight", "Hash/verifiche in coda o in calcolo", funzione=lambda: _in_corso)
+
+
+def _executor() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            # spawn: un fork del processo web copierebbe thread e connessioni aperte
+            _pool = ProcessPoolExecutor(PASSWORD_PROCESSI, mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def _scarta_pool():
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _entra():
+    global _in_corso
+    with _lock:
+        if _in_corso >= PASSWORD_MAX_IN_CODA:
+            _statistiche["rifiutate"] += 1
+            metriche.PASSWORD_RIFIUTATE.inc()
+            raise PasswordOccupato(f"{_in_corso} calcoli di password già in corso")
+        _in_corso += 1
+
+
+def _esci(attesa: float | None, calcolo: float | None):
+    global _in_corso
+    with _lock:
+        _in_corso -= 1
+        if attesa is None:
+            return
+        _statistiche["richieste"] += 1
+        _statistiche["attesa_totale_s"] += attesa
+        _statistiche["attesa_max_s"] = max(_statistiche["attesa_max_s"], attesa)
+        _statistiche["calcolo_totale_s"] += calcolo
+    metriche.PASSWORD_ATTESA.osserva(attesa)
+    metriche.PASSWORD_CALCOLO.osserva(calcolo)
+    if attesa * 1000 > PASSWORD_ATTESA_AVVISO_MS:
+        logging.warning("Password: %.0f ms di attesa in coda (%s processi)", attesa * 1000, PASSWORD_PROCESSI)
+
+
+async def _esegui(funzione, *args):
+    _entra()
+    attesa = calcolo = None
+    inizio = time.perf_counter()
+    try:
+        risultato, calcolo = await asyncio.wrap_future(_executor().submit(funzione, *args))
+        # tutto quello che non è calcolo è attesa (coda del pool e passaggio tra processi)
+        attesa = max(0.0, time.perf_counter() - inizio - calcolo)
+        return risultato
+    except BrokenProcessPool:
+        # un processo del pool è morto: il prossimo calcolo ne crea uno nuovo
+        _scarta_pool()
+        raise
+    finally:
+        _esci(attesa, calcolo)
+
+
+async def calcola_hash(password: str) -> str:
+    return await _esegui(_hash, password)
+
+
+async def verifica(password: str, hashed: str):
+    """(valida, nuovo_hash): nuovo_hash va salvato al posto di quello vecchio se non è None."""
+    return await _esegui(_verifica, password, hashed)
+
+
+def calcola_hash_molti(passwords) -> list:
+    """Per gli script (seed): calcola gli hash in parallelo sui processi del pool."""
+    return [h for h, _ in _executor().map(_hash, passwords)]
+
+
+async def avvia():
+    # avvia subito i processi, così il primo login non paga lo spawn
+    await asyncio.wrap_future(_executor().submit(_nulla))
+
+
+def chiudi():
+    _scarta_pool()
+
+
+def statistiche() -> dict:
+    with _lock:
+        stat = dict(_statistiche, in_corso=_in_corso, processi=PASSWORD_PROCESSI)
+    stat["attesa_media_s"] = stat["attesa_totale_s"] / stat["richieste"] if stat["richieste"] else 0.0
+    return stat
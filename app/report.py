@@ -0,0 +1,139 @@
+# app/report.py
+#
+# Rollup per i report admin: fatturato per (ristorante, giorno), vendite per
+# (ristorante, prodotto, giorno) e ordini per (ristorante, order manager, mese).
+# Vengono aggiornati in modo incrementale quando il job segna gli ordini come
+# inviati, così i report leggono poche centinaia di righe invece di order_items.
+
+from collections import defaultdict
+
+from sqlalchemy import Date, cast, delete, distinct, func, insert, select
+from sqlalchemy.orm import Session
+
+from app import models
+from app.database import SessionLocal, insert_dialetto
+
+# INSERT ... ON CONFLICT DO UPDATE che somma i valori a quelli già presenti
+def _upsert_additivo(db: Session, model, righe: list, chiavi: tuple, valori: tuple):
+    if not righe:
+        return
+    stmt = insert_dialetto(db, model)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(chiavi),
+        set_={v: getattr(model, v) + getattr(stmt.excluded, v) for v in valori},
+    )
+    db.execute(stmt, righe)
+
+
+def aggiorna_rollup(db: Session, ordine_ids):
+    # Da chiamare nella stessa transazione che segna gli ordini come inviati
+    ordine_ids = list(ordine_ids)
+    if not ordine_ids:
+        return
+
+    righe = db.execute(
+        select(
+            models.Ordine.id,
+            models.Ordine.ristorante_id,
+            models.Ordine.user_id,
+            models.Ordine.data_ordine,
+            models.OrderItem.prodotto_id,
+            models.OrderItem.quantita,
+            models.OrderItem.prezzo_unitario,
+        )
+        .join(models.OrderItem, models.OrderItem.ordine_id == models.Ordine.id)
+        .where(models.Ordine.id.in_(ordine_ids))
+    ).all()
+
+    per_giorno = defaultdict(lambda: {"ordini": set(), "fatturato": 0.0})
+    per_prodotto = defaultdict(lambda: {"quantita": 0, "fatturato": 0.0})
+    per_om = defaultdict(lambda: {"ordini": set(), "fatturato": 0.0})
+
+    for ordine_id, ristorante_id, user_id, data_ordine, prodotto_id, quantita, prezzo in righe:
+        giorno = data_ordine.date()
+        mese = giorno.replace(day=1)
+        importo = quantita * prezzo
+
+        g = per_giorno[(ristorante_id, giorno)]
+        g["ordini"].add(ordine_id)
+        g["fatturato"] += importo
+
+        if prodotto_id is not None:
+            p = per_prodotto[(ristorante_id, prodotto_id, giorno)]
+            p["quantita"] += quantita
+            p["fatturato"] += importo
+
+        m = per_om[(ristorante_id, user_id, mese)]
+        m["ordini"].add(ordine_id)
+        m["fatturato"] += importo
+
+    _upsert_additivo(
+        db, models.ReportRistoranteGiorno,
+        [
+            {"ristorante_id": r, "giorno": g, "n_ordini": len(v["ordini"]), "fatturato": v["fatturato"]}
+            for (r, g), v in per_giorno.items()
+        ],
+        ("ristorante_id", "giorno"), ("n_ordini", "fatturato"),
+    )
+    _upsert_additivo(
+        db, models.ReportProdottoGiorno,
+        [
+            {"ristorante_id": r, "prodotto_id": p, "giorno": g, "quantita": v["quantita"], "fatturato": v["fatturato"]}
+            for (r, p, g), v in per_prodotto.items()
+        ],
+        ("ristorante_id", "prodotto_id", "giorno"), ("quantita", "fatturato"),
+    )
+    _upsert_additivo(
+        db, models.ReportOrderManagerMese,
+        [
+            {"ristorante_id": r, "user_id": u, "mese": m, "n_ordini": len(v["ordini"]), "fatturato": v["fatturato"]}
+            for (r, u, m), v in per_om.items()
+        ],
+        ("ristorante_id", "user_id", "mese"), ("n_ordini", "fatturato"),
+    )
+
+
+def _giorno_e_mese(db: Session, colonna):
+    # data e primo giorno del mese di un DateTime, calcolati nel DB
+    if db.get_bind().dialect.name == "sqlite":
+        return func.date(colonna), func.date(colonna, "start of month")
+    return cast(colonna, Date), cast(func.date_trunc("month", colonna), Date)
+
+
+def ricostruisci_rollup(db: Session):
+    # Ricalcolo completo dallo storico (dopo import di dati o correzioni manuali).
+    # Stesse somme di aggiorna_rollup, ma con un INSERT ... SELECT ... GROUP BY
+    # per tabella: su milioni di righe non passa nulla da Python.
+    for model in (models.ReportRistoranteGiorno, models.ReportProdottoGiorno, models.ReportOrderManagerMese):
+        db.execute(delete(model))
+
+    o, r = models.Ordine, models.OrderItem
+    giorno, mese = _giorno_e_mese(db, o.data_ordine)
+    importo = func.sum(r.quantita * r.prezzo_unitario)
+    righe = select().select_from(o).join(r, r.ordine_id == o.id).where(o.inviato.is_(True))
+
+    db.execute(insert(models.ReportRistoranteGiorno).from_select(
+        ["ristorante_id", "giorno", "n_ordini", "fatturato"],
+        righe.add_columns(o.ristorante_id, giorno, func.count(distinct(o.id)), importo)
+        .group_by(o.ristorante_id, giorno),
+    ))
+    db.execute(insert(models.ReportProdottoGiorno).from_select(
+        ["ristorante_id", "prodotto_id", "giorno", "quantita", "fatturato"],
+        righe.add_columns(o.ristorante_id, r.prodotto_id, giorno, func.sum(r.quantita), importo)
+        .where(r.prodotto_id.is_not(None))
+        .group_by(o.ristorante_id, r.prodotto_id, giorno),
+    ))
+    db.execute(insert(models.ReportOrderManagerMese).from_select(
+        ["ristorante_id", "user_id", "mese", "n_ordini", "fatturato"],
+        righe.add_columns(o.ristorante_id, o.user_id, mese, func.count(distinct(o.id)), importo)
+        .group_by(o.ristorante_id, o.user_id, mese),
+    ))
+    db.commit()
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        ricostruisci_rollup(db)
+    finally:
+        db.close()
+    print("✅ Rollup report ricostruiti.")
@@ -0,0 +1,109 @@
+# app/ricerca.py
+#
+# Ricerca full-text sui prodotti visibili a un ristorante. Su SQLite usa
+# l'indice FTS5 prodotti_fts (vedi models.PRODOTTI_FTS_DDL) con ranking bm25,
+# il nome pesa più della descrizione; l'ultima parola è cercata come prefisso,
+# così "filetto salm" trova già "Filetto di Salmone". Sugli altri database
+# ripiega su LIKE, senza ranking.
+#
+# CROSS JOIN fissa l'ordine dei join in SQLite: si parte dai risultati FTS e si
+# verifica la visibilità per chiave, invece di scorrere tutta la vetrina del
+# ristorante interrogando l'indice per ogni prodotto.
+
+import re
+
+from sqlalchemy import or_, select, text
+from sqlalchemy.orm import Session
+
+from app import models
+
+# pesi bm25 delle colonne (nome, descrizione)
+PESO_NOME = 10.0
+PESO_DESCRIZIONE = 1.0
+
+_PAROLE = re.compile(r"\w+", re.UNICODE)
+
+_SQL_CERCA = text(f"""
+    SELECT p.id, p.nome, p.descrizione, p.prezzo, p.immagine_url
+    FROM prodotti_fts
+    CROSS JOIN prodotti p ON p.id = prodotti_fts.rowid
+    CROSS JOIN product_visibility v ON v.prodotto_id = p.id AND v.ristorante_id = :ristorante_id
+    WHERE prodotti_fts MATCH :query
+    ORDER BY bm25(prodotti_fts, {PESO_NOME}, {PESO_DESCRIZIONE}), p.id
+    LIMIT :limite
+""")
+
+# Autocompletamento: solo sul nome, usando i prefissi indicizzati. Un prefisso
+# corto ("sa") può trovare migliaia di prodotti e il bm25 su tutti costa decine
+# di ms: si prendono i primi AUTOCOMPLETA_CANDIDATI risultati visibili (nessun
+# ordinamento, FTS5 si ferma presto) e si ordinano quelli, nomi più corti prima.
+AUTOCOMPLETA_CANDIDATI = 200
+
+_SQL_AUTOCOMPLETA = text("""
+    SELECT id, nome FROM (
+        SELECT p.id, p.nome
+        FROM prodotti_fts
+        CROSS JOIN prodotti p ON p.id = prodotti_fts.rowid
+        CROSS JOIN product_visibility v ON v.prodotto_id = p.id AND v.ristorante_id = :ristorante_id
+        WHERE prodotti_fts MATCH :query
+        LIMIT :candidati
+    )
+    ORDER BY length(nome), nome, id
+    LIMIT :limite
+""")
+
+
+def parole(testo: str) -> list:
+    return _PAROLE.findall(testo or "")
+
+
+def query_fts(testo: str, colonna: str | None = None) -> str | None:
+    """Query FTS5 dal testo dell'utente: parole tra virgolette (nessun operatore
+    iniettabile), tutte obbligatorie, l'ultima come prefisso."""
+    termini = [f'"{p}"' for p in parole(testo)]
+    if not termini:
+        return None
+    termini[-1] += "*"
+    query = " ".join(termini)
+    return f"{colonna} : ({query})" if colonna else query
+
+
+def _usa_fts(db: Session) -> bool:
+    return db.get_bind().dialect.name == "sqlite"
+
+
+def _like(db: Session, testo: str, ristorante_id: int, limite: int, colonne):
+    P = models.Prodotto
+    pv = models.product_visibility
+    query = select(*colonne).join(pv, pv.c.prodotto_id == P.id).where(pv.c.ristorante_id == ristorante_id)
+    for p in parole(testo):
+        query = query.where(or_(P.nome.ilike(f"%{p}%"), P.descrizione.ilike(f"%{p}%")))
+    return db.execute(query.order_by(P.nome, P.id).limit(limite)).mappings().all()
+
+
+def cerca(db: Session, testo: str, ristorante_id: int, limite: int = 20) -> list:
+    query = query_fts(testo)
+    if query is None:
+        return []
+    if not _usa_fts(db):
+        P = models.Prodotto
+        righe = _like(db, testo, ristorante_id, limite, (P.id, P.nome, P.descrizione, P.prezzo, P.immagine_url))
+    else:
+        righe = db.execute(
+            _SQL_CERCA, {"query": query, "ristorante_id": ristorante_id, "limite": limite}
+        ).mappings().all()
+    return [dict(r) for r in righe]
+
+
+def autocompleta(db: Session, testo: str, ristorante_id: int, limite: int = 8) -> list:
+    query = query_fts(testo, colonna="nome")
+    if query is None:
+        return []
+    if not _usa_fts(db):
+        righe = _like(db, testo, ristorante_id, limite, (models.Prodotto.id, models.Prodotto.nome))
+    else:
+        righe = db.execute(
+            _SQL_AUTOCOMPLETA,
+            {"query": query, "ristorante_id": ristorante_id, "limite": limite, "candidati": AUTOCOMPLETA_CANDIDATI},
+        ).mappings().all()
+    return [dict(r) for r in righe]
@@ -1,11 +1,12 @@
 # app/routers/fornitori.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
 from typing import List
 
-from app import schemas, models
+from app import catalogo, schemas, models
 from app.database import get_db
+from app.dependencies import Principal, require_role
 
 router = APIRouter(
     prefix="/fornitori",
@@ -13,20 +14,32 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=schemas.Fornitore)
-def create_fornitore(f: schemas.FornitoreCreate, db: Session = Depends(get_db)):
+def create_fornitore(
+    f: schemas.FornitoreCreate,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(require_role("window_dresser"))
+):
     db_obj = models.Fornitore(nome=f.nome, email=f.email)
     db.add(db_obj)
+    catalogo.incrementa_versioni(db, "fornitori")
     db.commit()
     db.refresh(db_obj)
     return db_obj
 
 @router.get("/", response_model=List[schemas.Fornitore])
-def read_fornitori(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_fornitori(request: Request, response: Response, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    non_modificato = catalogo.validatori(db, "fornitori").risposta(request, response)
+    if non_modificato:
+        return non_modificato
     return db.query(models.Fornitore).offset(skip).limit(limit).all()
 
 @router.get("/{fornitore_id}", response_model=schemas.Fornitore)
-def read_fornitore(fornitore_id: int, db: Session = Depends(get_db)):
+def read_fornitore(fornitore_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
+    # prima il 404: un ETag valido non deve far sembrare esistente un id che non c'è
     obj = db.query(models.Fornitore).get(fornitore_id)
     if not obj:
         raise HTTPException(status_code=404, detail="Fornitore non trovato")
+    non_modificato = catalogo.validatori(db, "fornitori").risposta(request, response)
+    if non_modificato:
+        return non_modificato
     return obj
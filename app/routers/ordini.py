@@ -1,43 +1,58 @@
 # app/routers/ordini.py
 
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session, joinedload
-from typing import List
-from datetime import datetime, time
-
+from sqlalchemy import func, literal, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from typing import List, Optional
+from datetime import date, datetime, time, timedelta, timezone
+
+import base64
+import csv
+import io
+import json
 import logging
 
 logger = logging.getLogger(__name__)
 
-from app import models, schemas
-from app.database import get_db
+from app import models, orari, schemas, carrello
+from app.database import AsyncSessionLocal, get_async_db
+from app.dependencies import Principal, get_principal
+from app.statistiche_sql import budget_query
 
 router = APIRouter(
     prefix="/ordini",
     tags=["ordini"]
 )
 
-# --- Recupera ordine aggregato corrente ---
+# --- Recupera ordine aggregato corrente (sola lettura) ---
 @router.get("/order_manager/order_aggregato")
-def get_ordine_aggregato(request: Request, ristorante_id: int = None, db: Session = Depends(get_db)):
-    user_id = request.session.get("user_id")
-    if not user_id:
-        raise HTTPException(403, "Utente non autenticato")
-
-    user = db.query(models.User).get(user_id)
-    if not user:
-        raise HTTPException(404, "Utente non valido")
+@budget_query(8)
+async def get_ordine_aggregato(
+    ristorante_id: int = None,
+    db: AsyncSession = Depends(get_async_db),
+    principal: Principal = Depends(get_principal)
+):
+    user_id = principal.id
 
     # Se non è passato il ristorante_id, prova a prendere il primo associato
     if ristorante_id is None:
-        if not user.ristoranti:
+        if not principal.ristorante_ids:
             raise HTTPException(404, "Nessun ristorante associato all'utente")
-        ristorante_id = user.ristoranti[0].id
+        ristorante_id = min(principal.ristorante_ids)
 
-    ordine_agg = agglomera_ordini(db, user.id, ristorante_id)
-    if not ordine_agg:
+    ordine_agg = (await db.execute(
+        select(models.Ordine)
+        .options(selectinload(models.Ordine.righe).selectinload(models.OrderItem.prodotto))
+        .where(
+            models.Ordine.user_id == user_id,
+            models.Ordine.ristorante_id == ristorante_id,
+            models.Ordine.inviato == False
+        )
+    )).scalars().first()
+    if not ordine_agg or not ordine_agg.righe:
         return JSONResponse({"righe": [], "totale": 0})
 
     # Trasforma in JSON serializzabile
@@ -46,7 +61,7 @@ def get_ordine_aggregato(request: Request, ristorante_id: int = None, db: Sessio
         "totale": ordine_agg.totale,
         "righe": [
             {
-                "prodotto_id": getattr(r, "prodotto_id", (r.prodotto.id if r.prodotto else None)),
+                "prodotto_id": r.prodotto_id,
                 "prodotto": {"id": r.prodotto.id, "nome": r.prodotto.nome} if r.prodotto else None,
                 "quantita": r.quantita,
                 "prezzo_unitario": r.prezzo_unitario
@@ -55,240 +70,353 @@ def get_ordine_aggregato(request: Request, ristorante_id: int = None, db: Sessio
     }
     return JSONResponse(jsonable_encoder(result))
 
+# --- Cutoff del ristorante e dei fornitori (orari_dispatch, vedi app/orari.py) ---
+async def _verifica_cutoff(db: AsyncSession, ristorante_id: int, adesso: datetime) -> dict:
+    # ritorna gli orari del ristorante, per i controlli sui fornitori
+    orari_ristorante = await db.run_sync(orari.carica_orari, ristorante_id)
+    orario = orari.risolvi(orari_ristorante, ristorante_id)
+    if orari.cutoff_superato(orario, adesso):
+        raise HTTPException(403, f"Gli ordini possono essere modificati solo fino alle {orario.ora_cutoff:%H:%M}.")
+    return orari_ristorante
+
+def _verifica_cutoff_fornitore(orari_ristorante: dict, ristorante_id: int, prodotto_id: int, fornitore_id: int, adesso: datetime):
+    # un fornitore può chiudere gli ordini prima del ristorante
+    orario = orari.risolvi(orari_ristorante, ristorante_id, fornitore_id)
+    if orari.cutoff_superato(orario, adesso):
+        raise HTTPException(
+            403, f"Il prodotto {prodotto_id} può essere ordinato solo fino alle {orario.ora_cutoff:%H:%M}."
+        )
+
 # --- Modifica righe ordine esistente ---
 class AggiornaRigaOrdine(schemas.BaseModel):
     prodotto_id: int
     quantita: float
 
 @router.put("/order_manager/order_aggregato", response_model=schemas.Ordine)
-def aggiorna_ordine_aggregato(
+@budget_query(12)
+async def aggiorna_ordine_aggregato(
     righe: List[AggiornaRigaOrdine],
-    request: Request,
-    db: Session = Depends(get_db)
+    ristorante_id: int = None,
+    db: AsyncSession = Depends(get_async_db),
+    principal: Principal = Depends(get_principal)
 ):
-    user_id = request.session.get("user_id")
-    if not user_id:
-        raise HTTPException(403, "Utente non autenticato")
-
-    ordine = (
-        db.query(models.Ordine)
-        .options(joinedload(models.Ordine.righe).joinedload(models.OrderItem.prodotto))
-        .filter(models.Ordine.user_id == user_id, models.Ordine.inviato == False)
-        .order_by(models.Ordine.data_ordine.desc())
-        .first()
+    user_id = principal.id
+
+    query = select(models.Ordine).where(
+        models.Ordine.user_id == user_id,
+        models.Ordine.inviato == False
     )
+    if ristorante_id is not None:
+        query = query.where(models.Ordine.ristorante_id == ristorante_id)
+    ordine = (await db.execute(query.order_by(models.Ordine.data_ordine.desc()).limit(1))).scalars().first()
     if not ordine:
         raise HTTPException(404, "Nessun ordine aggregato trovato")
-    
-    righe_dict = {r.prodotto_id: r for r in ordine.righe}
-    totale = 0.0
-
-    for r in righe:
-        if r.prodotto_id in righe_dict:
-            if r.quantita > 0:
-                righe_dict[r.prodotto_id].quantita = r.quantita
-                totale += r.quantita * righe_dict[r.prodotto_id].prezzo_unitario
-            else:
-                db.delete(righe_dict[r.prodotto_id])
-        else:
-            if r.quantita > 0:
-                prod = db.query(models.Prodotto).get(r.prodotto_id)
-                if not prod:
-                    continue
-                item = models.OrderItem(
-                    ordine_id=ordine.id,
-                    prodotto_id=prod.id,
-                    quantita=r.quantita,
-                    prezzo_unitario=prod.prezzo
-                )
-                db.add(item)
-                totale += r.quantita * prod.prezzo
-
-    ordine.totale = totale
-    db.commit()
-    db.refresh(ordine)
-    return ordine
-
-# --- Funzione di agglomerazione ordini ---
-def agglomera_ordini(db: Session, user_id: int, ristorante_id: int):
-    ordini = (
-        db.query(models.Ordine)
-        .options(joinedload(models.Ordine.righe))
-        .filter(
-            models.Ordine.user_id == user_id,
-            models.Ordine.ristorante_id == ristorante_id,
-            models.Ordine.inviato == False
-        )
-        .all()
-    )
-    
-    if not ordini:
-        return None
-    
-    ordine_agg = models.Ordine(
-        user_id=user_id,
-        ristorante_id=ristorante_id,
-        data_ordine=datetime.utcnow(),
-        note="Ordine aggregato del giorno",
-        totale=0.0,
-        inviato=False
+
+    # stesso cutoff della POST: dopo l'orario l'ordine può essere già in invio
+    adesso = datetime.now(timezone.utc)
+    orari_ristorante = await _verifica_cutoff(db, ordine.ristorante_id, adesso)
+
+    quantita = {r.prodotto_id: r.quantita for r in righe}
+    prodotti = await db.run_sync(
+        carrello.risolvi_prodotti, ordine.ristorante_id, [pid for pid, q in quantita.items() if q > 0]
     )
-    db.add(ordine_agg)
-    db.flush()
+    if any(not visibile for _, visibile, _ in prodotti.values()):
+        raise HTTPException(403, "Prodotto non disponibile per questo ristorante")
+    for prodotto_id, (_, _, fornitore_id) in prodotti.items():
+        _verifica_cutoff_fornitore(orari_ristorante, ordine.ristorante_id, prodotto_id, fornitore_id, adesso)
+    prezzi = {pid: prezzo for pid, (prezzo, _, _) in prodotti.items()}
+
+    ordine_id = ordine.id
+    ordine = await db.run_sync(carrello.unisci_righe, ordine, quantita, prezzi, True)
+    await db.commit()
+    if not ordine:
+        # carrello svuotato ed eliminato
+        return JSONResponse({"righe": [], "totale": 0})
 
-    totale = 0.0
-    righe_dict = {}
+    return await db.run_sync(carrello.carica_ordine_completo, ordine_id)
 
-    for ordine in ordini:
-        for r in ordine.righe:
-            if r.prodotto_id in righe_dict:
-                righe_dict[r.prodotto_id]['quantita'] += r.quantita
-            else:
-                righe_dict[r.prodotto_id] = {
-                    'prodotto_id': r.prodotto_id,
-                    'quantita': r.quantita,
-                    'prezzo_unitario': r.prezzo_unitario
-                }
-        db.delete(ordine)
-
-    for r in righe_dict.values():
-        if r['quantita'] > 0:
-            item = models.OrderItem(
-                ordine_id=ordine_agg.id,
-                prodotto_id=r['prodotto_id'],
-                quantita=r['quantita'],
-                prezzo_unitario=r['prezzo_unitario']
-            )
-            totale += r['quantita'] * r['prezzo_unitario']
-            db.add(item)
-
-    ordine_agg.totale = totale
-    db.commit()
-    db.refresh(ordine_agg)
-
-    # --- PULIZIA AUTOMATICA: cancella righe senza ordine_id ---
-    db.query(models.OrderItem).filter(models.OrderItem.ordine_id == None).delete(synchronize_session=False)
-    db.commit()
-
-    if totale <= 0 or not ordine_agg.righe:
-        db.delete(ordine_agg)
-        db.commit()
-        return None
-
-    return ordine_agg
-
-# --- Creazione ordine ---
+# --- Creazione ordine: le righe vengono unite al carrello aperto ---
 @router.post("/", response_model=schemas.Ordine)
-def create_ordine(
+@budget_query(16)
+async def create_ordine(
     o: schemas.OrdineCreate,
-    request: Request,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db),
+    principal: Principal = Depends(get_principal)
 ):
-    now = datetime.now().time()
-    if now >= time(15, 30):
-        raise HTTPException(403, "Gli ordini possono essere modificati solo fino alle 15:30.")
-        
-    user_id = request.session.get("user_id")
-    if not user_id:
-        raise HTTPException(403, "Utente non autenticato")
-
-    user = db.query(models.User).get(user_id)
+    user_id = principal.id
 
     # ⚠️ PRENDI ristorante_id DAL PAYLOAD invece che dall'utente
     if not o.ristorante_id:
         raise HTTPException(400, "Devi specificare un ristorante")
-    
-    ristorante = db.query(models.Ristorante).get(o.ristorante_id)
-    if not ristorante or ristorante not in user.ristoranti:
+
+    if o.ristorante_id not in principal.ristorante_ids:
         raise HTTPException(403, "Non sei associato a questo ristorante")
 
-    ordine_temp = models.Ordine(
-        user_id=user.id,
-        ristorante_id=ristorante.id,
-        data_ordine=datetime.utcnow(),
-        note=o.note
-    )
-    db.add(ordine_temp)
-    db.flush()
+    adesso = datetime.now(timezone.utc)
+    orari_ristorante = await _verifica_cutoff(db, o.ristorante_id, adesso)
 
-    totale = 0.0
+    quantita = {}
     for r in o.righe:
-        prod = db.query(models.Prodotto).get(r.prodotto_id)
-        if not prod:
-            raise HTTPException(404, f"Prodotto {r.prodotto_id} non trovato")
-        item = models.OrderItem(
-            ordine_id=ordine_temp.id,
-            prodotto_id=r.prodotto_id,
-            quantita=r.quantita,
-            prezzo_unitario=prod.prezzo
-        )
-        totale += r.quantita * prod.prezzo
-        db.add(item)
-
-    ordine_temp.totale = totale
-    db.commit()
-    db.refresh(ordine_temp)
-
-    # ⚠️ PRENDI ristorante_id DAL PAYLOAD invece che dall'utente
-    ordine_agg = agglomera_ordini(db, user.id, o.ristorante_id)
-    if not ordine_agg:
+        quantita[r.prodotto_id] = quantita.get(r.prodotto_id, 0) + r.quantita
+
+    # prezzi e visibilità di tutte le righe in un'unica query IN
+    prodotti = await db.run_sync(carrello.risolvi_prodotti, o.ristorante_id, quantita)
+    for prodotto_id in quantita:
+        if prodotto_id not in prodotti:
+            raise HTTPException(404, f"Prodotto {prodotto_id} non trovato")
+        prezzo, visibile, fornitore_id = prodotti[prodotto_id]
+        if not visibile:
+            raise HTTPException(403, f"Prodotto {prodotto_id} non disponibile per questo ristorante")
+        if quantita[prodotto_id] > 0:
+            _verifica_cutoff_fornitore(orari_ristorante, o.ristorante_id, prodotto_id, fornitore_id, adesso)
+    prezzi = {pid: prezzo for pid, (prezzo, _, _) in prodotti.items()}
+
+    ordine_id = await db.run_sync(carrello.aggiungi_righe, user_id, o.ristorante_id, quantita, prezzi, o.note)
+    if not ordine_id:
+        await db.rollback()
         raise HTTPException(400, "L'ordine risultante è vuoto dopo la variazione dei prodotti.")
 
-    return ordine_agg
+    await db.commit()
+    return await db.run_sync(carrello.carica_ordine_completo, ordine_id)
+
+# --- ADMIN: storico ordini (filtri, ordinamento e paginazione lato SQL) ---
+_PREZZO_TOTALE = models.OrderItem.quantita * models.OrderItem.prezzo_unitario
+
+# chiavi di ordinamento = colonne della tabella in admin.html
+COLONNE_STORICO = {
+    "ristorante": models.Ristorante.nome,
+    "order_manager": models.User.email,
+    "data_ordine": models.Ordine.data_ordine,
+    "prodotto": func.coalesce(models.Prodotto.nome, "—"),
+    "quantita": models.OrderItem.quantita,
+    "prezzo_unitario": models.OrderItem.prezzo_unitario,
+    "prezzo_totale": _PREZZO_TOTALE,
+    "note": func.coalesce(models.Ordine.note, ""),
+}
+
+# oltre questa soglia il conteggio totale viene solo stimato
+SOGLIA_CONTEGGIO = 10000
+
+class FiltriStorico:
+    def __init__(
+        self,
+        ristorante_id: Optional[int] = None,
+        ristorante: Optional[str] = None,
+        order_manager: Optional[str] = None,
+        prodotto: Optional[str] = None,
+        data_da: Optional[date] = None,
+        data_a: Optional[date] = None,
+        note: Optional[str] = None,
+    ):
+        self.ristorante_id = ristorante_id
+        self.ristorante = ristorante
+        self.order_manager = order_manager
+        self.prodotto = prodotto
+        self.data_da = data_da
+        self.data_a = data_a
+        self.note = note
+
+def query_storico(ristorante_ids, filtri: FiltriStorico):
+    # una riga per OrderItem, solo colonne (nessun oggetto ORM né lazy load)
+    query = (
+        select(
+            models.OrderItem.id.label("riga_id"),
+            models.Ristorante.nome.label("ristorante"),
+            models.User.email.label("order_manager"),
+            models.Ordine.data_ordine,
+            COLONNE_STORICO["prodotto"].label("prodotto"),
+            models.OrderItem.quantita,
+            models.OrderItem.prezzo_unitario,
+            _PREZZO_TOTALE.label("prezzo_totale"),
+            COLONNE_STORICO["note"].label("note"),
+            models.Ordine.inviato,
+        )
+        .select_from(models.Ordine)
+        .join(models.OrderItem, models.OrderItem.ordine_id == models.Ordine.id)
+        .join(models.Ristorante, models.Ristorante.id == models.Ordine.ristorante_id)
+        .join(models.User, models.User.id == models.Ordine.user_id)
+        .outerjoin(models.Prodotto, models.Prodotto.id == models.OrderItem.prodotto_id)
+        .where(models.Ordine.ristorante_id.in_(ristorante_ids), models.Ordine.inviato.is_(True))
+    )
+    if filtri.ristorante_id is not None:
+        query = query.where(models.Ordine.ristorante_id == filtri.ristorante_id)
+    if filtri.ristorante:
+        query = query.where(models.Ristorante.nome.ilike(f"%{filtri.ristorante}%"))
+    if filtri.order_manager:
+        query = query.where(models.User.email.ilike(f"%{filtri.order_manager}%"))
+    if filtri.prodotto:
+        query = query.where(models.Prodotto.nome.ilike(f"%{filtri.prodotto}%"))
+    if filtri.note:
+        query = query.where(models.Ordine.note.ilike(f"%{filtri.note}%"))
+    if filtri.data_da:
+        query = query.where(models.Ordine.data_ordine >= datetime.combine(filtri.data_da, time.min))
+    if filtri.data_a:
+        query = query.where(models.Ordine.data_ordine < datetime.combine(filtri.data_a + timedelta(days=1), time.min))
+    return query
+
+def riga_storico(r) -> dict:
+    return {
+        "ristorante": r.ristorante,
+        "order_manager": r.order_manager,
+        "data_ordine": r.data_ordine.strftime("%Y-%m-%d %H:%M"),
+        "prodotto": r.prodotto,
+        "quantita": r.quantita,
+        "prezzo_unitario": r.prezzo_unitario,
+        "prezzo_totale": r.prezzo_totale,
+        "note": r.note,
+        "inviato": r.inviato
+    }
+
+# Cursore keyset: (chiave, direzione, ultimo valore, ultimo id riga) in base64
+def _codifica_cursore(ordina: str, direzione: str, valore, riga_id: int) -> str:
+    if isinstance(valore, datetime):
+        valore = valore.isoformat()
+    raw = json.dumps([ordina, direzione, valore, riga_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def _decodifica_cursore(cursore: str, ordina: str, direzione: str):
+    try:
+        c_ordina, c_direzione, valore, riga_id = json.loads(base64.urlsafe_b64decode(cursore.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(400, "Cursore non valido")
+    if c_ordina != ordina or c_direzione != direzione:
+        raise HTTPException(400, "Il cursore non corrisponde all'ordinamento richiesto")
+    if ordina == "data_ordine" and valore is not None:
+        valore = datetime.fromisoformat(valore)
+    return valore, riga_id
 
-# --- ADMIN: Visualizza ordine ---
 @router.get("/admin/ordini_ristorante")
-def ordini_per_admin(request: Request, db: Session = Depends(get_db)):
-    user_id = request.session.get("user_id")
-    if not user_id:
-        raise HTTPException(403, "Utente non autenticato")
+@budget_query(10)
+async def ordini_per_admin(
+    filtri: FiltriStorico = Depends(),
+    ordina: str = "data_ordine",
+    direzione: str = "desc",
+    limite: int = Query(50, ge=1, le=500),
+    cursore: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    principal: Principal = Depends(get_principal)
+):
+    if ordina not in COLONNE_STORICO or direzione not in ("asc", "desc"):
+        raise HTTPException(400, "Ordinamento non valido")
 
-    user = db.query(models.User).get(user_id)
-    if not user or not user.ristoranti:
+    ristorante_ids = sorted(principal.ristorante_ids)
+    if not ristorante_ids:
         raise HTTPException(403, "Utente non valido o senza ristoranti")
 
-    ristorante_ids = [r.id for r in user.ristoranti]
+    base = query_storico(ristorante_ids, filtri)
+    colonna = COLONNE_STORICO[ordina]
+    chiave = tuple_(colonna, models.OrderItem.id)
 
-    ordini = (
-        db.query(models.Ordine)
-        .options(joinedload(models.Ordine.righe).joinedload(models.OrderItem.prodotto))
-        .filter(models.Ordine.ristorante_id.in_(ristorante_ids), models.Ordine.inviato.is_(True))
-        .order_by(models.Ordine.data_ordine.desc())
-        .all()
-    )
+    query = base.add_columns(colonna.label("_chiave"))
+    if cursore:
+        valore, riga_id = _decodifica_cursore(cursore, ordina, direzione)
+        if direzione == "asc":
+            query = query.where(chiave > tuple_(literal(valore, colonna.type), literal(riga_id)))
+        else:
+            query = query.where(chiave < tuple_(literal(valore, colonna.type), literal(riga_id)))
+    if direzione == "asc":
+        query = query.order_by(colonna.asc(), models.OrderItem.id.asc())
+    else:
+        query = query.order_by(colonna.desc(), models.OrderItem.id.desc())
+
+    # una riga in più per sapere se esiste una pagina successiva
+    righe = (await db.execute(query.limit(limite + 1))).all()
+    altre = len(righe) > limite
+    righe = righe[:limite]
+
+    prossimo = None
+    if altre:
+        ultima = righe[-1]
+        prossimo = _codifica_cursore(ordina, direzione, ultima._chiave, ultima.riga_id)
+
+    # conteggio solo sulla prima pagina, limitato a SOGLIA_CONTEGGIO righe
+    totale, esatto = None, None
+    if not cursore:
+        contate = await db.scalar(
+            select(func.count()).select_from(base.limit(SOGLIA_CONTEGGIO + 1).subquery())
+        )
+        totale, esatto = min(contate, SOGLIA_CONTEGGIO), contate <= SOGLIA_CONTEGGIO
+
+    return JSONResponse({
+        "righe": [riga_storico(r) for r in righe],
+        "cursore": prossimo,
+        "totale_stimato": totale,
+        "totale_esatto": esatto
+    })
+
+# --- ADMIN: export in streaming (CSV / NDJSON) dello storico ---
+COLONNE_EXPORT = ["ristorante", "order_manager", "data_ordine", "prodotto", "quantita", "prezzo_unitario", "prezzo_totale", "note"]
+BATCH_EXPORT = 1000
+
+async def _righe_export(query, formato: str, separatore: str):
+    # sessione propria: il generatore gira dopo la chiusura delle dipendenze della richiesta
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(query.execution_options(yield_per=BATCH_EXPORT))
+        if formato == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, delimiter=separatore)
+            buffer.write("\ufeff")  # BOM: Excel riconosce l'UTF-8 (accenti)
+            writer.writerow(COLONNE_EXPORT)
+            yield buffer.getvalue()
+
+        async for partizione in result.partitions(BATCH_EXPORT):
+            if formato == "csv":
+                buffer.seek(0)
+                buffer.truncate()
+                for r in partizione:
+                    riga = riga_storico(r)
+                    writer.writerow([riga[c] for c in COLONNE_EXPORT])
+                yield buffer.getvalue()
+            else:
+                yield "".join(json.dumps(riga_storico(r), ensure_ascii=False) + "\n" for r in partizione)
+
+@router.get("/admin/export")
+async def export_ordini_admin(
+    filtri: FiltriStorico = Depends(),
+    formato: str = Query("csv", pattern="^(csv|ndjson)$"),
+    separatore: str = Query(";", min_length=1, max_length=1),
+    ordina: str = "data_ordine",
+    direzione: str = "desc",
+    principal: Principal = Depends(get_principal)
+):
+    if ordina not in COLONNE_STORICO or direzione not in ("asc", "desc"):
+        raise HTTPException(400, "Ordinamento non valido")
 
-    # ⚠️ forza il refresh da DB, così legge l'update manuale
-    for ordine in ordini:
-        db.refresh(ordine)
-
-    dati = []
-    for o in ordini:
-        for r in o.righe:
-            dati.append({
-                "ristorante": o.ristorante.nome,
-                "order_manager": o.user.email,
-                "data_ordine": o.data_ordine.strftime("%Y-%m-%d %H:%M"),
-                "prodotto": r.prodotto.nome if r.prodotto else "—",
-                "quantita": r.quantita,
-                "prezzo_unitario": r.prezzo_unitario,
-                "prezzo_totale": r.quantita * r.prezzo_unitario,
-                "note": o.note or "",
-                "inviato": o.inviato
-            })
-    return JSONResponse(dati)
+    ristorante_ids = sorted(principal.ristorante_ids)
+    if not ristorante_ids:
+        raise HTTPException(403, "Utente non valido o senza ristoranti")
+
+    colonna = COLONNE_STORICO[ordina]
+    query = query_storico(ristorante_ids, filtri)
+    if direzione == "asc":
+        query = query.order_by(colonna.asc(), models.OrderItem.id.asc())
+    else:
+        query = query.order_by(colonna.desc(), models.OrderItem.id.desc())
+
+    nome_file = f"storico_ordini_{datetime.now():%Y%m%d}.{formato}"
+    media_type = "text/csv; charset=utf-8" if formato == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        _righe_export(query, formato, separatore),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{nome_file}"'}
+    )
 
 # --- Id ristorante ---
 @router.get("/ristoranti_miei")
-def get_ristoranti_utente(request: Request, db: Session = Depends(get_db)):
-    user_id = request.session.get("user_id")
-    if not user_id:
-        raise HTTPException(403, "Utente non autenticato")
-
-    user = db.query(models.User).get(user_id)
-    if not user or not user.ristoranti:
+@budget_query(5)
+async def get_ristoranti_utente(
+    db: AsyncSession = Depends(get_async_db),
+    principal: Principal = Depends(get_principal)
+):
+    ristoranti = (await db.execute(
+        select(models.Ristorante.id, models.Ristorante.nome)
+        .where(models.Ristorante.id.in_(principal.ristorante_ids))
+        .order_by(models.Ristorante.id)
+    )).all()
+    if not ristoranti:
         raise HTTPException(404, "Nessun ristorante associato")
 
     return [
         {"id": r.id, "nome": r.nome}
-        for r in user.ristoranti
+        for r in ristoranti
     ]
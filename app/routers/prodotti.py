@@ -1,37 +1,38 @@
 # app/routers/prodotti.py
 
-import os
-import uuid
-from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status, UploadFile, File, Form
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
 from typing import List, Optional
 
-from app import schemas, models
-from app.database import get_db
-from app.dependencies import require_role
-from app.config import UPLOADS_DIR
+from app import catalogo, immagini, listini, ricerca, schemas, models
+from app.database import get_db, get_async_db, insert_dialetto
+from app.dependencies import Principal, require_role
+from app.statistiche_sql import budget_query
 
 router = APIRouter(
     prefix="/prodotti",
     tags=["prodotti"]
 )
 
+pv = models.product_visibility
+
+# coppie per DELETE ... WHERE (prodotto_id, ristorante_id) IN (...): 2 parametri ciascuna
+BATCH_VISIBILITA = 500
+
 # -----------------------------
 # Helpers
 # -----------------------------
 def _save_image(file: Optional[UploadFile]) -> Optional[str]:
     if not file:
         return None
-    # estensione sicura
-    _, ext = os.path.splitext(file.filename or "")
-    ext = ext.lower() if ext else ".jpg"
-    name = f"{uuid.uuid4().hex}{ext}"
-    dest_path = os.path.join(UPLOADS_DIR, name)
-    with open(dest_path, "wb") as f:
-        f.write(file.file.read())
-    # URL statico servito da /static/uploads/...
-    return f"/static/uploads/{name}"
+    # archivio per contenuto, scritto a blocchi (vedi app/immagini.py)
+    try:
+        return immagini.salva_stream(file.file, file.filename)
+    except immagini.ErroreImmagine as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 # -----------------------------
 # CRUD (protetto: window_dresser o superuser)
@@ -44,7 +45,7 @@ def create_prodotto(
     descrizione: Optional[str] = Form(None),
     immagine: Optional[UploadFile] = File(None),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(require_role("window_dresser"))
+    current_user: Principal = Depends(require_role("window_dresser"))
 ):
     # immagine
     img_url = _save_image(immagine) if immagine else None
@@ -57,6 +58,8 @@ def create_prodotto(
         fornitore_id=fornitore_id
     )
     db.add(nuovo)
+    immagini.aggiorna_riferimenti(db, aggiunti=[img_url])
+    catalogo.incrementa_versioni(db, "prodotti")
     db.commit()
     db.refresh(nuovo)
     return nuovo
@@ -70,7 +73,7 @@ def modifica_prodotto(
     descrizione: Optional[str] = Form(None),
     immagine: Optional[UploadFile] = File(None),
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(require_role("window_dresser"))
+    current_user: Principal = Depends(require_role("window_dresser"))
 ):
     prodotto = db.query(models.Prodotto).get(prodotto_id)
     if not prodotto:
@@ -81,13 +84,19 @@ def modifica_prodotto(
     prodotto.prezzo = prezzo
     prodotto.fornitore_id = fornitore_id
     prodotto.descrizione = descrizione
+    # modifica manuale: il prossimo listino del fornitore riscrive comunque la riga
+    prodotto.hash_riga = None
 
     # se inviata una nuova immagine, salvala e sostituisci url
     if immagine and immagine.filename:
         img_url = _save_image(immagine)
+        immagini.aggiorna_riferimenti(db, aggiunti=[img_url], rimossi=[prodotto.immagine_url])
         prodotto.immagine_url = img_url
 
+    catalogo.incrementa_versioni(db, "prodotti")
     db.commit()
+    # il prodotto può essere visibile in qualsiasi ristorante
+    catalogo.invalida()
     db.refresh(prodotto)
     return prodotto
 
@@ -95,73 +104,235 @@ def modifica_prodotto(
 def elimina_prodotto(
     prodotto_id: int,
     db: Session = Depends(get_db),
-    current_user: models.User = Depends(require_role("window_dresser"))
+    current_user: Principal = Depends(require_role("window_dresser"))
 ):
     prodotto = db.query(models.Prodotto).get(prodotto_id)
     if not prodotto:
         raise HTTPException(status_code=404, detail="Prodotto non trovato")
     db.delete(prodotto)
+    immagini.aggiorna_riferimenti(db, rimossi=[prodotto.immagine_url])
+    catalogo.incrementa_versioni(db, "prodotti", "visibilita")
     db.commit()
+    catalogo.invalida()
     return
 
+# -----------------------------
+# Ricerca nei prodotti visibili a un ristorante (vedi app/ricerca.py)
+# -----------------------------
+def _verifica_accesso_ristorante(user: Principal, ristorante_id: int):
+    # window_dresser e superuser vedono tutti i ristoranti, gli order manager solo i propri
+    if user.ha_ruolo("window_dresser") or ristorante_id in user.ristorante_ids:
+        return
+    raise HTTPException(status_code=403, detail="Non sei associato a questo ristorante")
+
+@router.get("/cerca")
+@budget_query(5)
+async def cerca_prodotti(
+    ristorante_id: int,
+    q: str = Query(..., min_length=1, max_length=200),
+    limite: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role("order_manager", "window_dresser"))
+):
+    _verifica_accesso_ristorante(current_user, ristorante_id)
+    return await db.run_sync(ricerca.cerca, q, ristorante_id, limite)
+
+@router.get("/autocompleta")
+@budget_query(5)
+async def autocompleta_prodotti(
+    ristorante_id: int,
+    q: str = Query(..., min_length=1, max_length=100),
+    limite: int = Query(8, ge=1, le=20),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role("order_manager", "window_dresser"))
+):
+    _verifica_accesso_ristorante(current_user, ristorante_id)
+    return await db.run_sync(ricerca.autocompleta, q, ristorante_id, limite)
+
+# -----------------------------
+# Import listino fornitore (CSV o JSON, vedi app/listini.py)
+# -----------------------------
+@router.post("/import")
+def importa_listino(
+    file: UploadFile = File(...),
+    fornitore_id: Optional[int] = Form(None),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(require_role("window_dresser"))
+):
+    try:
+        righe = listini.leggi_righe(file.file, listini.formato_da_nome(file.filename))
+        return listini.importa_listino(db, righe, fornitore_id)
+    except listini.ErroreListino as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# -----------------------------
+# Matrice di visibilità (dichiarata prima di /{prodotto_id})
+# -----------------------------
+@router.get("/visibilita", response_model=schemas.VisibilitaMatrice)
+@budget_query(10)
+async def get_visibility_matrix(
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role("window_dresser"))
+):
+    validatori = await db.run_sync(catalogo.validatori, "visibilita")
+    non_modificato = validatori.risposta(request, response)
+    if non_modificato:
+        return non_modificato
+
+    matrice = {}
+    for prodotto_id, ristorante_id in (await db.execute(
+        select(pv.c.prodotto_id, pv.c.ristorante_id).order_by(pv.c.prodotto_id, pv.c.ristorante_id)
+    )).all():
+        matrice.setdefault(prodotto_id, []).append(ristorante_id)
+    return {"prodotti": matrice}
+
+@router.post("/visibilita", response_model=schemas.VisibilitaEsito)
+async def bulk_visibility(
+    modifiche: schemas.VisibilitaModifiche,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role("window_dresser"))
+):
+    concedi = {(c.prodotto_id, c.ristorante_id) for c in modifiche.concedi}
+    revoca = {(c.prodotto_id, c.ristorante_id) for c in modifiche.revoca}
+    if concedi & revoca:
+        raise HTTPException(status_code=400, detail="Coppie presenti sia in concedi che in revoca")
+    coppie = concedi | revoca
+    if not coppie:
+        return {"concessi": 0, "revocati": 0}
+
+    prodotto_ids = {p for p, _ in coppie}
+    ristorante_ids = {r for _, r in coppie}
+    trovati = set((await db.scalars(select(models.Prodotto.id).where(models.Prodotto.id.in_(prodotto_ids)))).all())
+    if trovati != prodotto_ids:
+        raise HTTPException(status_code=404, detail=f"Prodotti non trovati: {sorted(prodotto_ids - trovati)}")
+    trovati = set((await db.scalars(select(models.Ristorante.id).where(models.Ristorante.id.in_(ristorante_ids)))).all())
+    if trovati != ristorante_ids:
+        raise HTTPException(status_code=404, detail=f"Ristoranti non trovati: {sorted(ristorante_ids - trovati)}")
+
+    # differenza con lo stato attuale: si scrivono solo le coppie che cambiano
+    esistenti = set((await db.execute(
+        select(pv.c.prodotto_id, pv.c.ristorante_id)
+        .where(pv.c.prodotto_id.in_(prodotto_ids), pv.c.ristorante_id.in_(ristorante_ids))
+    )).tuples().all())
+    da_inserire = sorted(concedi - esistenti)
+    da_cancellare = sorted(revoca & esistenti)
+
+    if da_inserire:
+        await db.execute(
+            insert_dialetto(db, pv).on_conflict_do_nothing(),
+            [{"prodotto_id": p, "ristorante_id": r} for p, r in da_inserire],
+        )
+    for i in range(0, len(da_cancellare), BATCH_VISIBILITA):
+        await db.execute(
+            delete(pv).where(tuple_(pv.c.prodotto_id, pv.c.ristorante_id).in_(da_cancellare[i:i + BATCH_VISIBILITA]))
+        )
+
+    if da_inserire or da_cancellare:
+        await db.run_sync(catalogo.incrementa_versioni, "visibilita")
+        await db.commit()
+        catalogo.invalida({r for _, r in da_inserire + da_cancellare})
+    return {"concessi": len(da_inserire), "revocati": len(da_cancellare)}
+
 # -----------------------------
 # Lettura
 # -----------------------------
+# ETag e Last-Modified dalle versioni del catalogo: il fornitore è incluso nella risposta
 @router.get("/", response_model=List[schemas.Prodotto])
-def read_prodotti(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return db.query(models.Prodotto).offset(skip).limit(limit).all()
+@budget_query(6)
+async def read_prodotti(
+    request: Request,
+    response: Response,
+    skip: int = 0,
+    limit: int = 100,
+    db: AsyncSession = Depends(get_async_db)
+):
+    validatori = await db.run_sync(catalogo.validatori, "prodotti", "fornitori")
+    non_modificato = validatori.risposta(request, response)
+    if non_modificato:
+        return non_modificato
+    result = await db.execute(
+        select(models.Prodotto)
+        .options(selectinload(models.Prodotto.fornitore))
+        .order_by(models.Prodotto.id)
+        .offset(skip)
+        .limit(limit)
+    )
+    return result.scalars().all()
 
 @router.get("/{prodotto_id}", response_model=schemas.Prodotto)
-def read_prodotto(prodotto_id: int, db: Session = Depends(get_db)):
-    obj = db.query(models.Prodotto).get(prodotto_id)
+@budget_query(6)
+async def read_prodotto(
+    prodotto_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
+):
+    obj = await db.get(models.Prodotto, prodotto_id, options=[selectinload(models.Prodotto.fornitore)])
     if not obj:
         raise HTTPException(status_code=404, detail="Prodotto non trovato")
+    validatori = await db.run_sync(catalogo.validatori, "prodotti", "fornitori")
+    non_modificato = validatori.risposta(request, response)
+    if non_modificato:
+        return non_modificato
     return obj
 
 # -----------------------------
 # Visibilità Prodotto <-> Ristoranti
 # -----------------------------
+async def _verifica_prodotto_ristorante(db: AsyncSession, prodotto_id: int, ristorante_id: int):
+    prodotto = await db.get(models.Prodotto, prodotto_id)
+    ristorante = await db.get(models.Ristorante, ristorante_id)
+    if not prodotto or not ristorante:
+        raise HTTPException(status_code=404, detail="Prodotto o Ristorante non trovato")
+
 @router.get("/{prodotto_id}/visibilita", response_model=List[int])
-def get_visibility(
+async def get_visibility(
     prodotto_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(require_role("window_dresser"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role("window_dresser"))
 ):
-    prodotto = db.query(models.Prodotto).get(prodotto_id)
+    prodotto = await db.get(models.Prodotto, prodotto_id)
     if not prodotto:
         raise HTTPException(status_code=404, detail="Prodotto non trovato")
-    return [r.id for r in prodotto.visibile_in]
+    result = await db.scalars(select(pv.c.ristorante_id).where(pv.c.prodotto_id == prodotto_id))
+    return result.all()
 
 @router.post("/{prodotto_id}/visibilita/{ristorante_id}", status_code=status.HTTP_204_NO_CONTENT)
-def add_visibility(
+async def add_visibility(
     prodotto_id: int,
     ristorante_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(require_role("window_dresser"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role("window_dresser"))
 ):
-    prodotto = db.query(models.Prodotto).get(prodotto_id)
-    ristorante = db.query(models.Ristorante).get(ristorante_id)
-    if not prodotto or not ristorante:
-        raise HTTPException(status_code=404, detail="Prodotto o Ristorante non trovato")
+    await _verifica_prodotto_ristorante(db, prodotto_id, ristorante_id)
 
-    if ristorante not in prodotto.visibile_in:
-        prodotto.visibile_in.append(ristorante)
-        db.commit()
+    # controllo sulla sola coppia, senza caricare tutta la collezione visibile_in
+    esiste = await db.scalar(
+        select(pv.c.prodotto_id).where(pv.c.prodotto_id == prodotto_id, pv.c.ristorante_id == ristorante_id)
+    )
+    if not esiste:
+        await db.execute(insert(pv).values(prodotto_id=prodotto_id, ristorante_id=ristorante_id))
+        await db.run_sync(catalogo.incrementa_versioni, "visibilita")
+        await db.commit()
+        catalogo.invalida([ristorante_id])
     return
 
 @router.delete("/{prodotto_id}/visibilita/{ristorante_id}", status_code=status.HTTP_204_NO_CONTENT)
-def remove_visibility(
+async def remove_visibility(
     prodotto_id: int,
     ristorante_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(require_role("window_dresser"))
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role("window_dresser"))
 ):
-    prodotto = db.query(models.Prodotto).get(prodotto_id)
-    ristorante = db.query(models.Ristorante).get(ristorante_id)
-    if not prodotto or not ristorante:
-        raise HTTPException(status_code=404, detail="Prodotto o Ristorante non trovato")
+    await _verifica_prodotto_ristorante(db, prodotto_id, ristorante_id)
 
-    if ristorante in prodotto.visibile_in:
-        prodotto.visibile_in.remove(ristorante)
-        db.commit()
+    result = await db.execute(
+        delete(pv).where(pv.c.prodotto_id == prodotto_id, pv.c.ristorante_id == ristorante_id)
+    )
+    if result.rowcount:
+        await db.run_sync(catalogo.incrementa_versioni, "visibilita")
+        await db.commit()
+        catalogo.invalida([ristorante_id])
     return
@@ -0,0 +1,149 @@
+# app/routers/report.py
+
+from collections import defaultdict
+from datetime import date
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import models
+from app.database import get_async_db
+from app.dependencies import Principal, require_role
+from app.statistiche_sql import budget_query
+
+router = APIRouter(
+    prefix="/report",
+    tags=["report"]
+)
+
+# I report leggono solo le tabelle di rollup (vedi app/report.py)
+
+# -----------------------------
+# Helpers
+# -----------------------------
+def _ristoranti_visibili(user: Principal, ristorante_id: Optional[int]):
+    # superuser: tutti i ristoranti; admin: solo i propri
+    if user.is_superuser:
+        return [ristorante_id] if ristorante_id else None
+
+    ids = user.ristorante_ids
+    if ristorante_id:
+        if ristorante_id not in ids:
+            raise HTTPException(status_code=403, detail="Non sei associato a questo ristorante")
+        return [ristorante_id]
+    if not ids:
+        raise HTTPException(status_code=403, detail="Utente senza ristoranti")
+    return list(ids)
+
+def _filtra(query, colonna_ristorante, ristorante_ids, colonna_data, data_da, data_a):
+    if ristorante_ids is not None:
+        query = query.where(colonna_ristorante.in_(ristorante_ids))
+    if data_da:
+        query = query.where(colonna_data >= data_da)
+    if data_a:
+        query = query.where(colonna_data <= data_a)
+    return query
+
+# -----------------------------
+# Fatturato e ordini per periodo
+# -----------------------------
+@router.get("/fatturato")
+@budget_query(5)
+async def report_fatturato(
+    granularita: str = Query("giorno", pattern="^(giorno|mese)$"),
+    data_da: Optional[date] = None,
+    data_a: Optional[date] = None,
+    ristorante_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role("admin"))
+):
+    ristorante_ids = _ristoranti_visibili(current_user, ristorante_id)
+    R = models.ReportRistoranteGiorno
+    query = _filtra(
+        select(R.ristorante_id, R.giorno, R.n_ordini, R.fatturato),
+        R.ristorante_id, ristorante_ids, R.giorno, data_da, data_a,
+    ).order_by(R.giorno, R.ristorante_id)
+    righe = (await db.execute(query)).all()
+
+    # al massimo 366 righe per ristorante all'anno: l'aggregazione mensile si fa qui
+    periodi = defaultdict(lambda: {"n_ordini": 0, "fatturato": 0.0})
+    for r in righe:
+        periodo = r.giorno if granularita == "giorno" else r.giorno.replace(day=1)
+        p = periodi[(r.ristorante_id, periodo)]
+        p["n_ordini"] += r.n_ordini
+        p["fatturato"] += r.fatturato
+
+    return [
+        {
+            "ristorante_id": rid,
+            "periodo": periodo.isoformat() if granularita == "giorno" else periodo.strftime("%Y-%m"),
+            "n_ordini": v["n_ordini"],
+            "fatturato": round(v["fatturato"], 2),
+        }
+        for (rid, periodo), v in periodi.items()
+    ]
+
+# -----------------------------
+# Prodotti più venduti
+# -----------------------------
+@router.get("/prodotti_top")
+@budget_query(5)
+async def report_prodotti_top(
+    data_da: Optional[date] = None,
+    data_a: Optional[date] = None,
+    ristorante_id: Optional[int] = None,
+    ordina: str = Query("fatturato", pattern="^(fatturato|quantita)$"),
+    limite: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role("admin"))
+):
+    ristorante_ids = _ristoranti_visibili(current_user, ristorante_id)
+    P = models.ReportProdottoGiorno
+    quantita = func.sum(P.quantita).label("quantita")
+    fatturato = func.sum(P.fatturato).label("fatturato")
+    query = _filtra(
+        select(P.prodotto_id, models.Prodotto.nome, quantita, fatturato)
+        .join(models.Prodotto, models.Prodotto.id == P.prodotto_id),
+        P.ristorante_id, ristorante_ids, P.giorno, data_da, data_a,
+    )
+    query = (
+        query.group_by(P.prodotto_id, models.Prodotto.nome)
+        .order_by((fatturato if ordina == "fatturato" else quantita).desc())
+        .limit(limite)
+    )
+    return [
+        {"prodotto_id": r.prodotto_id, "prodotto": r.nome, "quantita": r.quantita, "fatturato": round(r.fatturato, 2)}
+        for r in (await db.execute(query)).all()
+    ]
+
+# -----------------------------
+# Order manager più attivi
+# -----------------------------
+@router.get("/order_manager")
+@budget_query(5)
+async def report_order_manager(
+    mese_da: Optional[date] = None,
+    mese_a: Optional[date] = None,
+    ristorante_id: Optional[int] = None,
+    limite: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(require_role("admin"))
+):
+    ristorante_ids = _ristoranti_visibili(current_user, ristorante_id)
+    M = models.ReportOrderManagerMese
+    n_ordini = func.sum(M.n_ordini).label("n_ordini")
+    fatturato = func.sum(M.fatturato).label("fatturato")
+    query = _filtra(
+        select(M.user_id, models.User.email, n_ordini, fatturato)
+        .join(models.User, models.User.id == M.user_id),
+        M.ristorante_id, ristorante_ids, M.mese,
+        mese_da.replace(day=1) if mese_da else None,
+        mese_a,
+    )
+    query = query.group_by(M.user_id, models.User.email).order_by(n_ordini.desc()).limit(limite)
+    return [
+        {"user_id": r.user_id, "order_manager": r.email, "n_ordini": r.n_ordini, "fatturato": round(r.fatturato, 2)}
+        for r in (await db.execute(query)).all()
+    ]
@@ -1,11 +1,12 @@
 # app/routers/ristoranti.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
 from sqlalchemy.orm import Session
 from typing import List
 
-from app import schemas, models
+from app import catalogo, schemas, models
 from app.database import get_db
+from app.dependencies import invalida_principal
 
 router = APIRouter(
     prefix="/ristoranti",
@@ -16,19 +17,26 @@ router = APIRouter(
 def create_ristorante(r: schemas.RistoranteCreate, db: Session = Depends(get_db)):
     db_obj = models.Ristorante(nome=r.nome, abbonamento_attivo=r.abbonamento_attivo)
     db.add(db_obj)
+    catalogo.incrementa_versioni(db, "ristoranti")
     db.commit()
     db.refresh(db_obj)
     return db_obj
 
 @router.get("/", response_model=List[schemas.Ristorante])
-def read_ristoranti(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def read_ristoranti(request: Request, response: Response, skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+    non_modificato = catalogo.validatori(db, "ristoranti").risposta(request, response)
+    if non_modificato:
+        return non_modificato
     return db.query(models.Ristorante).offset(skip).limit(limit).all()
 
 @router.get("/{ristorante_id}", response_model=schemas.Ristorante)
-def read_ristorante(ristorante_id: int, db: Session = Depends(get_db)):
+def read_ristorante(ristorante_id: int, request: Request, response: Response, db: Session = Depends(get_db)):
     obj = db.query(models.Ristorante).get(ristorante_id)
     if not obj:
         raise HTTPException(status_code=404, detail="Ristorante non trovato")
+    non_modificato = catalogo.validatori(db, "ristoranti").risposta(request, response)
+    if non_modificato:
+        return non_modificato
     return obj
 
 @router.delete("/{ristorante_id}")
@@ -44,5 +52,9 @@ def delete_ristorante(ristorante_id: int, db: Session = Depends(get_db)):
         u.ristorante_id = None
 
     db.delete(ristorante)
+    catalogo.incrementa_versioni(db, "ristoranti", "visibilita")
     db.commit()
+    catalogo.invalida([ristorante_id])
+    # utenti disattivati e associazioni al ristorante rimosse
+    invalida_principal()
     return {"ok": True, "msg": f"Ristorante {ristorante_id} eliminato. {len(utenti)} utente/i disattivato/i"}
@@ -1,7 +1,7 @@
 # app/schemas.py
 
 from pydantic import BaseModel, field_serializer
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 
 # --------------------
@@ -102,11 +102,32 @@ class ProdottoCreate(ProdottoBase):
 
 class Prodotto(ProdottoBase):
     id: int
+    sku: Optional[str] = None
     fornitore: Optional[Fornitore] = None
 
     class Config:
         from_attributes = True
 
+# --------------------
+# VISIBILITÀ PRODOTTI <-> RISTORANTI
+# --------------------
+
+class VisibilitaCoppia(BaseModel):
+    prodotto_id: int
+    ristorante_id: int
+
+class VisibilitaModifiche(BaseModel):
+    concedi: List[VisibilitaCoppia] = []
+    revoca: List[VisibilitaCoppia] = []
+
+class VisibilitaEsito(BaseModel):
+    concessi: int
+    revocati: int
+
+class VisibilitaMatrice(BaseModel):
+    # prodotto_id -> ristoranti in cui è visibile (i prodotti senza visibilità sono omessi)
+    prodotti: Dict[int, List[int]]
+
 # --------------------
 # ORDER ITEM
 # --------------------
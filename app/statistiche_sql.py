@@ -0,0 +1,193 @@
+# app/statistiche_sql.py
+#
+# Conteggio delle query SQL per richiesta. Gli eventi degli engine (sync e
+# async, vedi database.configura_engine) sommano query e tempo nel DB su un
+# oggetto StatisticheSQL tenuto in una ContextVar: la imposta MiddlewareQuery
+# per ogni richiesta HTTP e arriva sia agli endpoint async sia a quelli sync
+# (il threadpool copia il contesto). Fuori da una richiesta (job, script) non
+# si conta nulla, a meno di usare misura().
+#
+# La stessa query (a meno dei parametri e della lunghezza delle liste IN)
+# eseguita almeno SQL_N1_SOGLIA volte in una richiesta è un N+1 sospetto:
+# tipicamente un lazy load in un ciclo (ordine.user, r.prodotto.fornitore…).
+# I lazy load sono anche contati per relazione, per trovare quale.
+#
+# Ogni endpoint ha un budget di query (budget_query, default SQL_BUDGET_QUERY).
+# Superarlo scrive un avviso; con SQL_BUDGET_STRETTO=1 (test, CI) solleva
+# BudgetQuerySuperato prima di inviare la risposta, così la richiesta fallisce.
+
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app import metriche
+
+SQL_N1_SOGLIA = int(os.getenv("SQL_N1_SOGLIA", 5))
+SQL_BUDGET_QUERY = int(os.getenv("SQL_BUDGET_QUERY", 30))
+SQL_BUDGET_STRETTO = os.getenv("SQL_BUDGET_STRETTO", "0") == "1"
+# X-Query-Count, X-Query-Time-Ms e X-Query-N1 nelle risposte
+SQL_INTESTAZIONI = os.getenv("SQL_INTESTAZIONI", "1") == "1"
+
+# segnaposto dei parametri nei vari driver: ?, %s, %(nome)s, $1, :nome
+_SEGNAPOSTO = r"(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)"
+_LISTA = re.compile(rf"\(\s*{_SEGNAPOSTO}(?:\s*,\s*{_SEGNAPOSTO})+\s*\)")
+_SPAZI = re.compile(r"\s+")
+
+
+class BudgetQuerySuperato(AssertionError):
+    pass
+
+
+def forma(statement: str) -> str:
+    """La query senza dettagli che cambiano tra esecuzioni equivalenti (liste IN, spazi)."""
+    return _SPAZI.sub(" ", _LISTA.sub("(…)", statement)).strip()
+
+
+class StatisticheSQL:
+    __slots__ = ("query", "tempo", "statement", "lazy")
+
+    def __init__(self):
+        self.query = 0
+        self.tempo = 0.0
+        self.statement = Counter()  # testo SQL -> esecuzioni
+        self.lazy = Counter()       # "Ordine -> User" -> lazy load
+
+    def sospette(self, soglia: int | None = None) -> list:
+        """[(forma, esecuzioni)] delle query ripetute almeno soglia volte, le più ripetute prima."""
+        soglia = SQL_N1_SOGLIA if soglia is None else soglia
+        forme = Counter()
+        for statement, n in self.statement.items():
+            forme[forma(statement)] += n
+        return [(f, n) for f, n in forme.most_common() if n >= soglia]
+
+
+_corrente: ContextVar = ContextVar("statistiche_sql", default=None)
+
+
+@contextmanager
+def misura():
+    """Conta le query eseguite nel blocco (script, benchmark, test)."""
+    statistiche = StatisticheSQL()
+    token = _corrente.set(statistiche)
+    try:
+        yield statistiche
+    finally:
+        _corrente.reset(token)
+
+
+def budget_query(massimo: int):
+    """Decoratore per gli endpoint: query massime per richiesta."""
+    def decora(funzione):
+        funzione.budget_query = massimo
+        return funzione
+    return decora
+
+
+# -----------------------------
+# Eventi di engine e sessione
+# -----------------------------
+def _prima(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _corrente.get() is not None:
+        context._inizio_statistiche = time.perf_counter()
+
+
+def _dopo(conn, cursor, statement, parameters, context, executemany):
+    statistiche = _corrente.get()
+    if statistiche is None:
+        return
+    inizio = getattr(context, "_inizio_statistiche", None)
+    if inizio is not None:
+        statistiche.tempo += time.perf_counter() - inizio
+    statistiche.query += 1
+    statistiche.statement[statement] += 1
+
+
+def registra_engine(engine):
+    event.listen(engine, "before_cursor_execute", _prima)
+    event.listen(engine, "after_cursor_execute", _dopo)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _lazy_load(stato):
+    statistiche = _corrente.get()
+    if statistiche is None or not stato.is_select or stato.lazy_loaded_from is None:
+        return
+    destinazione = stato.bind_mapper.class_.__name__ if stato.bind_mapper else "?"
+    statistiche.lazy[f"{stato.lazy_loaded_from.class_.__name__} -> {destinazione}"] += 1
+
+
+# -----------------------------
+# Middleware ASGI
+# -----------------------------
+def _oltre_budget(scope, statistiche: StatisticheSQL) -> str | None:
+    budget = getattr(scope.get("endpoint"), "budget_query", SQL_BUDGET_QUERY)
+    if statistiche.query > budget:
+        return f"{scope['method']} {metriche.rotta(scope)}: {statistiche.query} query, budget {budget}"
+    return None
+
+
+def _chiudi(scope, statistiche: StatisticheSQL):
+    metodo, template = scope["method"], metriche.rotta(scope)
+    metriche.SQL_QUERY.osserva(statistiche.query, template)
+    metriche.SQL_TEMPO.osserva(statistiche.tempo, template)
+
+    sospette = statistiche.sospette()
+    if sospette:
+        metriche.SQL_N1.inc(template)
+        dettaglio = "; ".join(f"{n}x {f[:160]}" for f, n in sospette[:3])
+        if statistiche.lazy:
+            dettaglio += " | lazy load: " + ", ".join(f"{n}x {r}" for r, n in statistiche.lazy.most_common(3))
+        logging.warning("N+1 sospetto in %s %s: %s", metodo, template, dettaglio)
+
+    messaggio = _oltre_budget(scope, statistiche)
+    if messaggio:
+        metriche.SQL_BUDGET.inc(template)
+        logging.warning("Budget di query superato: %s", messaggio)
+
+
+class MiddlewareQuery:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        statistiche = StatisticheSQL()
+
+        async def send_con_intestazioni(messaggio):
+            if messaggio["type"] == "http.response.start":
+                # in modalità stretta il budget si controlla prima che parta qualcosa
+                # verso il client: l'eccezione diventa un 500 (o un errore nel test)
+                # invece di arrivare dopo una risposta già inviata. Le query fatte
+                # mentre si scrive il corpo (streaming) restano fuori: per quelle
+                # solo avviso e metrica in _chiudi.
+                if SQL_BUDGET_STRETTO:
+                    superato = _oltre_budget(scope, statistiche)
+                    if superato:
+                        raise BudgetQuerySuperato(superato)
+                if SQL_INTESTAZIONI:
+                    intestazioni = list(messaggio.get("headers", []))
+                    intestazioni.append((b"x-query-count", str(statistiche.query).encode()))
+                    intestazioni.append((b"x-query-time-ms", f"{statistiche.tempo * 1000:.1f}".encode()))
+                    sospette = statistiche.sospette()
+                    if sospette:
+                        intestazioni.append((b"x-query-n1", str(len(sospette)).encode()))
+                    messaggio = dict(messaggio, headers=intestazioni)
+            await send(messaggio)
+
+        token = _corrente.set(statistiche)
+        try:
+            await self.app(scope, receive, send_con_intestazioni)
+        finally:
+            _corrente.reset(token)
+            # anche se l'endpoint solleva: metriche, N+1 e budget restano registrati
+            _chiudi(scope, statistiche)
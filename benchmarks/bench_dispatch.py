@@ -0,0 +1,110 @@
+# benchmarks/bench_dispatch.py
+#
+# Tempo del batch delle 16:00 (dispatch.esegui_dispatch) al variare del numero
+# di processi worker. Le mail vanno a un sink SMTP locale (aiosmtpd) che simula
+# la latenza di un server remoto. Lo speedup dipende dai core disponibili (la
+# prima riga li riporta): con un solo core lo spawn dei worker costa più di
+# quanto fanno risparmiare.
+#
+# Uso (dalla root del progetto):  pip install aiosmtpd && python benchmarks/bench_dispatch.py
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# DB temporaneo (l'app usa sqlite:///./sql_app.db) e SMTP verso il sink locale;
+# i worker spawn rieseguono questo modulo: la cartella passa dall'ambiente
+if "BENCH_DISPATCH_DIR" not in os.environ:
+    os.environ["BENCH_DISPATCH_DIR"] = tempfile.mkdtemp(prefix="bench_dispatch_")
+os.chdir(os.environ["BENCH_DISPATCH_DIR"])
+os.environ.update(
+    SMTP_HOST="127.0.0.1", SMTP_PORT="8030", SMTP_STARTTLS="0",
+    SMTP_USER="", SMTP_PASS="", EMAIL_FROM="ordini@example.com",
+)
+
+from aiosmtpd.controller import Controller
+
+from app import dispatch, models
+from app.database import Base, SessionLocal, engine
+
+N_RISTORANTI = 200
+N_FORNITORI = 40
+RIGHE_PER_ORDINE = 12
+LATENZA_SMTP = 0.2  # secondi per mail lato server
+WORKERS = [1, 2, 4, 8]
+N_PARTIZIONI = 16
+
+
+class Sink:
+    ricevute = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(LATENZA_SMTP)
+        Sink.ricevute += 1
+        return "250 OK"
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    fornitori = [models.Fornitore(nome=f"Fornitore {i}", email=f"fornitore{i}@example.com") for i in range(N_FORNITORI)]
+    prodotti = [
+        models.Prodotto(nome=f"Prodotto {i}", prezzo=1.0 + i % 20, fornitore=fornitori[i % N_FORNITORI])
+        for i in range(N_FORNITORI * 5)
+    ]
+    ristoranti = [models.Ristorante(nome=f"Ristorante {i}") for i in range(N_RISTORANTI)]
+    utenti = [models.User(email=f"om{i}@example.com", hashed_password="-", is_active=True) for i in range(N_RISTORANTI)]
+    db.add_all(fornitori + prodotti + ristoranti + utenti)
+    db.commit()
+    dati = ([r.id for r in ristoranti], [u.id for u in utenti], [(p.id, p.prezzo) for p in prodotti])
+    db.close()
+    return dati
+
+
+def apri_ordini(ristorante_ids, user_ids, prodotti):
+    db = SessionLocal()
+    for k, (rid, uid) in enumerate(zip(ristorante_ids, user_ids)):
+        ordine = models.Ordine(user_id=uid, ristorante_id=rid, data_ordine=datetime.utcnow(), totale=0, inviato=False)
+        db.add(ordine)
+        db.flush()
+        scelti = [prodotti[(k * 7 + j * 13) % len(prodotti)] for j in range(RIGHE_PER_ORDINE)]
+        db.add_all([
+            models.OrderItem(ordine_id=ordine.id, prodotto_id=pid, quantita=2, prezzo_unitario=prezzo)
+            for pid, prezzo in scelti
+        ])
+    db.commit()
+    db.close()
+
+
+def main():
+    ristorante_ids, user_ids, prodotti = seed()
+    controller = Controller(Sink(), hostname="127.0.0.1", port=8030)
+    controller.start()
+    try:
+        print(
+            f"{N_RISTORANTI} ristoranti, {N_FORNITORI} fornitori, latenza SMTP {LATENZA_SMTP * 1000:.0f} ms/mail, "
+            f"{os.cpu_count()} core"
+        )
+        print(f"{'worker':>6} | {'mail':>5} | {'secondi':>8} | {'speedup':>7}")
+        base = None
+        for workers in WORKERS:
+            apri_ordini(ristorante_ids, user_ids, prodotti)
+            Sink.ricevute = 0
+            t0 = time.perf_counter()
+            riepilogo = dispatch.esegui_dispatch(workers=workers, n_partizioni=N_PARTIZIONI)
+            secondi = time.perf_counter() - t0
+            assert riepilogo["stato"] == "completato", riepilogo
+            base = base or secondi
+            print(f"{workers:>6} | {Sink.ricevute:>5} | {secondi:>8.2f} | {base / secondi:>6.1f}x")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
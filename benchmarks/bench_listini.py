@@ -0,0 +1,61 @@
+# benchmarks/bench_listini.py
+#
+# Tempo di import di un listino fornitore (app/listini.py) su un DB temporaneo:
+# primo import (tutti nuovi), reimport identico (tutti invariati) e reimport
+# con il 10% dei prezzi cambiati.
+#
+# Uso (dalla root del progetto):  python benchmarks/bench_listini.py [righe]
+
+import io
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# DB temporaneo: l'app usa sqlite:///./sql_app.db relativo alla cartella corrente
+os.chdir(tempfile.mkdtemp(prefix="bench_listini_"))
+
+from app import listini, models
+from app.database import Base, SessionLocal, engine
+
+N_RIGHE = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+
+
+def listino(variazione: bool) -> bytes:
+    out = io.StringIO()
+    out.write("sku;nome;descrizione;prezzo\n")
+    for i in range(N_RIGHE):
+        prezzo = 1 + i % 97 + (0.5 if variazione and i % 10 == 0 else 0)
+        out.write(f"A{i:06d};Articolo {i};Descrizione articolo {i};{prezzo:.2f}".replace(".", ",") + "\n")
+    return out.getvalue().encode()
+
+
+def main():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    fornitore = models.Fornitore(nome="Fornitore Bench", email="bench@example.com")
+    db.add(fornitore)
+    db.commit()
+    fornitore_id = fornitore.id
+
+    print(f"{N_RIGHE} righe")
+    for etichetta, dati in (
+        ("primo import", listino(False)),
+        ("reimport identico", listino(False)),
+        ("10% prezzi cambiati", listino(True)),
+    ):
+        inizio = time.perf_counter()
+        esito = listini.importa_listino(db, listini.leggi_righe(io.BytesIO(dati), "csv"), fornitore_id)
+        durata = time.perf_counter() - inizio
+        print(
+            f"{etichetta:>20}: {durata:6.2f}s ({N_RIGHE / durata:8.0f} righe/s)  "
+            f"inseriti={esito['inseriti']} aggiornati={esito['aggiornati']} invariati={esito['invariati']}"
+        )
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_ordini.py
+#
+# Conta le query SQL eseguite da POST /ordini/ e PUT /ordini/order_manager/order_aggregato
+# al crescere del numero di righe: con la risoluzione prezzi in blocco il numero
+# di query deve restare costante.
+#
+# Uso (dalla root del progetto):  python benchmarks/bench_ordini.py
+
+import os
+import sys
+import tempfile
+import time as _time
+from datetime import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# DB temporaneo: l'app usa sqlite:///./sql_app.db relativo alla cartella corrente
+os.chdir(tempfile.mkdtemp(prefix="bench_ordini_"))
+
+from fastapi.testclient import TestClient
+from passlib.hash import bcrypt
+from sqlalchemy import event
+
+from app import models, orari
+from app.database import Base, SessionLocal, async_engine, engine
+from app.main import app
+
+N_PRODOTTI = 500
+RIGHE = [1, 10, 60, 200]
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    ristorante = models.Ristorante(nome="Bench")
+    fornitore = models.Fornitore(nome="Fornitore Bench", email="bench@example.com")
+    ruolo = models.Ruolo(nome="Order manager", ruolo="order_manager")
+    user = models.User(email="bench@example.com", hashed_password=bcrypt.hash("bench"), is_active=True)
+    user.ristoranti = [ristorante]
+    user.ruoli = [ruolo]
+    prodotti = [
+        models.Prodotto(nome=f"Prodotto {i}", prezzo=1.0 + i % 50, fornitore=fornitore)
+        for i in range(N_PRODOTTI)
+    ]
+    ristorante.prodotti_visibili = prodotti
+    db.add_all([ristorante, fornitore, ruolo, user, *prodotti])
+    db.commit()
+    ids = [p.id for p in prodotti]
+    rid = ristorante.id
+    db.close()
+    return rid, ids
+
+
+def main():
+    ristorante_id, prodotto_ids = seed()
+    orari.ORA_CUTOFF = time.max  # il benchmark deve girare a qualsiasi ora
+
+    contatore = {"n": 0}
+
+    def _conta(conn, cursor, statement, parameters, context, executemany):
+        contatore["n"] += 1
+
+    # gli endpoint async passano dall'engine sync sottostante ad async_engine
+    event.listen(engine, "before_cursor_execute", _conta)
+    event.listen(async_engine.sync_engine, "before_cursor_execute", _conta)
+
+    client = TestClient(app)
+    client.post("/login", data={"email": "bench@example.com", "password": "bench"}, follow_redirects=False)
+
+    print(f"{'righe':>6} | {'query POST':>10} | {'query PUT':>9} | {'ms POST':>8}")
+    for n in RIGHE:
+        righe = [{"prodotto_id": pid, "quantita": 2} for pid in prodotto_ids[:n]]
+
+        contatore["n"] = 0
+        t0 = _time.perf_counter()
+        resp = client.post("/ordini/", json={"ristorante_id": ristorante_id, "righe": righe})
+        ms = (_time.perf_counter() - t0) * 1000
+        assert resp.status_code == 200, resp.text
+        query_post = contatore["n"]
+
+        contatore["n"] = 0
+        resp = client.put(
+            f"/ordini/order_manager/order_aggregato?ristorante_id={ristorante_id}",
+            json=[{"prodotto_id": r["prodotto_id"], "quantita": 0} for r in righe],
+        )
+        assert resp.status_code == 200, resp.text
+        query_put = contatore["n"]
+
+        print(f"{n:>6} | {query_post:>10} | {query_put:>9} | {ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
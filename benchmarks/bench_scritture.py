@@ -0,0 +1,93 @@
+# benchmarks/bench_scritture.py
+#
+# Throughput di scrittura concorrente su SQLite: engine con impostazioni di
+# default (rollback journal, synchronous=FULL) contro l'engine configurato da
+# app.database (WAL, synchronous=NORMAL, busy_timeout, cache/mmap).
+# Simula più order manager che confermano ordini in parallelo.
+#
+# Uso (dalla root del progetto):  python benchmarks/bench_scritture.py [thread] [ordini_per_thread]
+
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import create_engine, insert, select, func
+from sqlalchemy.exc import OperationalError
+
+from app import models
+from app.database import Base, crea_engine
+
+THREAD = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+ORDINI_PER_THREAD = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+RIGHE_PER_ORDINE = 8
+
+
+def prepara(engine):
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.execute(insert(models.Fornitore), [{"id": 1, "nome": "F", "email": "f@example.com"}])
+        conn.execute(insert(models.Prodotto), [
+            {"id": i, "nome": f"P{i}", "prezzo": 1.5, "fornitore_id": 1} for i in range(1, 101)
+        ])
+
+
+def lavora(engine, n_thread, risultati):
+    errori = 0
+    for i in range(ORDINI_PER_THREAD):
+        try:
+            with engine.begin() as conn:
+                # lettura + scrittura come in create_ordine
+                conn.execute(select(models.Prodotto.prezzo).where(models.Prodotto.id.in_(range(1, 9)))).all()
+                ordine_id = conn.execute(insert(models.Ordine).values(
+                    user_id=n_thread, ristorante_id=1, data_ordine=datetime.utcnow(),
+                    totale=12.0, inviato=True,
+                )).inserted_primary_key[0]
+                conn.execute(insert(models.OrderItem), [
+                    {"ordine_id": ordine_id, "prodotto_id": p, "quantita": 1, "prezzo_unitario": 1.5}
+                    for p in range(1, RIGHE_PER_ORDINE + 1)
+                ])
+        except OperationalError:
+            errori += 1
+    risultati.append(errori)
+
+
+def misura(nome, engine):
+    prepara(engine)
+    risultati = []
+    threads = [threading.Thread(target=lavora, args=(engine, n, risultati)) for n in range(THREAD)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    durata = time.perf_counter() - t0
+    with engine.connect() as conn:
+        scritti = conn.execute(select(func.count()).select_from(models.Ordine)).scalar()
+    print(f"{nome:<10} {scritti / durata:>10.0f} ordini/s  {durata:>7.2f}s  errori 'database is locked': {sum(risultati)}")
+    engine.dispose()
+
+
+def main():
+    cartella = tempfile.mkdtemp(prefix="bench_scritture_")
+    print(f"{THREAD} thread × {ORDINI_PER_THREAD} ordini ({RIGHE_PER_ORDINE} righe ciascuno)")
+
+    # prima: come il vecchio app/database.py
+    prima = create_engine(
+        f"sqlite:///{os.path.join(cartella, 'prima.db')}",
+        connect_args={"check_same_thread": False},
+    )
+    misura("prima", prima)
+
+    # dopo: engine configurato con i pragma
+    dopo = crea_engine(f"sqlite:///{os.path.join(cartella, 'dopo.db')}")
+    misura("dopo", dopo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# benchmarks/bench_smtp.py
+#
+# Mail al secondo verso un sink SMTP locale (aiosmtpd): invio sequenziale con una
+# connessione per mail (vecchio comportamento del job) contro PoolSMTP + invio
+# concorrente. Il sink non usa TLS né AUTH, quindi il guadagno reale verso un
+# server remoto con STARTTLS è maggiore di quello misurato qui.
+#
+# Uso (dalla root del progetto):  pip install aiosmtpd && python benchmarks/bench_smtp.py
+
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import aiosmtplib
+from aiosmtpd.controller import Controller
+
+from app.email_utils import PoolSMTP, crea_messaggio, invia_messaggi
+
+HOST, PORT = "127.0.0.1", 8025
+N_MAIL = 1000
+CONFIGURAZIONI = [(1, 1), (5, 5), (10, 10), (20, 20)]  # (connessioni, concorrenza)
+
+
+class Sink:
+    def __init__(self):
+        self.ricevute = 0
+
+    async def handle_DATA(self, server, session, envelope):
+        self.ricevute += 1
+        return "250 OK"
+
+
+def messaggi(n):
+    return [
+        dict(destinatario=f"fornitore{i}@example.com", oggetto=f"Nuovo ordine #{i}",
+             corpo="- Prodotto x 1 = 1.00€\n" * 20, mittente="om@example.com")
+        for i in range(n)
+    ]
+
+
+async def sequenziale(n):
+    for m in messaggi(n):
+        await aiosmtplib.send(crea_messaggio(**m), hostname=HOST, port=PORT, start_tls=False)
+
+
+async def con_pool(n, connessioni, concorrenza):
+    async with PoolSMTP(hostname=HOST, port=PORT, username="", password="", start_tls=False,
+                        dimensione=connessioni) as pool:
+        esiti = await invia_messaggi(messaggi(n), pool, concorrenza=concorrenza)
+    errori = [e for e in esiti if e is not None]
+    assert not errori, errori[0]
+
+
+def misura(nome, coro, sink, n):
+    sink.ricevute = 0
+    t0 = time.perf_counter()
+    asyncio.run(coro)
+    secondi = time.perf_counter() - t0
+    assert sink.ricevute == n, (sink.ricevute, n)
+    print(f"{nome:<32} | {n / secondi:>9.0f} mail/s | {secondi:>6.2f} s")
+
+
+def main():
+    sink = Sink()
+    controller = Controller(sink, hostname=HOST, port=PORT)
+    controller.start()
+    try:
+        print(f"{N_MAIL} mail verso {HOST}:{PORT}")
+        misura("sequenziale, 1 connessione/mail", sequenziale(N_MAIL), sink, N_MAIL)
+        for connessioni, concorrenza in CONFIGURAZIONI:
+            misura(f"pool {connessioni} conn, concorrenza {concorrenza}",
+                   con_pool(N_MAIL, connessioni, concorrenza), sink, N_MAIL)
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+# genera_dataset.py
+#
+# Dataset sintetico per i test di carico: ristoranti, fornitori, prodotti,
+# visibilità, utenti e un anno di ordini inviati con stagionalità realistica
+# (giorno della settimana, mese, festività), poi i rollup dei report.
+#
+# Tutto con INSERT multipli Core in una sola transazione e id assegnati qui
+# (niente RETURNING, niente ORM); la password di tutti gli utenti è hashata una
+# volta sola. Stesso --seed e stessa --fine producono lo stesso dataset.
+# Con i default sono circa un milione di order_items.
+#
+# Uso:  python genera_dataset.py --reset --seed 42
+#       python genera_dataset.py --ristoranti 50 --prodotti 2000 --giorni 90
+
+import argparse
+import itertools
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, insert, select
+
+from app import catalogo, models, report
+from app.database import Base, SessionLocal, engine
+from app.utils import pwd_context
+
+LOTTO = 20000
+
+# categoria -> (articoli, varianti, formati, fascia di prezzo)
+CATEGORIE = {
+    "Ortofrutta": (
+        ["Pomodoro San Marzano", "Pomodorino ciliegino", "Zucchina", "Melanzana", "Insalata iceberg", "Rucola",
+         "Limone", "Arancia", "Mela Golden", "Patata", "Cipolla rossa", "Basilico", "Fragola", "Carciofo", "Funghi porcini"],
+        ["biologico", "IGP", "di stagione", "extra", "italiano"],
+        ["1 kg", "5 kg", "cassetta", "mazzo", "vaschetta 500 g"],
+        (0.8, 14.0),
+    ),
+    "Carne": (
+        ["Filetto di manzo", "Petto di pollo", "Salsiccia", "Guanciale", "Costata", "Macinato di vitello",
+         "Coscia di tacchino", "Prosciutto crudo", "Bresaola", "Spalla di maiale"],
+        ["nazionale", "DOP", "biologico", "frollato", "fresco"],
+        ["1 kg", "sottovuoto 500 g", "pezzo intero", "affettato 200 g"],
+        (6.0, 48.0),
+    ),
+    "Pesce": (
+        ["Filetto di salmone", "Orata", "Branzino", "Gamberi rossi", "Cozze", "Vongole veraci", "Polpo",
+         "Tonno pinna gialla", "Calamari", "Baccalà"],
+        ["fresco", "abbattuto", "pescato", "allevato", "decongelato"],
+        ["1 kg", "cassetta 5 kg", "sottovuoto 500 g", "retina 1 kg"],
+        (7.0, 60.0),
+    ),
+    "Latticini": (
+        ["Mozzarella di bufala", "Burrata", "Parmigiano Reggiano", "Pecorino romano", "Ricotta", "Mascarpone",
+         "Panna da cucina", "Burro", "Gorgonzola", "Fior di latte"],
+        ["DOP", "fresco", "stagionato 24 mesi", "di montagna", "senza lattosio"],
+        ["250 g", "1 kg", "forma intera", "confezione 6 pz"],
+        (2.0, 30.0),
+    ),
+    "Secco": (
+        ["Spaghetti", "Rigatoni", "Farina 00", "Riso Carnaroli", "Olio extravergine d'oliva", "Passata di pomodoro",
+         "Caffè in grani", "Zucchero", "Ceci", "Tonno sott'olio"],
+        ["trafilato al bronzo", "biologico", "professionale", "integrale", "classico"],
+        ["500 g", "1 kg", "5 kg", "latta 3 l", "cartone 12 pz"],
+        (1.0, 25.0),
+    ),
+    "Bevande": (
+        ["Acqua naturale", "Acqua frizzante", "Vino rosso", "Vino bianco", "Prosecco", "Birra artigianale",
+         "Succo d'arancia", "Chinotto", "Amaro", "Limoncello"],
+        ["DOC", "DOCG", "in vetro", "della casa", "riserva"],
+        ["75 cl", "cassa 6 bt", "fusto 20 l", "cassa 24 bt"],
+        (1.5, 40.0),
+    ),
+    "Attrezzatura": (
+        ["Tovaglioli", "Pellicola", "Guanti monouso", "Detergente", "Vaschette asporto", "Carta forno",
+         "Sacchi rifiuti", "Spugne"],
+        ["professionale", "compostabile", "extra resistente", "monouso", "ricarica"],
+        ["confezione 100 pz", "rotolo", "cartone", "tanica 5 l"],
+        (2.0, 35.0),
+    ),
+}
+CITTA = ["Milano", "Roma", "Napoli", "Torino", "Firenze", "Bologna", "Genova", "Palermo", "Bari", "Verona", "Venezia", "Trieste"]
+
+# domanda relativa: lunedì e giovedì si rifornisce, la domenica quasi nessuno
+SETTIMANA = (1.3, 0.95, 1.0, 1.25, 1.1, 0.75, 0.3)
+# gennaio ... dicembre: estate e dicembre alti, agosto in ferie
+MESI = (0.85, 0.85, 0.95, 1.0, 1.05, 1.15, 1.25, 0.8, 1.05, 1.0, 0.95, 1.2)
+# probabilità che un ristorante medio ordini in un giorno medio
+P_ORDINE = 0.8
+
+
+def stagionalita(giorno: date) -> float:
+    fattore = SETTIMANA[giorno.weekday()] * MESI[giorno.month - 1]
+    if (giorno.month, giorno.day) in ((1, 1), (12, 25), (12, 26), (8, 15)):
+        return fattore * 0.05
+    if giorno.month == 8 and 8 <= giorno.day <= 22:
+        fattore *= 0.5  # chiusure di ferragosto
+    elif giorno.month == 12 and 15 <= giorno.day <= 24:
+        fattore *= 1.4  # cene di Natale
+    return fattore
+
+
+def _prossimo_id(db, model) -> int:
+    return (db.scalar(select(func.max(model.id))) or 0) + 1
+
+
+def _inserisci(db, tabella, righe: list):
+    for i in range(0, len(righe), LOTTO):
+        db.execute(insert(tabella), righe[i:i + LOTTO])
+
+
+class Generatore:
+    def __init__(self, db, args):
+        self.db = db
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.conteggi = {}
+        # nomi ed email univoci anche se il DB ha già dati di un altro seed
+        self.tag = f"s{args.seed}"
+
+    def _scrivi(self, nome: str, tabella, righe: list):
+        _inserisci(self.db, tabella, righe)
+        self.conteggi[nome] = self.conteggi.get(nome, 0) + len(righe)
+
+    # -----------------------------
+    # Anagrafiche e catalogo
+    # -----------------------------
+    def fornitori(self):
+        rng = self.rng
+        categorie = list(CATEGORIE)
+        primo = _prossimo_id(self.db, models.Fornitore)
+        self.fornitori_categoria = []
+        righe = []
+        for i in range(self.args.fornitori):
+            categoria = categorie[i % len(categorie)]
+            id_ = primo + i
+            righe.append({
+                "id": id_,
+                "nome": f"{categoria} {rng.choice(CITTA)} {self.tag}-{i + 1}",
+                "email": f"fornitore{i + 1}@{self.tag}.dataset.example",
+            })
+            self.fornitori_categoria.append((id_, categoria))
+        self._scrivi("fornitori", models.Fornitore.__table__, righe)
+
+    def prodotti(self):
+        rng = self.rng
+        primo = _prossimo_id(self.db, models.Prodotto)
+        righe = []
+        self.prezzi = {}
+        for i in range(self.args.prodotti):
+            fornitore_id, categoria = self.fornitori_categoria[i % len(self.fornitori_categoria)]
+            articoli, varianti, formati, (minimo, massimo) = CATEGORIE[categoria]
+            nome = f"{rng.choice(articoli)} {rng.choice(varianti)} {rng.choice(formati)}"
+            # prezzi concentrati verso il basso della fascia
+            prezzo = round(minimo + (massimo - minimo) * rng.random() ** 2, 2)
+            id_ = primo + i
+            righe.append({
+                "id": id_,
+                "nome": nome,
+                "descrizione": f"{nome}, categoria {categoria.lower()}",
+                "prezzo": prezzo,
+                "sku": f"{categoria[:3].upper()}-{i + 1:06d}",
+                "fornitore_id": fornitore_id,
+            })
+            self.prezzi[id_] = prezzo
+        self._scrivi("prodotti", models.Prodotto.__table__, righe)
+
+        # popolarità a legge di Zipf: pochi prodotti fanno gran parte degli ordini
+        ids = list(self.prezzi)
+        rng.shuffle(ids)
+        self.popolarita = {id_: 1.0 / (rango + 1) ** 1.1 for rango, id_ in enumerate(ids)}
+
+    def ristoranti(self):
+        rng = self.rng
+        primo = _prossimo_id(self.db, models.Ristorante)
+        righe = []
+        self.ristoranti_ids = []
+        self.dimensione = {}
+        for i in range(self.args.ristoranti):
+            id_ = primo + i
+            righe.append({"id": id_, "nome": f"Ristorante {rng.choice(CITTA)} {self.tag}-{i + 1}", "abbonamento_attivo": True})
+            self.ristoranti_ids.append(id_)
+            # ristoranti grandi e piccoli: ordini più frequenti e più righe
+            self.dimensione[id_] = rng.lognormvariate(0, 0.35)
+        self._scrivi("ristoranti", models.Ristorante.__table__, righe)
+
+    def visibilita(self):
+        rng = self.rng
+        prodotti = list(self.prezzi)
+        quanti = max(1, round(len(prodotti) * self.args.densita))
+        righe = []
+        self.vetrine = {}
+        for rid in self.ristoranti_ids:
+            visibili = sorted(rng.sample(prodotti, quanti))
+            righe.extend({"ristorante_id": rid, "prodotto_id": p} for p in visibili)
+            # pesi cumulati per scegliere le righe degli ordini
+            self.vetrine[rid] = (visibili, list(itertools.accumulate(self.popolarita[p] for p in visibili)))
+        self._scrivi("product_visibility", models.product_visibility, righe)
+
+    def utenti(self):
+        rng = self.rng
+        ruoli = self._ruoli()
+        hashed = pwd_context.hash(self.args.password)  # uno solo per tutti
+        primo = _prossimo_id(self.db, models.User)
+        utenti, utente_ruolo, utente_ristorante = [], [], []
+        self.order_manager = {}
+
+        def nuovo(prefisso: str, n: int, ruolo: str, ristoranti: list) -> int:
+            id_ = primo + len(utenti)
+            utenti.append({"id": id_, "email": f"{prefisso}{n}@{self.tag}.dataset.example", "hashed_password": hashed, "is_active": True})
+            utente_ruolo.append({"user_id": id_, "ruolo_id": ruoli[ruolo]})
+            utente_ristorante.extend({"user_id": id_, "ristorante_id": r} for r in ristoranti)
+            return id_
+
+        n_om = itertools.count(1)
+        for rid in self.ristoranti_ids:
+            # un order manager, due nel 20% dei ristoranti
+            self.order_manager[rid] = [nuovo("om", next(n_om), "order_manager", [rid]) for _ in range(1 + (rng.random() < 0.2))]
+        # un window dresser ogni 25 ristoranti, un admin ogni 10
+        for n, i in enumerate(range(0, len(self.ristoranti_ids), 25), start=1):
+            nuovo("wd", n, "window_dresser", self.ristoranti_ids[i:i + 25])
+        for n, i in enumerate(range(0, len(self.ristoranti_ids), 10), start=1):
+            nuovo("admin", n, "admin", self.ristoranti_ids[i:i + 10])
+
+        self._scrivi("users", models.User.__table__, utenti)
+        self._scrivi("user_ruoli", models.user_ruoli, utente_ruolo)
+        self._scrivi("user_ristoranti", models.user_ristoranti, utente_ristorante)
+
+    def _ruoli(self) -> dict:
+        esistenti = dict(self.db.execute(select(models.Ruolo.ruolo, models.Ruolo.id)).all())
+        mancanti = [r for r in ("order_manager", "window_dresser", "admin", "superuser") if r not in esistenti]
+        if mancanti:
+            self.db.execute(insert(models.Ruolo.__table__), [{"nome": r.capitalize().replace("_", " "), "ruolo": r} for r in mancanti])
+            esistenti = dict(self.db.execute(select(models.Ruolo.ruolo, models.Ruolo.id)).all())
+        return esistenti
+
+    # -----------------------------
+    # Ordini
+    # -----------------------------
+    def ordini(self):
+        rng = self.rng
+        args = self.args
+        id_ordine = _prossimo_id(self.db, models.Ordine)
+        id_riga = _prossimo_id(self.db, models.OrderItem)
+        inizio = args.fine - timedelta(days=args.giorni - 1)
+        ordini, righe = [], []
+
+        for g in range(args.giorni):
+            giorno = inizio + timedelta(days=g)
+            stagione = stagionalita(giorno)
+            for rid in self.ristoranti_ids:
+                dimensione = self.dimensione[rid]
+                if rng.random() >= min(0.98, P_ORDINE * stagione * dimensione ** 0.5):
+                    continue
+                visibili, pesi = self.vetrine[rid]
+                n_righe = min(len(visibili), max(1, round(rng.gauss(args.righe * dimensione * stagione ** 0.5, 3))))
+                # estrazione pesata per popolarità, senza ripetere prodotti nello stesso ordine
+                scelti = dict.fromkeys(rng.choices(visibili, cum_weights=pesi, k=n_righe * 2))
+                totale = 0.0
+                for prodotto_id in itertools.islice(scelti, n_righe):
+                    quantita = min(50, 1 + int(rng.expovariate(1 / (3 * dimensione))))
+                    prezzo = self.prezzi[prodotto_id]
+                    righe.append({
+                        "id": id_riga, "ordine_id": id_ordine, "prodotto_id": prodotto_id,
+                        "quantita": quantita, "prezzo_unitario": prezzo,
+                    })
+                    id_riga += 1
+                    totale += quantita * prezzo
+                ora = datetime.combine(giorno, datetime.min.time()) + timedelta(minutes=rng.randint(6 * 60, 11 * 60))
+                ordini.append({
+                    "id": id_ordine, "user_id": rng.choice(self.order_manager[rid]), "ristorante_id": rid,
+                    "data_ordine": ora, "totale": round(totale, 2), "inviato": True,
+                })
+                id_ordine += 1
+
+            if len(righe) >= LOTTO * 5:
+                self._scrivi("ordini", models.Ordine.__table__, ordini)
+                self._scrivi("order_items", models.OrderItem.__table__, righe)
+                ordini, righe = [], []
+        self._scrivi("ordini", models.Ordine.__table__, ordini)
+        self._scrivi("order_items", models.OrderItem.__table__, righe)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera un dataset sintetico per i test di carico")
+    parser.add_argument("--ristoranti", type=int, default=200)
+    parser.add_argument("--fornitori", type=int, default=40)
+    parser.add_argument("--prodotti", type=int, default=5000)
+    parser.add_argument("--densita", type=float, default=0.3, help="frazione dei prodotti visibile a ogni ristorante")
+    parser.add_argument("--giorni", type=int, default=365, help="giorni di storico ordini fino a --fine")
+    parser.add_argument("--fine", type=date.fromisoformat, default=date.today() - timedelta(days=1), help="ultimo giorno (AAAA-MM-GG)")
+    parser.add_argument("--righe", type=float, default=20, help="righe medie per ordine")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--password", default="password123", help="password di tutti gli utenti generati")
+    parser.add_argument("--reset", action="store_true", help="svuota il DB prima (come reset_DB.py)")
+    args = parser.parse_args()
+
+    if args.reset:
+        from alembic import command
+        from alembic.config import Config
+
+        Base.metadata.drop_all(bind=engine)
+        Base.metadata.create_all(bind=engine)
+        command.stamp(Config("alembic.ini"), "head")
+
+    db = SessionLocal()
+    try:
+        generatore = Generatore(db, args)
+        inizio = time.perf_counter()
+        for fase in ("fornitori", "prodotti", "ristoranti", "visibilita", "utenti", "ordini"):
+            getattr(generatore, fase)()
+            print(f"{fase:12} {time.perf_counter() - inizio:6.1f} s")
+        catalogo.incrementa_versioni(db, "prodotti", "fornitori", "ristoranti", "visibilita")
+        db.commit()
+
+        report.ricostruisci_rollup(db)
+        print(f"{'rollup':12} {time.perf_counter() - inizio:6.1f} s")
+    finally:
+        db.close()
+
+    for tabella, n in generatore.conteggi.items():
+        print(f"{tabella:20} {n:>10}")
+
+
+if __name__ == "__main__":
+    main()
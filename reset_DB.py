@@ -1,8 +1,14 @@
 # reset_db.py
 
+from alembic import command
+from alembic.config import Config
+
 from app.database import Base, engine
 from app import models
 
 Base.metadata.drop_all(bind=engine)
 Base.metadata.create_all(bind=engine)
+
+# lo schema creato è già aggiornato: segna il DB all'ultima migrazione
+command.stamp(Config("alembic.ini"), "head")
 print("✅ Database resettato completamente.")
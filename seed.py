@@ -3,7 +3,7 @@
 from sqlalchemy.orm import Session
 from app.database import SessionLocal, engine
 from app import models
-from passlib.hash import bcrypt
+from app import password as password_pool
 
 def run_seed():
     db: Session = SessionLocal()
@@ -49,22 +49,26 @@ def run_seed():
         {"email": "superuser@email.com", "password": "superpassword", "ruoli": ["superuser"], "ristoranti": []},
     ]
 
-    for udata in utenti_data:
-        user = db.query(models.User).filter(models.User.email == udata["email"]).first()
-        if not user:
-            user = models.User(
-                email=udata["email"],
-                hashed_password=bcrypt.hash(udata["password"]),
-                is_active=True
-            )
-            # associa ruoli
-            user.ruoli = [get_ruolo(r) for r in udata["ruoli"]]
-            # associa ristoranti (many-to-many)
-            user.ristoranti = udata["ristoranti"]
-            db.add(user)
+    # hash delle password mancanti calcolati in parallelo sul pool di processi
+    esistenti = {email for (email,) in db.query(models.User.email)}
+    nuovi = [u for u in utenti_data if u["email"] not in esistenti]
+    hash_nuovi = password_pool.calcola_hash_molti([u["password"] for u in nuovi])
+
+    for udata, hashed in zip(nuovi, hash_nuovi):
+        user = models.User(
+            email=udata["email"],
+            hashed_password=hashed,
+            is_active=True
+        )
+        # associa ruoli
+        user.ruoli = [get_ruolo(r) for r in udata["ruoli"]]
+        # associa ristoranti (many-to-many)
+        user.ristoranti = udata["ristoranti"]
+        db.add(user)
 
     db.commit()
     db.close()
+    password_pool.chiudi()
 
 if __name__ == "__main__":
     run_seed()
@@ -0,0 +1,101 @@
+# tests/conftest.py
+#
+# Il DB dei test è un file SQLite temporaneo: DATABASE_URL va impostato prima
+# che qualunque test importi app (app.database crea gli engine all'import).
+
+import os
+import tempfile
+
+import pytest
+
+_CARTELLA = tempfile.mkdtemp(prefix="ecommerce_test_")
+os.environ["DATABASE_URL"] = f"sqlite:///{_CARTELLA}/test.db"
+os.environ["SCHEDULER_ATTIVO"] = "0"
+# login veloci: costo bcrypt minimo e un solo processo nel pool delle password
+os.environ["BCRYPT_ROUNDS"] = "4"
+os.environ["PASSWORD_PROCESSI"] = "1"
+
+
+@pytest.fixture(autouse=True)
+def budget_stretto(monkeypatch):
+    # in tutta la suite un endpoint oltre il proprio budget_query fa fallire il test
+    from app import statistiche_sql
+
+    monkeypatch.setattr(statistiche_sql, "SQL_BUDGET_STRETTO", True)
+
+
+@pytest.fixture(scope="session")
+def schema():
+    from app import models  # noqa: F401  registra le tabelle su Base
+    from app.database import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    yield
+    engine.dispose()
+
+
+@pytest.fixture
+def db(schema):
+    from app.database import SessionLocal
+
+    sessione = SessionLocal()
+    try:
+        yield sessione
+    finally:
+        sessione.close()
+
+
+# Un ristorante con 200 prodotti visibili (da 20 fornitori) e il suo order manager
+N_PRODOTTI = 200
+PASSWORD = "password123"
+
+
+@pytest.fixture(scope="session")
+def dati_ordini(schema):
+    from sqlalchemy import insert
+
+    from app import catalogo, models
+    from app.database import SessionLocal
+    from app.utils import hash_password
+
+    db = SessionLocal()
+    try:
+        fornitori = [models.Fornitore(nome=f"Fornitore budget {i}", email=f"f{i}@budget.example") for i in range(20)]
+        prodotti = [
+            models.Prodotto(nome=f"Prodotto budget {i}", prezzo=1.0 + i % 7, fornitore=fornitori[i % len(fornitori)])
+            for i in range(N_PRODOTTI)
+        ]
+        ristorante = models.Ristorante(nome="Ristorante budget")
+        ruolo = db.query(models.Ruolo).filter_by(ruolo="order_manager").first()
+        if ruolo is None:
+            ruolo = models.Ruolo(nome="Order manager", ruolo="order_manager")
+        utente = models.User(email="om@budget.example", hashed_password=hash_password(PASSWORD), is_active=True)
+        utente.ruoli = [ruolo]
+        utente.ristoranti = [ristorante]
+        db.add_all(fornitori + prodotti + [ristorante, utente])
+        db.flush()
+        db.execute(insert(models.product_visibility), [
+            {"ristorante_id": ristorante.id, "prodotto_id": p.id} for p in prodotti
+        ])
+        catalogo.incrementa_versioni(db, "prodotti", "fornitori", "ristoranti", "visibilita")
+        db.commit()
+        return ristorante.id, [p.id for p in prodotti]
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def client_order_manager(dati_ordini, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    from app import orari
+    from app.main import app
+
+    # gli ordini si possono modificare a qualunque ora del giorno in cui gira il test
+    monkeypatch.setattr(orari, "cutoff_superato", lambda *_: False)
+    with TestClient(app) as c:
+        risposta = c.post("/login", data={"email": "om@budget.example", "password": PASSWORD}, follow_redirects=False)
+        assert risposta.status_code == 302
+        # il principal in cache (app/dependencies.py): la prima richiesta lo carica
+        assert c.get("/ordini/ristoranti_miei").status_code == 200
+        yield c
@@ -0,0 +1,54 @@
+# tests/test_budget_query.py
+#
+# Le query degli endpoint con budget_query non devono crescere con i dati: un
+# carrello da 200 righe costa quanto uno da una riga, e la lista prodotti non fa
+# una query per fornitore. Il budget è verificato in modalità stretta
+# (conftest.py): superarlo fa fallire la richiesta.
+
+def _query(risposta) -> int:
+    assert risposta.status_code == 200, risposta.text
+    return int(risposta.headers["x-query-count"])
+
+
+def _svuota(client, ristorante_id, prodotto_ids):
+    righe = [{"prodotto_id": p, "quantita": 0} for p in prodotto_ids]
+    _query(client.put(f"/ordini/order_manager/order_aggregato?ristorante_id={ristorante_id}", json=righe))
+
+
+def test_post_ordine_costante_nelle_righe(client_order_manager, dati_ordini):
+    ristorante_id, prodotto_ids = dati_ordini
+    conteggi = []
+    for n in (1, len(prodotto_ids)):
+        righe = [{"prodotto_id": p, "quantita": 2} for p in prodotto_ids[:n]]
+        conteggi.append(_query(client_order_manager.post("/ordini/", json={"ristorante_id": ristorante_id, "righe": righe})))
+        _svuota(client_order_manager, ristorante_id, prodotto_ids[:n])
+    assert conteggi[0] == conteggi[1]
+
+
+def test_put_ordine_costante_nelle_righe(client_order_manager, dati_ordini):
+    ristorante_id, prodotto_ids = dati_ordini
+    conteggi = []
+    for n in (1, len(prodotto_ids)):
+        righe = [{"prodotto_id": p, "quantita": 1} for p in prodotto_ids[:n]]
+        _query(client_order_manager.post("/ordini/", json={"ristorante_id": ristorante_id, "righe": righe}))
+        modifica = [{"prodotto_id": p, "quantita": 3} for p in prodotto_ids[:n]]
+        conteggi.append(_query(client_order_manager.put(f"/ordini/order_manager/order_aggregato?ristorante_id={ristorante_id}", json=modifica)))
+        _svuota(client_order_manager, ristorante_id, prodotto_ids[:n])
+    assert conteggi[0] == conteggi[1]
+
+
+def test_carrello_letto_con_query_costanti(client_order_manager, dati_ordini):
+    ristorante_id, prodotto_ids = dati_ordini
+    conteggi = []
+    for n in (1, len(prodotto_ids)):
+        righe = [{"prodotto_id": p, "quantita": 1} for p in prodotto_ids[:n]]
+        _query(client_order_manager.post("/ordini/", json={"ristorante_id": ristorante_id, "righe": righe}))
+        conteggi.append(_query(client_order_manager.get(f"/ordini/order_manager/order_aggregato?ristorante_id={ristorante_id}")))
+        _svuota(client_order_manager, ristorante_id, prodotto_ids[:n])
+    assert conteggi[0] == conteggi[1]
+
+
+def test_lista_prodotti_costante_nei_fornitori(client_order_manager, dati_ordini):
+    _, prodotto_ids = dati_ordini
+    conteggi = [_query(client_order_manager.get(f"/prodotti/?limit={n}")) for n in (1, len(prodotto_ids))]
+    assert conteggi[0] == conteggi[1]
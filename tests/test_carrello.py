@@ -0,0 +1,56 @@
+# tests/test_carrello.py
+
+import itertools
+
+import pytest
+
+from app import carrello, models
+
+_n = itertools.count()
+
+
+@pytest.fixture
+def ristorante_e_utente(db):
+    n = next(_n)
+    ristorante = models.Ristorante(nome=f"Ristorante carrello {n}")
+    utente = models.User(email=f"om{n}@carrello.example", hashed_password="-", is_active=True)
+    prodotti = [models.Prodotto(nome=f"Prodotto carrello {i}", prezzo=2.5) for i in range(2)]
+    db.add_all([ristorante, utente, *prodotti])
+    db.commit()
+    return ristorante.id, utente.id, [p.id for p in prodotti]
+
+
+def _righe(db, ordine_id):
+    return dict(
+        db.query(models.OrderItem.prodotto_id, models.OrderItem.quantita)
+        .filter(models.OrderItem.ordine_id == ordine_id)
+    )
+
+
+def test_aggiunte_sommate_e_riga_azzerata(db, ristorante_e_utente):
+    ristorante_id, user_id, (p1, p2) = ristorante_e_utente
+    prezzi = {p1: 2.5, p2: 2.5}
+    ordine_id = carrello.aggiungi_righe(db, user_id, ristorante_id, {p1: 2, p2: 1}, prezzi)
+    carrello.aggiungi_righe(db, user_id, ristorante_id, {p1: 3}, prezzi)
+    db.commit()
+    assert _righe(db, ordine_id) == {p1: 5, p2: 1}
+
+    # una variazione oltre la quantità presente toglie la riga e solo il suo importo
+    carrello.aggiungi_righe(db, user_id, ristorante_id, {p1: -7}, prezzi)
+    db.commit()
+    assert _righe(db, ordine_id) == {p2: 1}
+    assert db.get(models.Ordine, ordine_id, populate_existing=True).totale == pytest.approx(2.5)
+
+    # l'ultima riga a zero elimina il carrello
+    assert carrello.aggiungi_righe(db, user_id, ristorante_id, {p2: -1}, prezzi) is None
+    db.commit()
+    assert db.get(models.Ordine, ordine_id) is None
+
+
+def test_nota_ripetuta_non_cresce(db, ristorante_e_utente):
+    ristorante_id, user_id, (p1, _) = ristorante_e_utente
+    for _ in range(3):
+        ordine_id = carrello.aggiungi_righe(db, user_id, ristorante_id, {p1: 1}, {p1: 2.5}, note="Consegna sul retro")
+    carrello.aggiungi_righe(db, user_id, ristorante_id, {p1: 1}, {p1: 2.5}, note="Fattura a parte")
+    db.commit()
+    assert db.get(models.Ordine, ordine_id).note == "Consegna sul retro; Fattura a parte"
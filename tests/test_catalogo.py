@@ -0,0 +1,41 @@
+# tests/test_catalogo.py
+#
+# Richieste condizionali sulle GET del catalogo: l'ETag decide da solo quando
+# c'è If-None-Match, e una data di modifica nel secondo in corso non fa da
+# validatore (un'altra scrittura nello stesso secondo avrebbe la stessa data).
+
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+from fastapi import Request
+
+from app.catalogo import Validatori
+
+
+def _richiesta(**intestazioni) -> Request:
+    headers = [(k.replace("_", "-").encode(), v.encode()) for k, v in intestazioni.items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_if_none_match_decide_da_solo():
+    ieri = datetime.utcnow().replace(microsecond=0) - timedelta(days=1)
+    v = Validatori({"prodotti": 2}, ieri)
+    assert not v.non_modificato(_richiesta(if_none_match='"prodotti.1"', if_modified_since=v.intestazioni()["Last-Modified"]))
+    assert v.non_modificato(_richiesta(if_none_match=v.etag, if_modified_since="Mon, 01 Jan 2001 00:00:00 GMT"))
+
+
+def test_if_modified_since_con_la_data_ricevuta():
+    ieri = datetime.utcnow().replace(microsecond=0) - timedelta(days=1)
+    v = Validatori({"prodotti": 2}, ieri)
+    copia = v.intestazioni()["Last-Modified"]
+    assert v.non_modificato(_richiesta(if_modified_since=copia))
+    # scrittura successiva: la data cambia e la copia non è più valida
+    assert not Validatori({"prodotti": 3}, ieri + timedelta(seconds=1)).non_modificato(_richiesta(if_modified_since=copia))
+
+
+def test_scrittura_nel_secondo_in_corso():
+    adesso = datetime.utcnow().replace(microsecond=0)
+    v = Validatori({"prodotti": 2}, adesso)
+    # niente Last-Modified da rimandare, e nessun 304 per una data dello stesso secondo
+    assert "Last-Modified" not in v.intestazioni()
+    assert not v.non_modificato(_richiesta(if_modified_since=format_datetime(adesso.replace(tzinfo=timezone.utc), usegmt=True)))
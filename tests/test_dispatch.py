@@ -0,0 +1,97 @@
+# tests/test_dispatch.py
+#
+# Gli ordini diventano inviati alla creazione del run: una partizione che
+# esaurisce i tentativi non deve lasciarli senza mail per sempre.
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import dispatch, models, outbox
+
+
+@pytest.fixture
+def ordini_aperti(db):
+    fornitori = [models.Fornitore(nome=f"Fornitore dispatch {i}", email=f"f{i}@dispatch.example") for i in range(3)]
+    prodotti = [models.Prodotto(nome=f"Prodotto dispatch {i}", prezzo=2.0, fornitore=f) for i, f in enumerate(fornitori)]
+    ristoranti = [models.Ristorante(nome=f"Ristorante dispatch {i}") for i in range(2)]
+    utenti = [models.User(email=f"om{i}@dispatch.example", hashed_password="-", is_active=True) for i in range(2)]
+    db.add_all(fornitori + prodotti + ristoranti + utenti)
+    db.flush()
+    for ristorante, utente in zip(ristoranti, utenti):
+        ordine = models.Ordine(user_id=utente.id, ristorante_id=ristorante.id, data_ordine=datetime.utcnow(), totale=6.0, inviato=False)
+        db.add(ordine)
+        db.flush()
+        db.add_all([
+            models.OrderItem(ordine_id=ordine.id, prodotto_id=p.id, quantita=1, prezzo_unitario=p.prezzo)
+            for p in prodotti
+        ])
+    db.commit()
+    return [r.id for r in ristoranti], [f.id for f in fornitori]
+
+
+@pytest.fixture(autouse=True)
+def senza_smtp(monkeypatch):
+    async def svuota_outbox(**_):
+        return None
+    monkeypatch.setattr(outbox, "svuota_outbox", svuota_outbox)
+
+
+def _mail_fornitori(db, run_id):
+    return db.query(models.EmailOutbox).filter(models.EmailOutbox.chiave.like(f"fornitore:%:{run_id}")).count()
+
+
+def test_partizione_fallita_ripresa_dopo_la_chiusura(db, ordini_aperti, monkeypatch):
+    ristorante_ids, fornitore_ids = ordini_aperti
+    processa = dispatch.processa_partizione
+
+    def fallisce_per_i_fornitori(db, partizione):
+        if partizione.tipo == dispatch.FORNITORI:
+            raise RuntimeError("rendering fallito")
+        return processa(db, partizione)
+
+    monkeypatch.setattr(dispatch, "processa_partizione", fallisce_per_i_fornitori)
+    riepilogo = dispatch.esegui_dispatch(workers=1, n_partizioni=2, ristorante_ids=ristorante_ids)
+    run_id = riepilogo["run_id"]
+    assert riepilogo["stato"] == "con_errori"
+    assert _mail_fornitori(db, run_id) == 0
+
+    monkeypatch.setattr(dispatch, "processa_partizione", processa)
+    # prima del backoff il run resta chiuso
+    assert dispatch.riprendi_run_con_errori(db) == []
+    dopo = datetime.utcnow() + timedelta(minutes=dispatch.DISPATCH_RIPRESA_MINUTI + 1)
+    assert dispatch.riprendi_run_con_errori(db, adesso=dopo) == [run_id]
+    # un secondo nodo non lo riapre di nuovo
+    assert dispatch.riprendi_run_con_errori(db, adesso=dopo) == []
+
+    dispatch.lavora(run_id)
+    run = db.get(models.DispatchRun, run_id, populate_existing=True)
+    assert run.stato == "completato"
+    assert _mail_fornitori(db, run_id) == len(fornitore_ids)
+
+
+def test_orario_fornitore_per_ristorante():
+    from datetime import date, time
+
+    from app import orari
+
+    def orario(ora):
+        return orari.Orario(time(ora - 1), time(ora), "Europe/Rome")
+
+    tabella = {
+        (None, 7): orario(17),  # il fornitore, per tutti
+        (1, 7): orario(18),     # il fornitore, solo per il ristorante 1
+        (2, None): orario(16),  # il ristorante 2 ha il suo orario: vince su (-, fornitore)
+    }
+    per_fornitore = {7: {"nome": "Fornitore", "email": "f@example.com", "ristoranti": {
+        rid: {"nome": f"R{rid}", "referenti": {"om@example.com"}, "ordini": {rid}, "righe": {}}
+        for rid in (1, 2, 3)
+    }}}
+    messaggi = dispatch.messaggi_fornitori(per_fornitore, date.today(), 1, tabella)
+    momenti = {m["corpo"].split("\n")[2].split(" ")[0]: m["prossimo_tentativo"] for m in messaggi}
+    assert momenti == {
+        "R1": orari.momento_invio(orario(18)),
+        "R2": None,
+        "R3": orari.momento_invio(orario(17)),
+    }
+    assert len({m["chiave"] for m in messaggi}) == 3
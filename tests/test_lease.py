@@ -0,0 +1,80 @@
+# tests/test_lease.py
+#
+# Più processi, un solo file SQLite (il DB dei test, vedi conftest.py): il lease
+# di un job lo prende uno solo, e quando chi lo detiene muore senza rilasciarlo
+# un altro subentra alla scadenza. Processi spawn come i worker uvicorn: ognuno
+# ha il suo PROPRIETARIO e il suo engine (DATABASE_URL arriva dall'ambiente).
+
+import multiprocessing
+import os
+import time
+
+NOME = "invia_ordini"
+# scadenza del lease del processo che muore: la si aspetta dal momento in cui
+# l'ha preso, non dall'avvio dei processi (lo spawn costa secondi)
+DURATA = 3
+ATTESA_MASSIMA = 60
+
+
+def _prova_lease(barriera, esiti, fine):
+    from app.lease import PROPRIETARIO, lease
+
+    barriera.wait()
+    with lease(NOME) as l:
+        esiti.put((PROPRIETARIO, l is not None))
+        if l:
+            # tiene il lease finché il test non ha raccolto tutti i tentativi
+            fine.wait(ATTESA_MASSIMA)
+
+
+def _prendi_e_muori(esiti):
+    from app.lease import PROPRIETARIO, lease
+
+    with lease(NOME, durata=DURATA) as l:
+        esiti.put((PROPRIETARIO, time.time()))
+        esiti.close()
+        esiti.join_thread()
+        # niente rilascio e niente heartbeat: come un processo ucciso
+        os._exit(0)
+
+
+def _contendi(quanti: int) -> list:
+    """Avvia quanti processi che provano insieme a prendere il lease; [(proprietario, preso)]."""
+    ctx = multiprocessing.get_context("spawn")
+    barriera, esiti, fine = ctx.Barrier(quanti), ctx.Queue(), ctx.Event()
+    processi = [ctx.Process(target=_prova_lease, args=(barriera, esiti, fine)) for _ in range(quanti)]
+    for p in processi:
+        p.start()
+    try:
+        risultato = [esiti.get(timeout=ATTESA_MASSIMA) for _ in processi]
+    finally:
+        fine.set()
+        for p in processi:
+            p.join(ATTESA_MASSIMA)
+    assert all(p.exitcode == 0 for p in processi)
+    return risultato
+
+
+def test_un_solo_processo_prende_il_lease(schema):
+    esiti = _contendi(3)
+    assert [preso for _, preso in esiti].count(True) == 1
+
+
+def test_lease_scaduto_passa_a_un_altro_processo(schema):
+    from app import lease
+
+    ctx = multiprocessing.get_context("spawn")
+    esiti = ctx.Queue()
+    morto = ctx.Process(target=_prendi_e_muori, args=(esiti,))
+    morto.start()
+    proprietario_morto, preso_alle = esiti.get(timeout=ATTESA_MASSIMA)
+    morto.join(ATTESA_MASSIMA)
+
+    # ancora valido: questo processo non lo prende
+    assert time.time() - preso_alle < DURATA
+    assert not lease.acquisisci(NOME)
+
+    time.sleep(max(0.0, preso_alle + DURATA + 0.5 - time.time()))
+    subentrati = [p for p, preso in _contendi(3) if preso]
+    assert len(subentrati) == 1
+    assert subentrati[0] != proprietario_morto
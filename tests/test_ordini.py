@@ -0,0 +1,34 @@
+# tests/test_ordini.py
+#
+# Dopo il cutoff il carrello aperto non si modifica né con la POST né con la
+# PUT: l'ordine può essere già in invio ai fornitori.
+
+from app import orari
+
+MESSAGGIO_CUTOFF = "Gli ordini possono essere modificati solo fino alle"
+
+
+def test_cutoff_vale_anche_per_la_put(client_order_manager, dati_ordini, monkeypatch):
+    ristorante_id, prodotto_ids = dati_ordini
+    url_carrello = f"/ordini/order_manager/order_aggregato?ristorante_id={ristorante_id}"
+    riga = {"prodotto_id": prodotto_ids[0], "quantita": 1}
+    risposta = client_order_manager.post("/ordini/", json={"ristorante_id": ristorante_id, "righe": [riga]})
+    assert risposta.status_code == 200, risposta.text
+
+    monkeypatch.setattr(orari, "cutoff_superato", lambda *_: True)
+    try:
+        risposta = client_order_manager.put(url_carrello, json=[{"prodotto_id": prodotto_ids[0], "quantita": 5}])
+        assert risposta.status_code == 403
+        assert risposta.json()["detail"].startswith(MESSAGGIO_CUTOFF)
+
+        risposta = client_order_manager.post("/ordini/", json={"ristorante_id": ristorante_id, "righe": [riga]})
+        assert risposta.status_code == 403
+        assert risposta.json()["detail"].startswith(MESSAGGIO_CUTOFF)
+    finally:
+        monkeypatch.setattr(orari, "cutoff_superato", lambda *_: False)
+
+    # la riga è rimasta com'era
+    righe = client_order_manager.get(url_carrello).json()["righe"]
+    assert [(r["prodotto_id"], r["quantita"]) for r in righe] == [(prodotto_ids[0], 1)]
+    risposta = client_order_manager.put(url_carrello, json=[{"prodotto_id": prodotto_ids[0], "quantita": 0}])
+    assert risposta.status_code == 200, risposta.text
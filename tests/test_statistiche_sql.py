@@ -0,0 +1,83 @@
+# tests/test_statistiche_sql.py
+#
+# MiddlewareQuery con SQL_BUDGET_STRETTO: una richiesta oltre il budget di query
+# deve fallire prima che la risposta arrivi al client.
+
+import pytest
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from app import statistiche_sql
+from app.database import crea_engine
+from app.statistiche_sql import BudgetQuerySuperato, MiddlewareQuery, budget_query
+
+
+@pytest.fixture
+def client(tmp_path):
+    engine = crea_engine(f"sqlite:///{tmp_path / 'budget.db'}")
+    Sessione = sessionmaker(bind=engine)
+
+    def get_db():
+        db = Sessione()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app = FastAPI()
+    app.add_middleware(MiddlewareQuery)
+
+    @app.get("/query/{n}")
+    @budget_query(3)
+    def esegui(n: int, db=Depends(get_db)):
+        for _ in range(n):
+            db.execute(text("SELECT 1"))
+        return {"query": n}
+
+    @app.get("/manca/{n}")
+    @budget_query(3)
+    def manca(n: int, db=Depends(get_db)):
+        for _ in range(n):
+            db.execute(text("SELECT 1"))
+        raise HTTPException(status_code=404, detail="Non trovato")
+
+    with TestClient(app) as c:
+        yield c
+    engine.dispose()
+
+
+@pytest.fixture
+def stretto(monkeypatch):
+    # già attiva per tutta la suite (conftest.py): qui resta esplicito
+    monkeypatch.setattr(statistiche_sql, "SQL_BUDGET_STRETTO", True)
+
+
+def test_entro_il_budget(client, stretto):
+    risposta = client.get("/query/3")
+    assert risposta.status_code == 200
+    assert risposta.headers["x-query-count"] == "3"
+
+
+def test_oltre_il_budget_fallisce(client, stretto):
+    with pytest.raises(BudgetQuerySuperato, match="4 query, budget 3"):
+        client.get("/query/4")
+
+
+def test_oltre_il_budget_senza_eccezioni_del_server_risponde_500(client, stretto):
+    client = TestClient(client.app, raise_server_exceptions=False)
+    assert client.get("/query/4").status_code == 500
+
+
+def test_oltre_il_budget_anche_con_errore_http(client, stretto):
+    with pytest.raises(BudgetQuerySuperato):
+        client.get("/manca/5")
+
+
+def test_non_stretto_avvisa_soltanto(client, caplog, monkeypatch):
+    monkeypatch.setattr(statistiche_sql, "SQL_BUDGET_STRETTO", False)
+    risposta = client.get("/query/6")
+    assert risposta.status_code == 200
+    assert risposta.headers["x-query-n1"] == "1"
+    assert "Budget di query superato" in caplog.text